@@ -4,197 +4,464 @@ Web-based Video Downloader
 A Flask web application to download videos from any URL
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, Response
+from flask import Flask, render_template, request, jsonify, Response
+import json
 import subprocess
 import os
+import re
+import shutil
 import uuid
 from pathlib import Path
 import threading
 import time
+import signal
+import hmac
+from collections import deque
+from contextlib import closing
+
+from hls_engine import HLSError, is_hls_url
+from engine import (Download, DownloadCancelled, DownloadError, ytdlp_info_command,
+                    ytdlp_stream_command)
+from stream_remux import ChunkSizer, HLSStream, drain, stop_process
+from stream_stats import StreamStats
+from scheduler import DownloadScheduler
+from download_cache import DownloadCache, cache_key
+from probe_cache import ProbeCache
+from job_events import JobEvents
+from job_store import open_job_store
+from file_serving import container_suffix, send_media, SENDFILE_MODE
+from progress import ProgressThrottle, format_progress
+from scraper import extract_video_url, is_direct_media_url, scan_page
+from source_picker import SourcePicker
+from tee import TeeRegistry
+from quality import (BitrateBudget, expected_size, format_id, max_height, normalize_quality,
+                     pick_variant, ytdlp_format)
+from janitor import Janitor
+from metrics import Registry, THROUGHPUT_BUCKETS
+from profiler import RequestProfiler
+from batch import BatchManager
+from bandwidth import DOWNLOAD, STREAM, Shaper, shaped
+from zip_stream import ZipArchive, unique_names
+import checkpoint
 
 app = Flask(__name__)
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching (media files set their own max-age)
+app.config['USE_X_SENDFILE'] = SENDFILE_MODE == 'x-sendfile'  # Let Apache/lighttpd send the bytes
+
+DOWNLOAD_DIR = Path("/tmp/downloads")  # Use /tmp on Render (writable)
+DOWNLOAD_DIR.mkdir(exist_ok=True, parents=True)
 
 # Store download status and processes
-downloads = {}
-download_processes = {}  # Store subprocess objects for cancellation
+# JOB_STORE=sqlite shares records between gunicorn workers on this host
+downloads = open_job_store(os.environ.get('JOB_STORE'), DOWNLOAD_DIR)
+download_processes = {}  # Store subprocess objects for cancellation (local to this worker)
 download_threads = {}  # Store thread objects
+download_locks = {}  # Job directory locks held by this worker (see checkpoint.claim)
+job_events = JobEvents()  # Wakes /events streams when a download changes
+CONTROL_POLL_INTERVAL = 0.5  # How often a worker checks the store for pause/resume/cancel
 
-DOWNLOAD_DIR = Path("/tmp/downloads")  # Use /tmp on Render (writable)
-DOWNLOAD_DIR.mkdir(exist_ok=True, parents=True)
+# Progress is written to the job record at most once per interval
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', '0.25'))
+
+# Parallel segment fetches per job for the in-process HLS engine
+HLS_CONCURRENCY = int(os.environ.get('HLS_CONCURRENCY', '8'))
+
+# Parallel range requests per job for direct .mp4 URLs
+DIRECT_CONNECTIONS = int(os.environ.get('DIRECT_CONNECTIONS', '8'))
+
+# Summed bitrate of running downloads; over it, new jobs pick lower variants (0 = off)
+bitrate_budget = BitrateBudget(int(float(os.environ.get('BANDWIDTH_BUDGET_MBPS', '0')) * 1000 * 1000))
+
+# Finished files are shared between requests for the same media + format
+download_cache = DownloadCache(
+    DOWNLOAD_DIR / 'cache',
+    max_bytes=int(os.environ.get('CACHE_MAX_BYTES', str(2 * 1024 ** 3))),
+    ttl=int(os.environ.get('CACHE_TTL', str(24 * 3600)))
+)
+
+# Batches (URL lists and playlists) of ordinary jobs, BATCH_PARALLEL at a time each
+batches = open_job_store(os.environ.get('JOB_STORE'), DOWNLOAD_DIR, table='batches')
+
+# Expires finished files and job records, and checks free space before admitting a job
+janitor = Janitor(
+    DOWNLOAD_DIR, downloads, download_cache,
+    interval=int(os.environ.get('JANITOR_INTERVAL', '300')),
+    job_retention=int(os.environ.get('JOB_RETENTION', str(24 * 3600))),
+    user_quota=int(os.environ.get('USER_QUOTA_BYTES', '0')),
+    min_free=int(os.environ.get('DISK_MIN_FREE_BYTES', str(256 * 1024 * 1024))),
+    batches=batches,
+    events=job_events
+)
+# Files fetched again within this many seconds don't rewrite the job record
+FETCH_TOUCH_INTERVAL = 60
+
+# /check-formats results, optionally persisted across restarts with PROBE_CACHE_DIR
+probe_cache = ProbeCache(
+    ttl=int(os.environ.get('PROBE_CACHE_TTL', '600')),
+    max_entries=int(os.environ.get('PROBE_CACHE_SIZE', '512')),
+    disk_dir=os.environ.get('PROBE_CACHE_DIR') or None
+)
+
+# Which mirror won the probe for each site, so repeat pages skip probing
+source_picker = SourcePicker(ttl=int(os.environ.get('SOURCE_CACHE_TTL', '3600')))
+
+# All server-side downloads run through one bounded pool
+scheduler = DownloadScheduler(
+    workers=int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', '4')),
+    connections_per_host=int(os.environ.get('MAX_CONNECTIONS_PER_HOST', '16')),
+    connections_per_job=int(os.environ.get('CONNECTIONS_PER_JOB', '16')),
+    order=os.environ.get('QUEUE_ORDER', 'fifo')
+)
+
+# Tee mode: /stream fetches each video once, writing it to disk while it's
+# sent; requests for the same video meanwhile read along behind the writer,
+# and a complete file goes into the download cache for everyone after
+STREAM_CACHE = os.environ.get('STREAM_CACHE', '0') == '1'
+tees = TeeRegistry(DOWNLOAD_DIR)  # Per worker process
+stream_stats = StreamStats()  # Active /stream responses and bytes/s
+
+# Each open stream holds a server thread (or greenlet); past this many, new
+# ones get 503 so pages and status polls are still served (0 = no limit;
+# gunicorn.conf.py derives it from the thread count)
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS', '0'))
+
+# Bandwidth shaping in bytes/s (0 = no limit): a global cap shared by weight,
+# streams first, and caps per download job and per stream; adjustable at
+# runtime through /admin/bandwidth (per worker process)
+bandwidth = Shaper(
+    rate=int(os.environ.get('BANDWIDTH_LIMIT', '0')),
+    caps={DOWNLOAD: int(os.environ.get('DOWNLOAD_RATE_LIMIT', '0')),
+          STREAM: int(os.environ.get('STREAM_RATE_LIMIT', '0'))},
+    weights={DOWNLOAD: float(os.environ.get('DOWNLOAD_WEIGHT', '1')),
+             STREAM: float(os.environ.get('STREAM_WEIGHT', '4'))}
+)
+
+# Bearer token for /admin endpoints (unset = they're off)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# yt-dlp probes (/check-formats) running at once; others wait up to PROBE_WAIT seconds, then get 503
+probe_slots = threading.BoundedSemaphore(int(os.environ.get('MAX_CONCURRENT_PROBES', '4')))
+PROBE_WAIT = 10
+
+# Prometheus-style /metrics (per worker process)
+metrics = Registry()
+jobs_by_status = metrics.gauge('downloader_jobs', 'Job records by status', ['status'])
+queue_depth = metrics.gauge('downloader_queue_depth', 'Scheduler jobs waiting or running', ['state'])
+downloaded_bytes = metrics.counter('downloader_downloaded_bytes_total', 'Bytes of finished server-side downloads')
+served_bytes = metrics.counter('downloader_served_bytes_total', 'Bytes sent to clients', ['route'])
+job_throughput = metrics.histogram('downloader_job_throughput_bytes_per_second',
+                                   'Average speed of finished server-side downloads', buckets=THROUGHPUT_BUCKETS)
+extractor_seconds = metrics.histogram('downloader_extractor_seconds', 'yt-dlp format probe time for /check-formats')
+spawn_seconds = metrics.histogram('downloader_subprocess_first_output_seconds',
+                                  'Time from spawning yt-dlp to its first output', ['kind'])
+cache_requests = metrics.counter('downloader_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+cache_bytes = metrics.gauge('downloader_cache_bytes', 'Bytes of finished files in the download cache')
+disk_bytes = metrics.gauge('downloader_disk_bytes', 'Space on the download volume', ['state'])
+active_streams = metrics.gauge('downloader_active_streams', 'Open /stream responses', ['kind'])
+stream_rate = metrics.gauge('downloader_stream_bytes_per_second', '/stream throughput over the last 10 s')
+
+# Opt-in cProfile sampling of request handlers (PROFILE_SAMPLE_RATE=0.01 profiles 1%)
+profiler = RequestProfiler(float(os.environ.get('PROFILE_SAMPLE_RATE', '0')))
+profiler.init_app(app)
+
+# /events pushes at most one update per job per interval, plus a heartbeat
+EVENTS_MIN_INTERVAL = float(os.environ.get('EVENTS_MIN_INTERVAL', '0.5'))
+EVENTS_HEARTBEAT = 15
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+RESERVATION_FIELDS = {'expected_bytes', 'downloaded_bytes', 'status'}  # Fields the janitor's disk reservation follows
+
+def update_job(download_id, **fields):
+    """Apply changes to a download entry and wake any progress streams"""
+    downloads.update(download_id, fields)
+    job_events.notify(download_id)
+    if RESERVATION_FIELDS & fields.keys():
+        janitor.track(download_id, fields)
+
+def job_status(download_id):
+    """Public view of a download entry, as returned by /status and /events"""
+    status = dict(downloads[download_id])
+    if status['status'] == 'queued':
+        status['queue_position'] = scheduler.position(download_id)
+        if status['queue_position']:
+            status['progress'] = f"Queued (position {status['queue_position']})..."
+    return status
+
+def client_id():
+    """Who a request is from, for per-user quotas (the client address; Render sits behind a proxy)"""
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    return forwarded.split(',')[0].strip() or request.remote_addr
+
+def requested_quality(fields, url=None):
+    """
+    Normalized quality asked for in a request's fields
+
+    A bare format id is only taken when /check-formats listed it for url;
+    raises ValueError for anything not understood.
+    """
+    probe = probe_cache.peek(url) if url else None
+    known = [fmt['format_id'] for fmt in (probe or {}).get('formats') or [] if fmt.get('format_id')]
+    return normalize_quality(fields.get('quality'), fields.get('format_id'), known)
 
-def download_video(download_id, url, filename, quality='best'):
-    """Background task to download video"""
+def new_job_record(url, filename, quality, owner=None):
+    """Initial download entry"""
+    return {
+        'status': 'queued',
+        'progress': 'Queued...',
+        'percent': 0,
+        'url': url,
+        'filename': filename,
+        'quality': quality,
+        'cache_keys': [cache_key(url, quality)],
+        'owner': owner,
+        'created': time.time()
+    }
+
+def download_video(download_id, url, filename, quality='best', connections=16):
+    """Background task to download video (run by the scheduler)"""
+    # The job directory lock makes sure only one worker runs a job, even
+    # when several rediscover it after a restart
+    job_dir = DOWNLOAD_DIR / download_id
+    lock = checkpoint.claim(job_dir)
+    if lock is None:
+        return
+    download_locks[download_id] = lock
     try:
+        if downloads[download_id]['status'] != 'queued':
+            return  # Cancelled while waiting in the queue
+        update_job(download_id, status='downloading', progress='Starting download...', started=time.time())
         # For m3u8 URLs, we need to download to server first
         # (m3u8 streams can't be directly downloaded by browser)
-        download_video_to_server(download_id, url, filename, quality)
+        download_video_to_server(download_id, url, filename, quality, connections)
             
     except Exception as e:
-        downloads[download_id]['status'] = 'error'
-        downloads[download_id]['progress'] = f'Error: {str(e)}'
+        update_job(download_id, status='error', progress=f'Error: {str(e)}')
     finally:
         # Clean up process reference
         if download_id in download_processes:
             del download_processes[download_id]
+        download_cache.release(cache_key(url, quality), download_id)
+        bitrate_budget.release(download_id)
+        # Finished files have been moved into the cache; drop leftovers and the
+        # resume data (a worker that dies never gets here, so its job resumes)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        checkpoint.release(download_locks.pop(download_id, None))
 
-def extract_video_url(page_url):
-    """Extract m3u8 or mp4 URL from webpage"""
-    try:
-        import requests
-        import re
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        response = requests.get(page_url, headers=headers, timeout=10)
-        html = response.text
-        
-        # Look for m3u8 URLs
-        m3u8_pattern = r'https?://[^\s<>"]+?\.m3u8[^\s<>"]*'
-        m3u8_urls = re.findall(m3u8_pattern, html)
-        if m3u8_urls:
-            return m3u8_urls[0]
-        
-        # Look for mp4 URLs
-        mp4_pattern = r'https?://[^\s<>"]+?\.mp4[^\s<>"]*'
-        mp4_urls = re.findall(mp4_pattern, html)
-        if mp4_urls:
-            return mp4_urls[0]
-        
+def resume_unfinished_jobs():
+    """Re-queue jobs that a previous worker was running when it stopped"""
+    for job_dir, info in checkpoint.find_unfinished(DOWNLOAD_DIR):
+        # Held while the record is rewritten, so no other worker is running the job meanwhile
+        lock = checkpoint.claim(job_dir)
+        if lock is None:
+            continue  # Another worker picked it up since
+        try:
+            download_id = info['download_id']
+            record = downloads.get(download_id)
+            if record and record['status'] in FINISHED_STATUSES:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                continue
+            record = record or new_job_record(info['url'], info['filename'], info['quality'], info.get('owner'))
+            if info.get('cache_keys'):
+                record.update(quality_served=info.get('quality_served'), cache_keys=info['cache_keys'])
+            record.update(status='queued', progress='Resuming after restart...')
+            downloads[download_id] = record
+        finally:
+            checkpoint.release(lock)
+        janitor.track(download_id, record)
+        download_cache.claim(record['cache_keys'][-1], download_id)
+        scheduler.submit(download_id, info['url'], download_video,
+                         args=(download_id, info['url'], info['filename'], info['quality']),
+                         priority=info.get('priority', 0),
+                         resolve=lambda job_id=download_id, info=info: resolve_job(job_id, info['url'], info['quality']))
+        print(f"Resuming download {download_id} ({info['filename']})")
+
+def record_served_quality(download_id, url, height):
+    """
+    Note that the bitrate budget picked a lower quality than requested
+
+    The file is cached under the height it actually has, so it's never
+    served to someone who asked for the original quality.
+    """
+    served = f'{height}p' if height else 'budget'
+    cache_keys = [cache_key(url, served)]
+    update_job(download_id, quality_served=served, cache_keys=cache_keys)
+    # Also in the job file, so a job resumed after a restart is cached under it too
+    job_dir = DOWNLOAD_DIR / download_id
+    info = checkpoint.read_json(job_dir / checkpoint.JOB_FILE)
+    if info:
+        checkpoint.save_job(job_dir, dict(info, quality_served=served, cache_keys=cache_keys))
+
+def mark_completed(download_id, downloaded_file, cached=False):
+    """Record a finished file on the download entry"""
+    if not cached:
+        # Move the file into the cache so repeat requests reuse it
+        info = downloads[download_id]
+        downloaded_file = download_cache.put(info['cache_keys'], downloaded_file,
+                                             url=info['url'], fmt=info['quality'])
+        size = downloaded_file.stat().st_size
+        downloaded_bytes.inc(size)
+        if info.get('started'):
+            job_throughput.observe(size / max(time.time() - info['started'], 0.001))
+    
+    # Get file size and format
+    file_size = downloaded_file.stat().st_size
+    file_ext = downloaded_file.suffix.upper().replace('.', '') if downloaded_file.suffix else 'MP4'
+    
+    # Format file size
+    if file_size < 1024 * 1024:  # Less than 1 MB
+        size_str = f"{file_size / 1024:.2f} KB"
+    elif file_size < 1024 * 1024 * 1024:  # Less than 1 GB
+        size_str = f"{file_size / (1024 * 1024):.2f} MB"
+    else:  # GB or larger
+        size_str = f"{file_size / (1024 * 1024 * 1024):.2f} GB"
+    
+    update_job(
+        download_id,
+        status='completed',
+        percent=100,
+        file=str(downloaded_file),
+        file_size=size_str,
+        file_bytes=file_size,
+        file_format=file_ext,
+        finished=time.time(),
+        progress=f'Download completed! ({size_str}, {file_ext})'
+    )
+    owner = downloads[download_id].get('owner')
+    if owner and janitor.user_quota:
+        janitor.enforce_user_quota(owner, keep=download_id)
+
+def resolve_job(download_id, url, quality):
+    """
+    Find the video behind a page URL before the job takes connections (a
+    scheduler hook), so they count against the media host, not the page's
+
+    Returns the media URL, or None when there's nothing to download (not
+    found, or already cached; the job record says which).
+    """
+    if is_direct_media_url(url) or downloads.get(download_id, {}).get('status') != 'queued':
         return None
-    except Exception as e:
-        print(f"URL extraction error: {e}")
+    update_job(download_id, progress='Extracting video URL from page...')
+    media_url = extract_video_url(url, source_picker, max_height(quality))
+    if not media_url:
+        update_job(download_id, status='error', progress='Could not find video URL on page. Try right-clicking video and copying direct link.')
         return None
+    # The page may embed media that's already cached
+    media_key = cache_key(media_url, quality)
+    update_job(download_id, media_url=media_url, progress='Found video URL! Waiting for a download slot...',
+               cache_keys=[media_key] + downloads[download_id]['cache_keys'])
+    cached_file = download_cache.get(media_key)
+    if cached_file:
+        mark_completed(download_id, cached_file, cached=True)
+        return None
+    return media_url
 
-def download_video_to_server(download_id, url, filename, quality='best'):
+def download_video_to_server(download_id, url, filename, quality='best', connections=16):
     """Fallback: Download to server if direct download doesn't work"""
+    flow = None
     try:
-        # If URL is not a direct video URL, try to extract it
-        if not url.endswith('.m3u8') and not url.endswith('.mp4'):
-            downloads[download_id]['progress'] = 'Extracting video URL from page...'
-            extracted_url = extract_video_url(url)
+        # If URL is not a direct video URL, try to extract it (resolve_job usually has)
+        page_url = None
+        media_url = downloads[download_id].get('media_url')
+        if media_url:
+            page_url, url = url, media_url
+        elif not is_direct_media_url(url):
+            update_job(download_id, progress='Extracting video URL from page...')
+            extracted_url = extract_video_url(url, source_picker, max_height(quality))
             if extracted_url:
+                page_url = url
                 url = extracted_url
-                downloads[download_id]['progress'] = 'Found video URL! Starting download...'
+                update_job(download_id, progress='Found video URL! Starting download...')
+                # The page may embed media that's already cached
+                media_key = cache_key(url, quality)
+                update_job(download_id, cache_keys=[media_key] + downloads[download_id]['cache_keys'])
+                cached_file = download_cache.get(media_key)
+                if cached_file:
+                    mark_completed(download_id, cached_file, cached=True)
+                    return
             else:
-                downloads[download_id]['status'] = 'error'
-                downloads[download_id]['progress'] = 'Could not find video URL on page. Try right-clicking video and copying direct link.'
+                update_job(download_id, status='error', progress='Could not find video URL on page. Try right-clicking video and copying direct link.')
                 return
         
-        output_path = DOWNLOAD_DIR / filename
-        output_template = str(output_path.with_suffix(''))
+        # Each job writes into its own directory, so its output can never be
+        # confused with another job's file
+        job_dir = DOWNLOAD_DIR / download_id
+        job_dir.mkdir(exist_ok=True)
+        output_path = job_dir / Path(filename).name
         
-        format_string = 'best'
+        def select_variant(variants):
+            # The tallest variant within the requested height, stepped down
+            # further when the server's bitrate budget is taken
+            requested = pick_variant(variants, max_height(quality))
+            variant = pick_variant(variants, max_height(quality), bitrate_budget.allowance(download_id))
+            bitrate_budget.reserve(download_id, variant['bandwidth'])
+            if variant is not requested:
+                record_served_quality(download_id, url, variant['height'])
+            return variant
         
-        # Use yt-dlp to download with MAXIMUM SPEED settings
-        command = [
-            'python3', '-m', 'yt_dlp',
-            '--no-check-certificate',
-            '--newline',  # Print progress on new lines
-            '-f', format_string,
-            '-o', output_template,
-            '--merge-output-format', 'mp4',
-            '--concurrent-fragments', '16',  # Download 16 fragments at once (FAST!)
-            '--buffer-size', '16K',  # Larger buffer for faster download
-            '--http-chunk-size', '10M',  # Download in 10MB chunks
-            '--retries', '10',  # Retry failed chunks
-            '--fragment-retries', '10',  # Retry failed fragments
-            '--no-part',  # Don't use .part files (faster)
-            '--no-mtime',  # Don't set file modification time (faster)
-            url
-        ]
+        budget_limited = False
         
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            cwd=str(Path.cwd())
-        )
+        def format_string():
+            # Under load, prefer formats within this job's share of the bitrate budget
+            nonlocal budget_limited
+            allowance = bitrate_budget.allowance(download_id)
+            budget_limited = allowance is not None and allowance < bitrate_budget.total
+            if allowance is not None:
+                bitrate_budget.reserve(download_id, allowance)
+            return ytdlp_format(quality, allowance if budget_limited else None)
         
-        # Store process for cancellation
-        download_processes[download_id] = process
+        # Progress is written at most every PROGRESS_INTERVAL (and always at 100%)
+        throttle = ProgressThrottle(PROGRESS_INTERVAL)
         
-        # Read output line by line
-        error_messages = []
-        for line in process.stdout:
-            line = line.strip()
-            if line:
-                downloads[download_id]['progress'] = line
-                # Capture error messages
-                if 'ERROR' in line or 'error' in line.lower():
-                    error_messages.append(line)
-                if '[download]' in line and '%' in line:
-                    # Extract percentage
-                    try:
-                        percent = line.split('%')[0].split()[-1]
-                        downloads[download_id]['percent'] = float(percent)
-                    except:
-                        pass
+        def report(fields):
+            if throttle.ready() or (fields.get('percent') or 0) >= 100:
+                update_job(download_id, progress=format_progress(fields), **fields)
         
-        process.wait()
+        def output(line):
+            if line.startswith('ERROR:') or throttle.ready():
+                update_job(download_id, progress=line)
         
-        if process.returncode == 0:
-            # Find the downloaded file - check multiple locations and extensions
-            downloaded_file = None
-            
-            # First, try common extensions with exact filename
-            for ext in ['.mp4', '.mkv', '.webm', '.avi', '.m4v', '.ts', '.flv']:
-                test_path = output_path.with_suffix(ext)
-                if test_path.exists():
-                    downloaded_file = test_path
-                    break
-            
-            # If not found, search entire directory for ANY video file (including files without extensions!)
-            if not downloaded_file:
-                all_files = list(DOWNLOAD_DIR.glob("*"))
-                video_files = [f for f in all_files 
-                              if f.is_file() 
-                              and (f.suffix.lower() in ['.mp4', '.mkv', '.webm', '.avi', '.m4v', '.ts', '.flv', '.m4a', '']  # Include no extension!
-                                   or f.suffix == '')  # Files without extension
-                              and f.stat().st_size > 1024]  # At least 1KB
-                
-                if video_files:
-                    # Get the most recently modified video file
-                    downloaded_file = max(video_files, key=lambda f: f.stat().st_mtime)
-                    print(f"Found file: {downloaded_file.name} ({downloaded_file.stat().st_size} bytes)")
-            
-            if downloaded_file:
-                # Get file size and format
-                file_size = downloaded_file.stat().st_size
-                file_ext = downloaded_file.suffix.upper().replace('.', '') if downloaded_file.suffix else 'MP4'
-                
-                # Format file size
-                if file_size < 1024 * 1024:  # Less than 1 MB
-                    size_str = f"{file_size / 1024:.2f} KB"
-                elif file_size < 1024 * 1024 * 1024:  # Less than 1 GB
-                    size_str = f"{file_size / (1024 * 1024):.2f} MB"
-                else:  # GB or larger
-                    size_str = f"{file_size / (1024 * 1024 * 1024):.2f} GB"
-                
-                downloads[download_id]['status'] = 'completed'
-                downloads[download_id]['file'] = str(downloaded_file)
-                downloads[download_id]['file_size'] = size_str
-                downloads[download_id]['file_format'] = file_ext
-                downloads[download_id]['progress'] = f'Download completed! ({size_str}, {file_ext})'
-            else:
-                downloads[download_id]['status'] = 'error'
-                # List what files ARE in the directory for debugging
-                files_in_dir = list(DOWNLOAD_DIR.glob('*'))
-                file_names = [f.name for f in files_in_dir if f.is_file()]
-                downloads[download_id]['progress'] = f'File not found. Expected: {output_path.stem}. Found files: {", ".join(file_names) if file_names else "none"}'
-                print(f"ERROR: Expected {output_path.stem}, found: {file_names}")
-        else:
-            downloads[download_id]['status'] = 'error'
-            error_detail = error_messages[-1] if error_messages else 'Download failed'
-            downloads[download_id]['progress'] = f'Failed: {error_detail}'
+        def fallback(error):
+            update_job(download_id, percent=0, progress='Retrying with yt-dlp...')
+        
+        # m3u8 and direct .mp4 URLs are fetched in-process, anything else by yt-dlp
+        flow = bandwidth.flow(DOWNLOAD, label=download_id)
+        job = Download(
+            url, output_path, quality, connections,
+            hls_concurrency=HLS_CONCURRENCY,
+            range_connections=DIRECT_CONNECTIONS,
+            progress=report, output=output, fallback=fallback,
+            select_variant=select_variant, format_string=format_string,
+            throttle=flow.consume, rate_limit=flow.limit,
+            # Share the job lock with yt-dlp: if this worker dies, a restarted
+            # worker can't resume the job while the orphaned yt-dlp still runs
+            pass_fds=(download_locks[download_id].fileno(),)
+        )
+        # Store the job for pause/resume/cancel
+        download_processes[download_id] = job
+        try:
+            downloaded_file = job.run()
+        except DownloadCancelled:
+            return
+        except DownloadError as e:
+            if page_url:
+                source_picker.forget(page_url)  # Probe the site's sources afresh next time
+            if downloads[download_id]['status'] != 'cancelled':
+                update_job(download_id, status='error', progress=f'Failed: {e}')
+            return
+        finally:
+            if 'yt-dlp first output' in job.timings:
+                spawn_seconds.observe(job.timings['yt-dlp first output'], kind='download')
+        
+        if downloads[download_id]['status'] == 'cancelled':
+            return
+        if job.method == 'yt-dlp' and budget_limited:
+            record_served_quality(download_id, url, job.height)
+        mark_completed(download_id, downloaded_file)
             
     except Exception as e:
-        downloads[download_id]['status'] = 'error'
-        downloads[download_id]['progress'] = f'Error: {str(e)}'
+        update_job(download_id, status='error', progress=f'Error: {str(e)}')
     finally:
+        if flow:
+            flow.close()
         # Clean up process reference
         if download_id in download_processes:
             del download_processes[download_id]
@@ -204,6 +471,109 @@ def index():
     """Main page"""
     return render_template('index.html')
 
+class ProbeError(Exception):
+    """yt-dlp couldn't extract format information"""
+
+class ProbeBusy(Exception):
+    """All probe slots stayed taken for PROBE_WAIT seconds"""
+
+def probe_formats(url):
+    """Run the yt-dlp extractor and summarize the available formats"""
+    # Use yt-dlp to list formats with playlist extraction
+    command = ytdlp_info_command(url)
+    
+    if not probe_slots.acquire(timeout=PROBE_WAIT):
+        raise ProbeBusy()
+    try:
+        with extractor_seconds.time():
+            result = subprocess.run(
+                command,
+                capture_output=True,
+                text=True,
+                timeout=30
+            )
+    finally:
+        probe_slots.release()
+    
+    if result.returncode != 0:
+        raise ProbeError('Could not fetch video information')
+    
+    info = json.loads(result.stdout)
+    
+    formats = []
+    for fmt in info.get('formats', []):
+        # Only include video formats with reasonable quality
+        if fmt.get('vcodec') != 'none' and fmt.get('height'):
+            filesize = fmt.get('filesize') or fmt.get('filesize_approx') or 0
+            
+            # Format file size
+            if filesize > 0:
+                if filesize < 1024 * 1024:
+                    size_str = f"{filesize / 1024:.1f} KB"
+                elif filesize < 1024 * 1024 * 1024:
+                    size_str = f"{filesize / (1024 * 1024):.1f} MB"
+                else:
+                    size_str = f"{filesize / (1024 * 1024 * 1024):.2f} GB"
+            else:
+                size_str = "Unknown"
+            
+            formats.append({
+                'format_id': fmt.get('format_id'),
+                'resolution': f"{fmt.get('width')}x{fmt.get('height')}",
+                'height': fmt.get('height'),
+                'ext': fmt.get('ext'),
+                'filesize': filesize,
+                'filesize_str': size_str,
+                'fps': fmt.get('fps'),
+                'vcodec': fmt.get('vcodec', '').split('.')[0],
+                'acodec': fmt.get('acodec', 'none').split('.')[0]
+            })
+    
+    # Sort by height (quality)
+    formats.sort(key=lambda x: x['height'], reverse=True)
+    
+    # Remove duplicates, keep best quality for each resolution
+    seen_heights = set()
+    unique_formats = []
+    for fmt in formats:
+        if fmt['height'] not in seen_heights:
+            seen_heights.add(fmt['height'])
+            unique_formats.append(fmt)
+    
+    return {
+        'title': info.get('title', 'Video'),
+        'duration': info.get('duration'),
+        'formats': unique_formats[:10]  # Limit to top 10
+    }
+
+def expand_source(url):
+    """Entries of a playlist/page as [(url, title)]: yt-dlp's flat playlist, else the page's media links"""
+    command = ytdlp_info_command(url)
+    try:
+        with probe_slots:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=60)
+        if result.returncode == 0:
+            info = json.loads(result.stdout)
+            if 'entries' not in info:
+                return [(url, info.get('title'))]
+            entries = []
+            for entry in info['entries'] or []:
+                entry_url = entry.get('url') or entry.get('webpage_url')
+                if entry_url:
+                    entries.append((entry_url, entry.get('title')))
+            return entries
+    except (subprocess.TimeoutExpired, ValueError, OSError) as e:
+        print(f"Playlist expansion failed for {url}: {e}")
+    
+    # Not something yt-dlp understands: take every m3u8/mp4 linked from the page
+    if is_direct_media_url(url):
+        return [(url, None)]
+    try:
+        return [(media_url, None) for media_url, _ in scan_page(url, stop_early=False)]
+    except Exception as e:
+        print(f"Page scan failed for {url}: {e}")
+        return []
+
 @app.route('/check-formats', methods=['POST'])
 def check_formats():
     """Check available formats for a URL"""
@@ -214,114 +584,274 @@ def check_formats():
         return jsonify({'error': 'URL is required'}), 400
     
     try:
-        # Use yt-dlp to list formats with playlist extraction
-        command = [
-            'python3', '-m', 'yt_dlp',
-            '--no-check-certificate',
-            '-J',  # Output JSON
-            '--flat-playlist',  # Extract all videos from playlist/page
-            '--no-warnings',
-            url
-        ]
-        
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        
-        if result.returncode == 0:
-            import json
-            info = json.loads(result.stdout)
-            
-            formats = []
-            for fmt in info.get('formats', []):
-                # Only include video formats with reasonable quality
-                if fmt.get('vcodec') != 'none' and fmt.get('height'):
-                    filesize = fmt.get('filesize') or fmt.get('filesize_approx') or 0
-                    
-                    # Format file size
-                    if filesize > 0:
-                        if filesize < 1024 * 1024:
-                            size_str = f"{filesize / 1024:.1f} KB"
-                        elif filesize < 1024 * 1024 * 1024:
-                            size_str = f"{filesize / (1024 * 1024):.1f} MB"
-                        else:
-                            size_str = f"{filesize / (1024 * 1024 * 1024):.2f} GB"
-                    else:
-                        size_str = "Unknown"
-                    
-                    formats.append({
-                        'format_id': fmt.get('format_id'),
-                        'resolution': f"{fmt.get('width')}x{fmt.get('height')}",
-                        'height': fmt.get('height'),
-                        'ext': fmt.get('ext'),
-                        'filesize': filesize,
-                        'filesize_str': size_str,
-                        'fps': fmt.get('fps'),
-                        'vcodec': fmt.get('vcodec', '').split('.')[0],
-                        'acodec': fmt.get('acodec', 'none').split('.')[0]
-                    })
-            
-            # Sort by height (quality)
-            formats.sort(key=lambda x: x['height'], reverse=True)
-            
-            # Remove duplicates, keep best quality for each resolution
-            seen_heights = set()
-            unique_formats = []
-            for fmt in formats:
-                if fmt['height'] not in seen_heights:
-                    seen_heights.add(fmt['height'])
-                    unique_formats.append(fmt)
-            
-            return jsonify({
-                'title': info.get('title', 'Video'),
-                'duration': info.get('duration'),
-                'formats': unique_formats[:10]  # Limit to top 10
-            })
-        else:
-            return jsonify({'error': 'Could not fetch video information'}), 400
-            
+        # Repeat and simultaneous probes of one URL share a single extraction
+        return jsonify(probe_cache.get_or_probe(url, probe_formats))
+    except ProbeError as e:
+        return jsonify({'error': str(e)}), 400
+    except ProbeBusy:
+        return jsonify({'error': 'Server is busy checking other videos, try again shortly'}), 503, {'Retry-After': '5'}
     except subprocess.TimeoutExpired:
         return jsonify({'error': 'Request timeout'}), 408
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/check-formats/stats')
+def check_formats_stats():
+    """Hit/miss counters for the format probe cache"""
+    return jsonify(probe_cache.stats())
+
+@app.route('/sources/stats')
+def sources_stats():
+    """Hit/miss counters for the per-site source choice"""
+    return jsonify(source_picker.stats())
+
+class AdmissionError(ValueError):
+    """A download can't be admitted; carries the HTTP status to answer with"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def submit_download(url, filename, quality='best', priority=0, owner=None):
+    """
+    Create (or join, or serve from cache) a download job
+    
+    Returns the /download response body; raises AdmissionError if the job
+    can't be admitted
+    """
+    # Ensure filename has .mp4 extension
+    if not filename.endswith('.mp4'):
+        filename += '.mp4'
+    
+    # Generate unique download ID
+    download_id = str(uuid.uuid4())
+    
+    # Initialize download status
+    key = cache_key(url, quality)
+    downloads[download_id] = new_job_record(url, filename, quality, owner)
+    
+    # Serve repeat requests straight from the cache
+    cached_file = download_cache.get(key)
+    if cached_file:
+        mark_completed(download_id, cached_file, cached=True)
+        return {'download_id': download_id, 'cached': True}
+    
+    # Admit the job only if its file fits (sized from /check-formats, when it was run)
+    expected_bytes = expected_size(probe_cache.peek(url), quality)
+    if janitor.user_quota and expected_bytes and expected_bytes > janitor.user_quota:
+        del downloads[download_id]
+        raise AdmissionError('Video is larger than your storage quota', 507)
+    if not janitor.ensure_space(expected_bytes or 0):
+        del downloads[download_id]
+        raise AdmissionError('Not enough disk space on the server, try again later', 507)
+    update_job(download_id, expected_bytes=expected_bytes)
+    
+    # Join a job that's already downloading the same media
+    running_id = download_cache.claim(key, download_id)
+    if running_id is not None:
+        if running_id in downloads and downloads[running_id]['status'] in ('queued', 'downloading', 'paused'):
+            del downloads[download_id]
+            janitor.untrack(download_id)
+            job_events.forget(download_id)
+            return {'download_id': running_id, 'joined': True}
+        download_cache.release(key, running_id)
+        download_cache.claim(key, download_id)
+    
+    # Persist the job so it can be resumed if this worker restarts
+    job_dir = DOWNLOAD_DIR / download_id
+    job_dir.mkdir(exist_ok=True)
+    checkpoint.save_job(job_dir, {'download_id': download_id, 'url': url, 'filename': filename,
+                                  'quality': quality, 'priority': priority, 'owner': owner})
+    
+    # Queue the download; the scheduler bounds total and per-host concurrency
+    scheduler.submit(download_id, url, download_video, args=(download_id, url, filename, quality),
+                     priority=priority, resolve=lambda: resolve_job(download_id, url, quality))
+    
+    return {'download_id': download_id}
+
 @app.route('/download', methods=['POST'])
 def download():
     """Start a new download"""
     data = request.json
     url = data.get('url', '').strip()
     filename = data.get('filename', 'video').strip()
-    quality = data.get('quality', 'best').strip()
+    try:
+        # A height ('720', '720p'), 'best', or a format_id from /check-formats
+        quality = requested_quality(data, url)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        priority = int(data.get('priority') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'priority must be a whole number'}), 400
     
     if not url:
         return jsonify({'error': 'URL is required'}), 400
     
-    # Ensure filename has .mp4 extension
-    if not filename.endswith('.mp4'):
-        filename += '.mp4'
+    try:
+        return jsonify(submit_download(url, filename, quality, priority, client_id()))
+    except AdmissionError as e:
+        return jsonify({'error': str(e)}), e.status
+
+def submit_batch_item(url, filename, quality, owner):
+    return submit_download(url, filename, quality, owner=owner)['download_id']
+
+batch_manager = BatchManager(
+    batches, downloads, job_events, submit_batch_item, expand_source,
+    parallel=int(os.environ.get('BATCH_PARALLEL', '2')),
+    max_items=int(os.environ.get('MAX_BATCH_ITEMS', '50'))
+)
+
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    """Download a list of URLs ('urls') or every video of a playlist/page ('url')"""
+    data = request.json
+    urls = data.get('urls') or []
+    source = (data.get('url') or '').strip() or None
+    if not urls and not source:
+        return jsonify({'error': 'Give a playlist/page "url" or a list of "urls"'}), 400
+    if not isinstance(urls, list):
+        return jsonify({'error': '"urls" must be a list'}), 400
+    try:
+        parallel = int(data.get('parallel') or 0) or None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'parallel must be a whole number'}), 400
+    try:
+        quality = requested_quality(data, source)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Generate unique download ID
-    download_id = str(uuid.uuid4())
+    try:
+        batch_id = batch_manager.create(
+            urls=None if source else urls,
+            source=source,
+            quality=quality,
+            prefix=(data.get('filename') or 'video').strip(),
+            parallel=parallel,
+            owner=client_id()
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'batch_id': batch_id})
+
+@app.route('/batch/<batch_id>')
+def batch_status(batch_id):
+    """Aggregate and per-item progress of a batch"""
+    if batch_id not in batches:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(batch_manager.status(batch_id))
+
+@app.route('/batch/<batch_id>/manifest')
+def batch_manifest(batch_id):
+    """Results of a batch: one entry per item, with a link to its file when completed"""
+    if batch_id not in batches:
+        return jsonify({'error': 'Batch not found'}), 404
+    status = batch_manager.status(batch_id)
+    manifest = []
+    for item in status['items']:
+        entry = {key: item[key] for key in ('url', 'title', 'download_id', 'status')}
+        job = downloads.get(item['download_id']) if item['download_id'] else None
+        if item['status'] == 'completed' and job:
+            entry.update(filename=job['filename'], file_bytes=job.get('file_bytes'),
+                         file_format=job.get('file_format'),
+                         download_url=f"/download-file/{item['download_id']}")
+        elif item['status'] == 'error':
+            entry['error'] = item['progress']
+        manifest.append(entry)
+    return jsonify({'batch_id': batch_id, 'status': status['status'], 'items': manifest})
+
+@app.route('/batch/<batch_id>/zip')
+def batch_zip(batch_id):
+    """The batch's completed files as one streamed ZIP (once the batch has finished)"""
+    if batch_id not in batches:
+        return jsonify({'error': 'Batch not found'}), 404
+    if batches[batch_id]['status'] in ('expanding', 'running'):
+        return jsonify({'error': 'Batch is still running'}), 409
+    files = batch_manager.completed_files(batch_id)
+    if not files:
+        return jsonify({'error': 'No completed files in this batch'}), 404
+    return send_bundle(files, batches[batch_id]['prefix'])
+
+def send_bundle(files, name):
+    """
+    Stream a stored ZIP of (download_id, path, name in archive) files
     
-    # Initialize download status
-    downloads[download_id] = {
-        'status': 'queued',
-        'progress': 'Queued...',
-        'percent': 0,
-        'url': url,
-        'filename': filename,
-        'quality': quality
-    }
+    The layout is computed first (CRCs are cached in the job records), so
+    the archive has a Content-Length and answers Range / If-Range requests.
+    """
+    full = streams_full()
+    if full:
+        return full
+    names = unique_names([entry_name for _, _, entry_name in files])
+    crcs = [downloads.get(download_id, {}).get('file_crc32') for download_id, _, _ in files]
+    archive = ZipArchive([(path, entry_name, crc) for (_, path, _), entry_name, crc in zip(files, names, crcs)])
+    for (download_id, _, _), old, crc in zip(files, crcs, archive.crcs):
+        if old is None and download_id in downloads:
+            update_job(download_id, file_crc32=crc)
     
-    # Start download in background thread
-    thread = threading.Thread(target=download_video, args=(download_id, url, filename, quality))
-    thread.daemon = True
-    thread.start()
+    # A Range is honoured unless If-Range names another version (or a date; there's no mtime)
+    start, stop, status = 0, archive.size, 200
+    if_range = request.if_range
+    if request.range and (if_range.etag or if_range.date) in (None, archive.etag):
+        byte_range = request.range.range_for_length(archive.size)
+        if byte_range is None:
+            return Response(status=416, headers={'Content-Range': f'bytes */{archive.size}'})
+        (start, stop), status = byte_range, 206
     
-    return jsonify({'download_id': download_id})
+    response = Response(monitored(archive.iter_range(start, stop), 'zip', route='bundle'), status=status,
+                        mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{name}.zip"',
+        'Content-Length': str(stop - start),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache'
+    })
+    response.set_etag(archive.etag)
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{archive.size}'
+    return response
+
+@app.route('/bundle')
+def bundle():
+    """A ZIP of completed downloads: /bundle?ids=<id>,<id>,...&name=<archive name>"""
+    download_ids = [i for i in request.args.get('ids', '').split(',') if i]
+    if not download_ids:
+        return jsonify({'error': 'ids is required'}), 400
+    files = []
+    for download_id in dict.fromkeys(download_ids):
+        info = downloads.get(download_id)
+        if not info or info['status'] != 'completed' or not os.path.isfile(info.get('file') or ''):
+            return jsonify({'error': f'Download {download_id} has no completed file'}), 404
+        files.append((download_id, info['file'], Path(info['filename']).with_suffix(Path(info['file']).suffix).name))
+    name = re.sub(r'[^A-Za-z0-9._-]+', '-', request.args.get('name', '')).strip('-.') or 'videos'
+    return send_bundle(files, name)
+
+@app.route('/batch/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    """Stop a batch: no new items start, and running ones are cancelled"""
+    if batch_id not in batches:
+        return jsonify({'error': 'Batch not found'}), 404
+    for download_id in batch_manager.cancel(batch_id):
+        cancel_job(download_id)
+    return jsonify({'success': True})
+
+def streams_full():
+    """503 response while MAX_STREAMS long-lived responses are open, else None"""
+    if MAX_STREAMS and stream_stats.stats()['active'] >= MAX_STREAMS:
+        return jsonify({'error': 'Too many open streams, try again shortly'}), 503, {'Retry-After': '10'}
+    return None
+
+def monitored(chunks, kind, route='stream'):
+    """Count a response body's bytes in stream_stats; it's aborted if the client leaves early"""
+    stream_id = stream_stats.start(kind)
+    complete = False
+    try:
+        with closing(iter(chunks)) as body:
+            for chunk in body:
+                stream_stats.add(stream_id, len(chunk))
+                served_bytes.inc(len(chunk), route=route)
+                yield chunk
+        complete = True
+    finally:
+        stream_stats.finish(stream_id, complete)
 
 @app.route('/stream')
 def stream_video():
@@ -331,57 +861,110 @@ def stream_video():
     
     if not url:
         return jsonify({'error': 'URL is required'}), 400
+    try:
+        quality = requested_quality(request.args, url)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Content-Type': 'video/mp4',
+        'Cache-Control': 'no-cache',
+        'X-Content-Type-Options': 'nosniff'
+    }
+    
+    # Already downloaded (or streamed) by someone: send the file, seekable
+    key = cache_key(url, quality)
+    cached_file = download_cache.get(key)
+    if cached_file:
+        return send_media(cached_file, Path(filename).with_suffix(cached_file.suffix).name, DOWNLOAD_DIR)
+    
+    full = streams_full()
+    if full:
+        return full
+    
+    def keep_streamed(path):
+        # yt-dlp writes whichever container the formats need; cache the file as what it is
+        real_path = path.with_suffix(container_suffix(path))
+        if real_path != path:
+            os.replace(path, real_path)
+        return download_cache.put([key], real_path, url=url, fmt=quality)
+    
+    def respond(body, kind, is_complete):
+        """Send body; in tee mode via a file on disk that others can read along"""
+        if STREAM_CACHE:
+            tee, created = tees.start(key, body, is_complete, keep_streamed)
+            if not created:
+                body.close()  # Lost a race with another request for the same video
+                kind = 'tee'
+            body = tee.read()
+        return app.response_class(monitored(shaped(body, bandwidth, STREAM), kind),
+                                  mimetype='video/mp4', headers=headers)
+    
+    # Being fetched for another request: read along behind it
+    tee = STREAM_CACHE and tees.get(key)
+    if tee:
+        return app.response_class(monitored(shaped(tee.read(), bandwidth, STREAM), 'tee'),
+                                  mimetype='video/mp4', headers=headers)
+    
+    # m3u8: fetch segments in-process and remux them to fragmented MP4 on
+    # the fly, so the first bytes go out after one segment
+    if is_hls_url(url) and not format_id(quality):
+        stream = HLSStream(url, HLS_CONCURRENCY,
+                           select_variant=lambda variants: pick_variant(variants, max_height(quality)))
+        try:
+            stream.open()
+        except HLSError as e:
+            print(f"Streaming remux unavailable, falling back to yt-dlp: {e}")
+        else:
+            return respond(stream, 'remux', lambda: stream.complete)
+    
+    finished = []  # Set once yt-dlp exits cleanly
     
     def generate():
         """Stream yt-dlp output directly to browser"""
-        command = [
-            'python3', '-m', 'yt_dlp',
-            '--no-check-certificate',
-            '-f', 'best',
-            '--merge-output-format', 'mp4',
-            '--concurrent-fragments', '16',
-            '--buffer-size', '16K',
-            '--http-chunk-size', '10M',
-            '--retries', '10',
-            '--fragment-retries', '10',
-            '--fixup', 'detect_or_warn',  # Fix issues automatically
-            '-o', '-',  # Output to stdout!
-            url
-        ]
+        command = ytdlp_stream_command(url, ytdlp_format(quality))
         
+        spawned = time.perf_counter()
         process = subprocess.Popen(
             command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            bufsize=0  # No buffering - stream immediately
+            bufsize=0,  # No buffering - stream immediately
+            start_new_session=True  # So stopping it also stops the ffmpeg it spawns
         )
+        # Keep reading stderr, or a chatty yt-dlp fills the pipe and stalls
+        errors = deque(maxlen=20)
+        drain(process.stderr, errors)
         
-        # Stream the output - larger chunks for faster transfer
+        # Stream the output; read size follows how fast yt-dlp produces
+        sizer = ChunkSizer()
         try:
             while True:
-                chunk = process.stdout.read(65536)  # Read 64KB at a time (larger chunks)
+                chunk = process.stdout.read(sizer.size)
+                if spawned:
+                    spawn_seconds.observe(time.perf_counter() - spawned, kind='stream')
+                    spawned = None
                 if not chunk:
                     break
+                sizer.update(len(chunk))
                 yield chunk
-        except Exception as e:
-            print(f"Streaming error: {e}")
-        finally:
-            # Make sure process completes
             process.wait()
             if process.returncode != 0:
-                error = process.stderr.read().decode('utf-8', errors='ignore')
-                print(f"yt-dlp error: {error}")
-    
-    return app.response_class(
-        generate(),
-        mimetype='video/mp4',
-        headers={
-            'Content-Disposition': f'attachment; filename="{filename}"',
-            'Content-Type': 'video/mp4',
-            'Cache-Control': 'no-cache',
-            'X-Content-Type-Options': 'nosniff'
-        }
-    )
+                print(f"yt-dlp error: {' / '.join(errors)}")
+            else:
+                finished.append(True)
+        finally:
+            # Also reached when the client disconnects: don't leave yt-dlp running
+            stop_process(process, group=True)
+            process.stdout.close()
+    
+    return respond(generate(), 'yt-dlp', lambda: bool(finished))
+
+@app.route('/stream/stats')
+def stream_stats_view():
+    """Active /stream responses and their throughput"""
+    return jsonify({**stream_stats.stats(), 'tees': tees.stats()})
 
 @app.route('/status/<download_id>')
 def get_status(download_id):
@@ -389,7 +972,132 @@ def get_status(download_id):
     if download_id not in downloads:
         return jsonify({'error': 'Download not found'}), 404
     
-    return jsonify(downloads[download_id])
+    return jsonify(job_status(download_id))
+
+@app.route('/events/<download_id>')
+@app.route('/events')
+def job_event_stream(download_id=None):
+    """Server-Sent Events feed of status changes for one or more downloads"""
+    if download_id:
+        download_ids = [download_id]
+    else:
+        download_ids = [i for i in request.args.get('ids', '').split(',') if i]
+    
+    if not download_ids:
+        return jsonify({'error': 'No downloads given'}), 400
+    if not all(i in downloads for i in download_ids):
+        return jsonify({'error': 'Download not found'}), 404
+    # The page falls back to polling /status when this is refused
+    full = streams_full()
+    if full:
+        return full
+    
+    def generate():
+        """Emit an event only when a job's status, percent or queue position changes"""
+        last_sent = {}
+        last_write = time.time()
+        yield 'retry: 3000\n\n'
+        while True:
+            # Snapshot before reading, so a change made mid-read still wakes us
+            seen = job_events.snapshot(download_ids)
+            for job_id in download_ids:
+                if job_id not in downloads:
+                    continue
+                status = job_status(job_id)
+                state = (status['status'], round(status.get('percent') or 0, 1), status.get('queue_position'))
+                if last_sent.get(job_id) != state:
+                    last_sent[job_id] = state
+                    last_write = time.time()
+                    yield f'event: progress\ndata: {json.dumps(dict(status, id=job_id))}\n\n'
+            
+            if all(job_id not in downloads or downloads[job_id]['status'] in FINISHED_STATUSES
+                   for job_id in download_ids):
+                yield 'event: end\ndata: {}\n\n'
+                return
+            
+            # Throttle: changes during this pause are coalesced into the next event
+            time.sleep(EVENTS_MIN_INTERVAL)
+            if downloads.shared:
+                # Jobs owned by other workers don't notify us; re-read the store
+                time.sleep(CONTROL_POLL_INTERVAL)
+                if time.time() - last_write >= EVENTS_HEARTBEAT:
+                    last_write = time.time()
+                    yield ': keepalive\n\n'
+            elif job_events.wait(download_ids, seen, EVENTS_HEARTBEAT) == seen:
+                yield ': keepalive\n\n'
+    
+    return Response(monitored(generate(), 'events', route='events'), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let a proxy buffer the stream
+    })
+
+def control_process(download_id, action):
+    """
+    Pause, resume or cancel a download's process in this worker
+    
+    Returns False if the process runs in another worker (or isn't running)
+    """
+    process = download_processes.get(download_id)
+    if process is None:
+        return False
+    if action == 'pause':
+        process.send_signal(signal.SIGSTOP)  # Pause the process
+    elif action == 'resume':
+        process.send_signal(signal.SIGCONT)  # Resume the process
+    else:
+        process.terminate()  # Try graceful termination first
+        time.sleep(0.5)
+        if process.poll() is None:  # If still running
+            process.kill()  # Force kill
+        download_processes.pop(download_id, None)
+    return True
+
+def cancel_job(download_id):
+    """Stop a job whether it's queued or running, and mark it cancelled"""
+    # Drop it from the queue if it hasn't started yet (a queued job in another
+    # worker sees the 'cancelled' status and never starts)
+    if scheduler.cancel(download_id):
+        # download_video won't run to remove the job directory, and a
+        # restart would otherwise resume the job from it
+        job_dir = DOWNLOAD_DIR / download_id
+        lock = checkpoint.claim(job_dir)
+        if lock:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            checkpoint.release(lock)
+    
+    # Kill the process if it's running
+    try:
+        request_control(download_id, 'cancel')
+    except:
+        pass
+    
+    # Update status
+    update_job(download_id, status='cancelled', progress='Download cancelled by user')
+
+def request_control(download_id, action):
+    """Apply a control action here, or hand it to the worker that owns the process"""
+    if control_process(download_id, action):
+        return True
+    if downloads.shared and downloads[download_id]['status'] in ('downloading', 'paused'):
+        update_job(download_id, control=action)  # Picked up by that worker's watch_controls()
+        return True
+    return False
+
+def watch_controls():
+    """Apply pause/resume/cancel requests that other workers wrote to the shared store"""
+    while True:
+        time.sleep(CONTROL_POLL_INTERVAL)
+        for download_id in list(download_processes):
+            action = downloads.get(download_id, {}).get('control')
+            if action:
+                update_job(download_id, control=None)
+                try:
+                    control_process(download_id, action)
+                except Exception as e:
+                    print(f"Control '{action}' failed for {download_id}: {e}")
+
+if downloads.shared:
+    threading.Thread(target=watch_controls, daemon=True, name='control-watcher').start()
 
 @app.route('/pause/<download_id>', methods=['POST'])
 def pause_download(download_id):
@@ -398,16 +1106,12 @@ def pause_download(download_id):
         return jsonify({'error': 'Download not found'}), 404
     
     # Pause the process if it's running
-    if download_id in download_processes:
-        try:
-            import signal
-            process = download_processes[download_id]
-            process.send_signal(signal.SIGSTOP)  # Pause the process
-            downloads[download_id]['status'] = 'paused'
-            downloads[download_id]['progress'] = 'Download paused'
+    try:
+        if request_control(download_id, 'pause'):
+            update_job(download_id, status='paused', progress='Download paused')
             return jsonify({'success': True, 'message': 'Download paused'})
-        except Exception as e:
-            return jsonify({'error': f'Failed to pause: {str(e)}'}), 500
+    except Exception as e:
+        return jsonify({'error': f'Failed to pause: {str(e)}'}), 500
     
     return jsonify({'error': 'No active process to pause'}), 400
 
@@ -418,16 +1122,12 @@ def resume_download(download_id):
         return jsonify({'error': 'Download not found'}), 404
     
     # Resume the process if it's paused
-    if download_id in download_processes:
-        try:
-            import signal
-            process = download_processes[download_id]
-            process.send_signal(signal.SIGCONT)  # Resume the process
-            downloads[download_id]['status'] = 'downloading'
-            downloads[download_id]['progress'] = 'Download resumed'
+    try:
+        if request_control(download_id, 'resume'):
+            update_job(download_id, status='downloading', progress='Download resumed')
             return jsonify({'success': True, 'message': 'Download resumed'})
-        except Exception as e:
-            return jsonify({'error': f'Failed to resume: {str(e)}'}), 500
+    except Exception as e:
+        return jsonify({'error': f'Failed to resume: {str(e)}'}), 500
     
     return jsonify({'error': 'No paused process to resume'}), 400
 
@@ -437,21 +1137,7 @@ def cancel_download(download_id):
     if download_id not in downloads:
         return jsonify({'error': 'Download not found'}), 404
     
-    # Kill the process if it's running
-    if download_id in download_processes:
-        try:
-            process = download_processes[download_id]
-            process.terminate()  # Try graceful termination first
-            time.sleep(0.5)
-            if process.poll() is None:  # If still running
-                process.kill()  # Force kill
-            del download_processes[download_id]
-        except:
-            pass
-    
-    # Update status
-    downloads[download_id]['status'] = 'cancelled'
-    downloads[download_id]['progress'] = 'Download cancelled by user'
+    cancel_job(download_id)
     
     return jsonify({'success': True, 'message': 'Download cancelled'})
 
@@ -471,7 +1157,116 @@ def download_file(download_id):
     if not os.path.exists(file_path):
         return jsonify({'error': 'File not found'}), 404
     
-    return send_file(file_path, as_attachment=True)
+    # Remember the fetch, so the janitor and the cache keep files people still use
+    download_cache.touch(file_path)
+    if time.time() - (download_info.get('fetched') or 0) > FETCH_TOUCH_INTERVAL:
+        update_job(download_id, fetched=time.time())
+    
+    # Cached files are stored under their hash; send them with the user's filename
+    download_name = Path(download_info['filename']).with_suffix(Path(file_path).suffix).name
+    # Supports Range/If-Range/ETag, so dropped downloads resume and players can seek
+    response = send_media(file_path, download_name, DOWNLOAD_DIR)
+    served_bytes.inc(response.content_length or 0, route='download-file')
+    return response
+
+@metrics.collector
+def collect_state():
+    """Refresh gauges that mirror state kept elsewhere, at scrape time"""
+    counts = dict.fromkeys(('queued', 'downloading', 'paused') + FINISHED_STATUSES, 0)
+    for job_id in downloads.ids():
+        record = downloads.get(job_id)
+        if record:
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+    for status, count in counts.items():
+        jobs_by_status.set(count, status=status)
+    
+    queue = scheduler.stats()
+    queue_depth.set(queue['queued'], state='queued')
+    queue_depth.set(queue['running'], state='running')
+    
+    for name, cache in (('download', download_cache), ('probe', probe_cache)):
+        stats = cache.stats()
+        cache_requests.set(stats['hits'] + stats.get('disk_hits', 0), cache=name, result='hit')
+        cache_requests.set(stats['misses'], cache=name, result='miss')
+    cache_requests.set(probe_cache.stats()['coalesced'], cache='probe', result='coalesced')
+    sources = source_picker.stats()
+    cache_requests.set(sources['hits'], cache='source', result='hit')
+    cache_requests.set(sources['misses'], cache='source', result='miss')
+    cache_bytes.set(download_cache.stats()['bytes'])
+    
+    usage = shutil.disk_usage(DOWNLOAD_DIR)
+    disk_bytes.set(usage.free, state='free')
+    disk_bytes.set(usage.used, state='used')
+    disk_bytes.set(janitor.reserved_bytes(), state='reserved')
+    
+    streams = stream_stats.stats()
+    for kind in ('remux', 'yt-dlp', 'tee'):
+        active_streams.set(streams['active_by_kind'].get(kind, 0), kind=kind)
+    stream_rate.set(streams['bytes_per_second'])
+
+@app.route('/metrics')
+def metrics_view():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def admin_authorized():
+    """Whether the request carries ADMIN_TOKEN (Authorization: Bearer <token>)"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.strip(), ADMIN_TOKEN)
+
+def _rate(value):
+    """A bytes/s limit from a request body: a number >= 0, or null"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f'Not a rate in bytes/s: {value!r}')
+    return int(value)
+
+@app.route('/admin/bandwidth', methods=['GET', 'POST'])
+def admin_bandwidth():
+    """
+    Bandwidth limits and active flows; POST changes limits, e.g.
+    {"rate": 50000000, "caps": {"download": 5000000}, "weights": {"stream": 8},
+     "flows": {"<download_id>": 1000000}}
+    in bytes/s, 0 = no limit; a flow set to null follows its kind's cap again
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are off; set ADMIN_TOKEN'}), 404
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401, {'WWW-Authenticate': 'Bearer'}
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        kinds = (DOWNLOAD, STREAM)
+        caps = data.get('caps') or {}
+        weights = data.get('weights') or {}
+        flows = data.get('flows') or {}
+        try:
+            if not all(isinstance(d, dict) for d in (caps, weights, flows)):
+                raise ValueError('caps, weights and flows must be objects')
+            if set(caps) - set(kinds) or set(weights) - set(kinds):
+                raise ValueError(f'Kinds are {", ".join(kinds)}')
+            if any(isinstance(w, bool) or not isinstance(w, (int, float)) or w <= 0 for w in weights.values()):
+                raise ValueError('Weights must be positive numbers')
+            bandwidth.configure(
+                rate=_rate(data.get('rate')),
+                caps={kind: _rate(cap) or 0 for kind, cap in caps.items()},
+                weights={kind: float(weight) for kind, weight in weights.items()},
+                flows={label: _rate(cap) for label, cap in flows.items()}
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify(bandwidth.stats())
+
+@app.route('/debug/profile')
+def profile_view():
+    """Summed cProfile output of sampled requests (PROFILE_SAMPLE_RATE > 0)"""
+    if not profiler.enabled:
+        return jsonify({'error': 'Profiling is off; set PROFILE_SAMPLE_RATE'}), 404
+    return Response(profiler.report(), mimetype='text/plain')
+
+# Pick up downloads interrupted by a restart or deploy
+resume_unfinished_jobs()
+janitor.start()
 
 if __name__ == '__main__':
     print("\n" + "="*60)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Bandwidth Shaping
+Token buckets shared by server-side downloads and /stream responses:
+an optional cap per flow (one download job or one stream), and an
+optional global cap that active flows share by weight, so interactive
+streams keep moving while a large background download runs.
+Limits can be changed at runtime (see /admin/bandwidth in app.py).
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import closing
+
+BURST_SECONDS = 0.25  # Tokens a bucket can bank: this many seconds at its rate
+SLEEP_SLICE = 0.25  # Longest single sleep, so closed flows and new limits apply quickly
+
+DOWNLOAD = 'download'
+STREAM = 'stream'
+
+
+class TokenBucket:
+    """
+    rate bytes/s (0 = unlimited)
+
+    reserve(n) takes n tokens at once and returns how long to wait before
+    sending them; a chunk larger than the burst just waits longer.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            if rate != self.rate:
+                self.rate = rate
+                self._tokens = min(self._tokens, 0.0)
+
+    def reserve(self, n):
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.rate * BURST_SECONDS)
+            self._updated = now
+            self._tokens -= n
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class Flow:
+    """
+    One download or stream's share of the shaper
+
+    consume(n) blocks until n more bytes may move. cap overrides the
+    shaper's per-kind cap for this flow (None = use it, 0 = uncapped).
+    After close(), consume returns at once.
+    """
+
+    def __init__(self, shaper, kind, label=None, cap=None):
+        self.shaper = shaper
+        self.kind = kind
+        self.label = label
+        self.cap = cap
+        self.bucket = TokenBucket()
+        self.finish = 0.0  # Virtual finish time of this flow's last grant (weighted fair queueing)
+        self.bytes = 0
+        self.waited = 0.0
+        self.started = time.time()
+        self.closed = False
+
+    def limit(self):
+        """The per-flow cap in effect, bytes/s (0 = none)"""
+        return self.shaper.caps.get(self.kind, 0) if self.cap is None else self.cap
+
+    def _sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.closed:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            time.sleep(min(left, SLEEP_SLICE))
+
+    def consume(self, n):
+        if self.closed:
+            return
+        started = time.monotonic()
+        self.bucket.set_rate(self.limit())
+        self._sleep(self.bucket.reserve(n))
+        self.shaper.grant(self, n)
+        self.waited += time.monotonic() - started
+        self.bytes += n
+
+    def close(self):
+        self.closed = True
+        self.shaper.release(self)
+
+    def stats(self):
+        elapsed = time.time() - self.started
+        return {
+            'kind': self.kind,
+            'label': self.label,
+            'cap': self.limit(),
+            'bytes': self.bytes,
+            'bytes_per_second': round(self.bytes / elapsed) if elapsed > 0 else 0,
+            'waited_seconds': round(self.waited, 3),
+        }
+
+
+class Shaper:
+    """
+    rate: global cap in bytes/s (0 = none); caps: per-flow cap by kind;
+    weights: share of the global cap by kind
+
+    While the global cap is in force, waiting flows are served in order
+    of virtual finish time (bytes / weight), so each active flow gets
+    rate * its weight / the sum of active weights, and whatever an idle
+    or slower flow doesn't use goes to the others.
+    """
+
+    def __init__(self, rate=0, caps=None, weights=None):
+        self.rate = rate
+        self.caps = {DOWNLOAD: 0, STREAM: 0, **(caps or {})}
+        self.weights = {DOWNLOAD: 1, STREAM: 4, **(weights or {})}
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._vclock = 0.0
+        self._queue = []  # [finish, seq, flow, n, waiting] entries, smallest finish first
+        self._sequence = itertools.count()
+        self._flows = set()
+        self._cond = threading.Condition()
+
+    def flow(self, kind, label=None, cap=None):
+        flow = Flow(self, kind, label, cap)
+        with self._cond:
+            self._flows.add(flow)
+        return flow
+
+    def release(self, flow):
+        with self._cond:
+            self._flows.discard(flow)
+            self._cond.notify_all()
+
+    def configure(self, rate=None, caps=None, weights=None, flows=None):
+        """Change limits while running; flows maps a flow label to its own cap (None = kind's)"""
+        with self._cond:
+            if rate is not None:
+                self.rate = rate
+                self._tokens = min(self._tokens, 0.0)
+            self.caps.update(caps or {})
+            self.weights.update({kind: max(weight, 0.01) for kind, weight in (weights or {}).items()})
+            for flow in self._flows:
+                if flow.label in (flows or {}):
+                    flow.cap = flows[flow.label]
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.rate * BURST_SECONDS)
+        self._updated = now
+
+    def grant(self, flow, n):
+        """Block until the global cap lets flow move n bytes"""
+        with self._cond:
+            if not self.rate:
+                return
+            flow.finish = max(flow.finish, self._vclock) + n / self.weights.get(flow.kind, 1)
+            entry = [flow.finish, next(self._sequence), flow, n, True]
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    while self._queue and not self._queue[0][4]:
+                        heapq.heappop(self._queue)  # Left by a flow that gave up waiting
+                    if flow.closed or not self.rate:
+                        return
+                    self._refill()
+                    if self._queue[0] is entry and self._tokens > 0:
+                        heapq.heappop(self._queue)
+                        # May go into debt for a chunk larger than the tokens banked
+                        self._tokens -= n
+                        self._vclock = entry[0]
+                        return
+                    head = self._queue[0] is entry
+                    self._cond.wait(min(max(-self._tokens / self.rate, 0.001), SLEEP_SLICE) if head else SLEEP_SLICE)
+            finally:
+                entry[4] = False
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            flows = [flow.stats() for flow in self._flows]
+            return {
+                'rate': self.rate,
+                'caps': dict(self.caps),
+                'weights': dict(self.weights),
+                'waiting': sum(1 for entry in self._queue if entry[4]),
+                'flows': sorted(flows, key=lambda f: (f['kind'], -f['bytes_per_second'])),
+            }
+
+
+def shaped(chunks, shaper, kind, label=None):
+    """Pass a response body through at the pace the shaper allows"""
+    flow = shaper.flow(kind, label)
+    try:
+        with closing(iter(chunks)) as body:
+            for chunk in body:
+                flow.consume(len(chunk))
+                yield chunk
+    finally:
+        flow.close()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Batch Downloads
+Runs a list of URLs, or the entries of one playlist/page, as a batch of
+ordinary download jobs: a few at a time, with aggregate progress and a
+manifest of the results
+"""
+
+import os
+import re
+import threading
+import time
+import uuid
+
+ACTIVE_STATUSES = ('queued', 'downloading', 'paused')
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+
+
+def item_filename(prefix, index, title):
+    """Numbered, filesystem-safe name for a batch item"""
+    slug = re.sub(r'[^A-Za-z0-9._-]+', '-', title or '').strip('-.')[:60]
+    return f"{prefix}-{index:03d}{'-' + slug if slug else ''}.mp4"
+
+
+class BatchManager:
+    """
+    Batch records live in their own store (same backends as jobs)
+
+    submit(url, filename, quality, owner) must return the download_id of
+    the job created (or joined), or raise ValueError with a reason the item
+    can't run. jobs is the job store, events the JobEvents used to wake
+    when items change. Each batch is driven by a thread in the worker
+    that created it.
+    """
+
+    def __init__(self, store, jobs, events, submit, expand, parallel=2, max_items=50):
+        self.store = store
+        self.jobs = jobs
+        self.events = events
+        self.submit = submit
+        self.expand = expand
+        self.parallel = parallel
+        self.max_items = max_items
+
+    def create(self, urls=None, source=None, quality='best', prefix='video', parallel=None, owner=None):
+        """Start a batch from a URL list, or from a playlist/page URL expanded once"""
+        urls = [u.strip() for u in urls or [] if u and u.strip()]
+        if len(urls) > self.max_items:
+            raise ValueError(f'At most {self.max_items} URLs per batch')
+        batch_id = str(uuid.uuid4())
+        self.store[batch_id] = {
+            'status': 'expanding' if source else 'running',
+            'source': source,
+            'quality': quality,
+            'prefix': prefix,
+            'parallel': max(1, min(parallel or self.parallel, self.parallel)),
+            'owner': owner,
+            'items': [{'url': url, 'title': None, 'download_id': None, 'error': None} for url in urls],
+            'created': time.time(),
+        }
+        threading.Thread(target=self._run, args=(batch_id,), daemon=True).start()
+        return batch_id
+
+    def _run(self, batch_id):
+        try:
+            batch = self.store[batch_id]
+            if batch['source']:
+                entries = self.expand(batch['source'])[:self.max_items]
+                if not entries:
+                    self.store.update(batch_id, {'status': 'error', 'error': 'No videos found',
+                                             'finished': time.time()})
+                    return
+                items = [{'url': url, 'title': title, 'download_id': None, 'error': None}
+                         for url, title in entries]
+                self.store.update(batch_id, {'status': 'running', 'items': items})
+            while not self._pump(batch_id):
+                ids = [i['download_id'] for i in self.store[batch_id]['items'] if i['download_id']]
+                seen = self.events.snapshot(ids)
+                self.events.wait(ids, seen, 5)
+        except Exception as e:
+            self.store.update(batch_id, {'status': 'error', 'error': str(e), 'finished': time.time()})
+
+    def _pump(self, batch_id):
+        """Start items while under the batch's parallel limit; returns True once all are finished"""
+        batch = self.store[batch_id]
+        if batch['status'] == 'cancelled':
+            return True
+        items = batch['items']
+        statuses = [self._item_status(item) for item in items]
+        running = sum(status in ACTIVE_STATUSES for status in statuses)
+        changed = False
+        for index, item in enumerate(items):
+            if running >= batch['parallel']:
+                break
+            if item['download_id'] or item['error']:
+                continue
+            if self.store[batch_id]['status'] == 'cancelled':
+                return True  # Cancelled while this pass was starting items
+            filename = item_filename(batch['prefix'], index + 1, item['title'])
+            try:
+                item['download_id'] = self.submit(item['url'], filename, batch['quality'], batch['owner'])
+            except ValueError as e:
+                item['error'] = str(e)
+            changed = True
+            statuses[index] = self._item_status(item)
+            running += statuses[index] in ACTIVE_STATUSES
+        finished = all(status in FINISHED_STATUSES for status in statuses)
+        if changed or finished:
+            fields = {'items': items}
+            if finished:
+                fields.update(status='completed', finished=time.time())
+            self.store.update(batch_id, fields)
+        return finished
+
+    def _item_status(self, item):
+        if item['error']:
+            return 'error'
+        if not item['download_id']:
+            return 'pending'
+        job = self.jobs.get(item['download_id'])
+        return job['status'] if job else 'error'
+
+    def cancel(self, batch_id):
+        """Stop starting new items; returns the download_ids still running"""
+        batch = self.store[batch_id]
+        self.store.update(batch_id, {'status': 'cancelled', 'finished': time.time()})
+        return [item['download_id'] for item in batch['items']
+                if item['download_id'] and self._item_status(item) in ACTIVE_STATUSES]
+
+    def status(self, batch_id):
+        """Aggregate and per-item progress"""
+        batch = self.store[batch_id]
+        items = []
+        counts = {}
+        percent = 0.0
+        downloaded = 0
+        for item in batch['items']:
+            job = self.jobs.get(item['download_id']) if item['download_id'] else None
+            status = self._item_status(item)
+            counts[status] = counts.get(status, 0) + 1
+            item_percent = 100.0 if status == 'completed' else (job or {}).get('percent') or 0
+            percent += item_percent
+            downloaded += (job or {}).get('file_bytes') or (job or {}).get('downloaded_bytes') or 0
+            items.append({
+                'url': item['url'],
+                'title': item['title'],
+                'download_id': item['download_id'],
+                'status': status,
+                'percent': item_percent,
+                'progress': (job or {}).get('progress') or item['error'],
+            })
+        return {
+            'batch_id': batch_id,
+            'status': batch['status'],
+            'error': batch.get('error'),
+            'total': len(items),
+            'counts': counts,
+            'percent': percent / len(items) if items else 0.0,
+            'downloaded_bytes': downloaded,
+            'items': items,
+        }
+
+    def completed_files(self, batch_id):
+        """(download_id, path, name) of the batch's finished files"""
+        files = []
+        for item in self.store[batch_id]['items']:
+            job = self.jobs.get(item['download_id']) if item['download_id'] else None
+            if job and job['status'] == 'completed' and job.get('file') and os.path.isfile(job['file']):
+                name = os.path.splitext(job['filename'])[0] + os.path.splitext(job['file'])[1]
+                files.append((item['download_id'], job['file'], name))
+        return files
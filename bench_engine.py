@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Download Engine Benchmark
+Compares per-job startup latency and memory of the in-process HLS engine
+against spawning a yt-dlp interpreter, using a local HLS stand-in server
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from hls_engine import HLSDownload
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_stream(directory, segments, segment_size):
+    """Write a VOD playlist with random TS-sized segments"""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+    for i in range(segments):
+        (directory / f'seg{i:05d}.ts').write_bytes(os.urandom(segment_size))
+        lines += ['#EXTINF:4.0,', f'seg{i:05d}.ts']
+    lines.append('#EXT-X-ENDLIST')
+    (directory / 'index.m3u8').write_text('\n'.join(lines) + '\n')
+
+
+def run_child(command):
+    """Run a command, returning (seconds, peak RSS in MB) for that child only"""
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is KB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return elapsed, usage.ru_maxrss / scale, process.returncode
+
+
+def bench_subprocess(url, output_dir, jobs):
+    """yt-dlp interpreter per job: bare startup, then a full download"""
+    startup = [run_child([sys.executable, '-m', 'yt_dlp', '--version']) for _ in range(jobs)]
+    if startup[0][2] != 0:
+        print("yt-dlp is not installed; skipping subprocess path")
+        return None
+    full = [run_child([sys.executable, '-m', 'yt_dlp', '--no-check-certificate', '--quiet',
+                       '--concurrent-fragments', '16', '-o', str(output_dir / f'ytdlp{i}.%(ext)s'), url])
+            for i in range(jobs)]
+    return {
+        'startup': sum(r[0] for r in startup) / jobs,
+        'total': sum(r[0] for r in full) / jobs,
+        'memory': max(r[1] for r in full),
+    }
+
+
+def bench_native(url, output_dir, jobs):
+    """In-process engine: time to first segment, total time and peak Python heap per job"""
+    first, totals, peaks = [], [], []
+    for i in range(jobs):
+        started = time.perf_counter()
+        first_segment = []
+
+        def progress(done, total, bytes_done, speed):
+            if not first_segment:
+                first_segment.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        HLSDownload(url, output_dir / f'native{i}', progress=progress).run()
+        peaks.append(tracemalloc.get_traced_memory()[1] / (1024 * 1024))
+        tracemalloc.stop()
+        totals.append(time.perf_counter() - started)
+        first.append(first_segment[0])
+    return {
+        'startup': sum(first) / jobs,
+        'total': sum(totals) / jobs,
+        'memory': max(peaks),
+    }
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    segments = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    segment_size = 256 * 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        stream_dir = tmp / 'stream'
+        output_dir = tmp / 'out'
+        stream_dir.mkdir()
+        output_dir.mkdir()
+        make_stream(stream_dir, segments, segment_size)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=str(stream_dir)))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/index.m3u8'
+
+        print(f"\n{jobs} jobs x {segments} segments x {segment_size // 1024} KB\n")
+        results = {'native engine': bench_native(url, output_dir, jobs),
+                   'yt-dlp subprocess': bench_subprocess(url, output_dir, jobs)}
+        server.shutdown()
+
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    print(f"{'path':<20}{'startup (s)':>14}{'job total (s)':>16}{'memory/job (MB)':>18}")
+    print("-" * 68)
+    for name, result in results.items():
+        if result:
+            print(f"{name:<20}{result['startup']:>14.3f}{result['total']:>16.3f}{result['memory']:>18.1f}")
+    print("\nstartup = time to first segment (native) / interpreter start to exit of --version (yt-dlp)")
+    print("memory  = peak Python heap of the job (native) / peak RSS of the child process (yt-dlp)")
+    print(f"benchmark process peak RSS: {base_rss:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
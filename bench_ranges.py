@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Range Downloader Benchmark
+Downloads one direct file from a local stand-in server that throttles
+each connection (like most CDNs do), with different connection counts
+"""
+
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from range_fetcher import RangeDownload
+
+PER_CONNECTION_RATE = 4 * 1024 * 1024  # Bytes/s each connection is held to
+SEND_SIZE = 64 * 1024
+
+
+def make_handler(data, rate):
+    etag = '"' + hashlib.md5(data).hexdigest() + '"'
+
+    class ThrottledHandler(BaseHTTPRequestHandler):
+        """Serves `data` with Range support, at most `rate` bytes/s per connection"""
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            start, end = 0, len(data) - 1
+            match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if_range = self.headers.get('If-Range')
+            if match and (not if_range or if_range == etag):
+                start = int(match.group(1))
+                end = min(int(match.group(2) or end), end)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.end_headers()
+            started = time.perf_counter()
+            sent = 0
+            try:
+                for offset in range(start, end + 1, SEND_SIZE):
+                    chunk = data[offset:min(offset + SEND_SIZE, end + 1)]
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    ahead = sent / rate - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return ThrottledHandler
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    counts = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4, 8, 16]
+    data = os.urandom(size_mb * 1024 * 1024)
+    digest = hashlib.sha256(data).hexdigest()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(data, PER_CONNECTION_RATE))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/video.mp4'
+
+    print(f"\n{size_mb} MB file, server limited to {PER_CONNECTION_RATE // (1024 * 1024)} MB/s per connection\n")
+    print(f"{'connections':>12}{'time (s)':>12}{'MB/s':>10}{'speedup':>10}")
+    print("-" * 44)
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for connections in counts:
+            output = Path(tmp) / f'out{connections}.mp4'
+            started = time.perf_counter()
+            RangeDownload(url, output, connections=connections).run()
+            elapsed = time.perf_counter() - started
+            if hashlib.sha256(output.read_bytes()).hexdigest() != digest:
+                print(f"{connections:>12}  output does not match the source!")
+                continue
+            baseline = baseline or elapsed
+            print(f"{connections:>12}{elapsed:>12.2f}{size_mb / elapsed:>10.1f}{baseline / elapsed:>9.1f}x")
+            output.unlink()
+    server.shutdown()
+    print("\n1 connection = one sequential stream, like yt-dlp's single HTTP download")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Page Scraper Benchmark
+Compares the streaming scraper against the old whole-page findall passes
+over a corpus of saved HTML pages (a synthetic corpus is generated if no
+directory is given)
+"""
+
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+from scraper import CHUNK_SIZE, pick_candidate, scan_chunks
+
+BASE_URL = 'https://example.com/watch/1'
+
+
+def legacy_extract(html):
+    """The original extract_video_url body, minus the fetch"""
+    m3u8_urls = re.findall(r'https?://[^\s<>"]+?\.m3u8[^\s<>"]*', html)
+    if m3u8_urls:
+        return m3u8_urls[0]
+    mp4_urls = re.findall(r'https?://[^\s<>"]+?\.mp4[^\s<>"]*', html)
+    if mp4_urls:
+        return mp4_urls[0]
+    return None
+
+
+def streaming_extract(data):
+    """Returns (url, bytes read) for the streaming scraper fed from memory"""
+    read = [0]
+
+    def chunks():
+        for start in range(0, len(data), CHUNK_SIZE):
+            chunk = data[start:start + CHUNK_SIZE]
+            read[0] += len(chunk)
+            yield chunk
+
+    candidates, _ = scan_chunks(chunks(), BASE_URL)
+    return pick_candidate(candidates), read[0]
+
+
+def synthetic_corpus(count=40, seed=1):
+    """Pages of 200 KB - 1.5 MB with the player config at varying depths"""
+    rng = random.Random(seed)
+    filler = ('<div class="item"><a href="https://example.com/p/{n}">Post {n}</a>'
+              '<img src="https://img.example.com/{n}.jpg"></div>\n')
+    players = [
+        '<script>var player = {{"file": "https:\\/\\/cdn.example.com\\/v\\/{n}\\/index.m3u8?token=abc\\u0026e=1"}};</script>',
+        '<video><source src="/media/{n}/master.m3u8" type="application/x-mpegURL"></video>',
+        '<a href="https://cdn.example.com/dl/{n}.mp4">Download</a>',
+        '',  # Nothing to find: the whole page is read
+    ]
+    pages = []
+    for i in range(count):
+        size = rng.randint(200, 1500) * 1024
+        body = []
+        length = 0
+        n = 0
+        while length < size:
+            line = filler.format(n=n)
+            body.append(line)
+            length += len(line)
+            n += 1
+        body.insert(int(len(body) * rng.choice((0.05, 0.3, 0.6, 0.95))), rng.choice(players).format(n=i))
+        pages.append((f'synthetic-{i}', ('<html><body>' + ''.join(body) + '</body></html>').encode()))
+    return pages
+
+
+def load_corpus(directory):
+    return [(path.name, path.read_bytes()) for path in sorted(Path(directory).glob('*.htm*'))]
+
+
+def main():
+    pages = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else synthetic_corpus()
+    if not pages:
+        print("No .html files found")
+        sys.exit(1)
+    rounds = 5
+
+    legacy_time = streaming_time = 0.0
+    total_bytes = read_bytes = 0
+    legacy_found = streaming_found = 0
+    for name, data in pages:
+        for _ in range(rounds):
+            started = time.perf_counter()
+            legacy_url = legacy_extract(data.decode('utf-8', errors='replace'))
+            legacy_time += time.perf_counter() - started
+
+            started = time.perf_counter()
+            streaming_url, read = streaming_extract(data)
+            streaming_time += time.perf_counter() - started
+        total_bytes += len(data)
+        read_bytes += read
+        legacy_found += legacy_url is not None
+        streaming_found += streaming_url is not None
+
+    runs = len(pages) * rounds
+    print(f"\n{len(pages)} pages, {total_bytes / (1024 * 1024):.1f} MB, {rounds} rounds\n")
+    print(f"{'scraper':<12}{'ms/page':>10}{'found':>8}{'bytes read':>14}")
+    print("-" * 44)
+    print(f"{'findall':<12}{legacy_time * 1000 / runs:>10.2f}{legacy_found:>8}{'100%':>14}")
+    print(f"{'streaming':<12}{streaming_time * 1000 / runs:>10.2f}{streaming_found:>8}"
+          f"{read_bytes * 100 / total_bytes:>13.0f}%")
+    print("\nbytes read = share of the corpus the scraper had to receive before answering")
+
+
+if __name__ == '__main__':
+    main()
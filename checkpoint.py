@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Download Checkpoints
+Persists what a server-side job needs to resume after a worker restart:
+the job's parameters, the HLS segment manifest and how far it got, or
+how far each piece of a parallel range download got
+"""
+
+import fcntl
+import json
+import os
+import time
+from pathlib import Path
+
+# Control files live next to the download, dot-prefixed so they're never
+# mistaken for the downloaded file
+JOB_FILE = '.job.json'
+MANIFEST_FILE = '.manifest.json'
+PROGRESS_FILE = '.checkpoint.json'
+RANGES_FILE = '.ranges.json'
+LOCK_FILE = '.lock'
+
+
+def write_json(path, data):
+    """Atomically replace a JSON file"""
+    path = Path(path)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_job(job_dir, info):
+    """Record the parameters a job was submitted with"""
+    write_json(Path(job_dir) / JOB_FILE, info)
+
+
+def claim(job_dir):
+    """
+    Take the job's lock; returns a handle to keep open while working on
+    it, or None if another worker process holds it
+    """
+    try:
+        handle = open(Path(job_dir) / LOCK_FILE, 'a')
+    except OSError:
+        return None  # Job directory is gone (the job already finished)
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def release(handle):
+    if handle:
+        handle.close()  # Closing drops the flock
+
+
+def find_unfinished(download_dir):
+    """Job directories left behind by a worker that died mid-download, as (job_dir, info)"""
+    unfinished = []
+    for job_file in Path(download_dir).glob(f'*/{JOB_FILE}'):
+        info = read_json(job_file)
+        handle = claim(job_file.parent)
+        if info and handle:
+            unfinished.append((job_file.parent, info))
+        release(handle)
+    return unfinished
+
+
+class SegmentCheckpoint:
+    """
+    Segment manifest + resume point of an in-process HLS download
+
+    The manifest is written once; the resume point (next segment index and
+    the output byte offset it starts at) is rewritten as segments land.
+    """
+
+    def __init__(self, job_dir, interval=1.0):
+        self.job_dir = Path(job_dir)
+        self.interval = interval
+        self._last_write = 0
+
+    def load(self):
+        """Returns (playlist, next_index, offset), or None if there's nothing to resume"""
+        playlist = read_json(self.job_dir / MANIFEST_FILE)
+        progress = read_json(self.job_dir / PROGRESS_FILE)
+        if not playlist:
+            return None
+        if not progress:
+            return playlist, 0, 0
+        return playlist, progress['next_index'], progress['offset']
+
+    def start(self, playlist):
+        write_json(self.job_dir / MANIFEST_FILE, playlist)
+
+    def clear(self):
+        """Forget the manifest (the job is no longer an in-process HLS download)"""
+        (self.job_dir / MANIFEST_FILE).unlink(missing_ok=True)
+        (self.job_dir / PROGRESS_FILE).unlink(missing_ok=True)
+
+    def due(self):
+        """Whether enough time has passed to write the resume point again"""
+        return time.time() - self._last_write >= self.interval
+
+    def update(self, next_index, offset):
+        """Record that everything before next_index is on disk, ending at offset"""
+        write_json(self.job_dir / PROGRESS_FILE, {'next_index': next_index, 'offset': offset})
+        self._last_write = time.time()
+
+
+class RangeCheckpoint:
+    """
+    Piece list + per-piece resume offsets of a parallel range download
+
+    Saved with the file's size and validator (ETag/Last-Modified), so a
+    resumed download only keeps the bytes if the file is still the same.
+    """
+
+    def __init__(self, job_dir, interval=1.0):
+        self.job_dir = Path(job_dir)
+        self.interval = interval
+        self._last_write = 0
+
+    def load(self):
+        """Returns {'size', 'validator', 'pieces': [[start, end, offset], ...]}, or None"""
+        return read_json(self.job_dir / RANGES_FILE)
+
+    def clear(self):
+        (self.job_dir / RANGES_FILE).unlink(missing_ok=True)
+
+    def due(self):
+        """Whether enough time has passed to write the resume point again"""
+        return time.time() - self._last_write >= self.interval
+
+    def update(self, size, validator, pieces):
+        """Record that each piece is on disk from its start up to its offset"""
+        write_json(self.job_dir / RANGES_FILE, {'size': size, 'validator': validator, 'pieces': pieces})
+        self._last_write = time.time()
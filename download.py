@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Bulk Video Downloader
+Downloads any number of URLs with the same engine as the web app
+(in-process HLS, parallel range requests, tuned yt-dlp), several at a time.
+Interrupted downloads resume when the same command is run again.
+
+Usage:
+  python3 download.py [--jobs N] [--quality 720p] [--output-dir DIR] url [url ...]
+  python3 download.py --jobs 4 --input urls.txt
+"""
+
+import argparse
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urlparse
+
+from batch import item_filename
+from download_cache import DownloadCache
+from engine import DEFAULT_CONNECTIONS, DownloadCancelled, DownloadError, download_file
+from progress import ProgressThrottle, format_progress
+from quality import normalize_quality
+
+GENERIC_NAMES = {'', 'index', 'master', 'playlist', 'video', 'manifest', 'chunklist'}
+
+
+def read_urls(path):
+    """URLs from a file, one per line; blank lines and # comments are skipped"""
+    lines = sys.stdin if path == '-' else open(path)
+    with lines:
+        return [line.strip() for line in lines if line.strip() and not line.startswith('#')]
+
+
+def output_name(prefix, index, url):
+    """Numbered file name, with the URL's own name when it says something"""
+    stem = Path(urlparse(url).path).stem
+    return item_filename(prefix, index, None if stem.lower() in GENERIC_NAMES else stem)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download videos, several at a time')
+    parser.add_argument('urls', nargs='*', help='m3u8, mp4 or page URLs')
+    parser.add_argument('-i', '--input', help="file with one URL per line ('-' for stdin)")
+    parser.add_argument('-j', '--jobs', type=int, default=3, help='downloads at once (default 3)')
+    parser.add_argument('-q', '--quality', default='best', help="'best' or a height like 720p (default best)")
+    parser.add_argument('-f', '--format-id', help='yt-dlp format id to download instead (see /check-formats)')
+    parser.add_argument('-c', '--connections', type=int, default=DEFAULT_CONNECTIONS,
+                        help=f'connections per download (default {DEFAULT_CONNECTIONS})')
+    parser.add_argument('-o', '--output-dir', default='.', help='where to save files (default: here)')
+    parser.add_argument('-p', '--prefix', default='video', help="file name prefix (default 'video')")
+    parser.add_argument('--cache', help='reuse finished downloads kept in this directory')
+    args = parser.parse_args()
+
+    urls = args.urls + (read_urls(args.input) if args.input else [])
+    if not urls:
+        parser.error('no URLs given')
+    try:
+        quality = normalize_quality(args.quality, args.format_id)
+    except ValueError as e:
+        parser.error(str(e))
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cache = DownloadCache(args.cache) if args.cache else None
+
+    jobs = {}  # name -> running engine.Download, for Ctrl+C
+    lock = threading.Lock()
+
+    def run(index, url):
+        name = output_name(args.prefix, index, url)
+        throttle = ProgressThrottle(2.0)
+
+        def progress(fields):
+            if throttle.ready():
+                print(f"[{name}] {format_progress(fields)}", flush=True)
+
+        def started(job):
+            with lock:
+                jobs[name] = job
+
+        try:
+            return name, download_file(url, output_dir / name, quality, args.connections,
+                                       progress=progress, cache=cache, started=started)
+        finally:
+            with lock:
+                jobs.pop(name, None)
+
+    print(f"Downloading {len(urls)} video(s), {args.jobs} at a time, into {output_dir.absolute()}\n")
+    failed = 0
+    pool = ThreadPoolExecutor(max_workers=max(1, args.jobs))
+    futures = {pool.submit(run, index, url): url for index, url in enumerate(urls, 1)}
+    try:
+        for future in as_completed(futures):
+            try:
+                name, path = future.result()
+                print(f"✓ {path}", flush=True)
+            except (DownloadError, OSError) as e:
+                failed += 1
+                print(f"✗ {futures[future]}: {e}", flush=True)
+            except DownloadCancelled:
+                failed += 1
+    except KeyboardInterrupt:
+        print("\nCancelling... (run the same command again to resume)")
+        for future in futures:
+            future.cancel()
+        with lock:
+            for job in jobs.values():
+                job.terminate()
+        pool.shutdown(wait=True)
+        sys.exit(130)
+    pool.shutdown()
+
+    print(f"\n{len(urls) - failed} downloaded, {failed} failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Download Cache
+Content-addressed store of finished downloads, keyed on the normalized
+media URL plus the requested format, with size-bounded LRU eviction and a
+TTL counted from each file's last use
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+INDEX_SAVE_INTERVAL = 30  # Seconds between index writes for access-time-only changes
+
+
+def normalize_url(url):
+    """Canonical form of a URL: lowercase scheme/host, no default port, fragment or utm_* params, sorted query"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith('utm_'))
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+
+def cache_key(url, fmt='best'):
+    """Cache key for a media URL + format"""
+    return hashlib.sha256(f'{normalize_url(url)}\n{fmt}'.encode()).hexdigest()
+
+
+class DownloadCache:
+    """
+    Finished files live in <root>/<key><ext>, described by <root>/index.json
+
+    Entries may be reached through aliases (e.g. the page URL a media URL
+    was extracted from). The index is re-read when another worker process
+    rewrites it, so all gunicorn workers on a host share one cache.
+    """
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, ttl=24 * 3600):
+        self.root = Path(root)
+        self.root.mkdir(exist_ok=True, parents=True)
+        self.index_path = self.root / 'index.json'
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = {}
+        self._aliases = {}
+        self._inflight = {}  # key -> download_id of the job producing it
+        self._index_mtime = None
+        self._last_save = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        try:
+            mtime = self.index_path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._index_mtime:
+            return
+        try:
+            index = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            return
+        self._entries = index.get('entries', {})
+        self._aliases = index.get('aliases', {})
+        self._index_mtime = mtime
+
+    def _save(self):
+        tmp_path = self.index_path.with_name(f'.index.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps({'entries': self._entries, 'aliases': self._aliases}))
+        os.replace(tmp_path, self.index_path)
+        self._index_mtime = self.index_path.stat().st_mtime
+        self._last_save = time.time()
+
+    def _resolve(self, key):
+        return self._aliases.get(key, key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            Path(entry['file']).unlink(missing_ok=True)
+        self._aliases = {a: k for a, k in self._aliases.items() if k != key}
+
+    def get(self, key):
+        """Path of a cached file for key, or None"""
+        with self._lock:
+            self._load()
+            key = self._resolve(key)
+            entry = self._entries.get(key)
+            if entry and self._expired(entry, time.time()):
+                self._drop(key)
+                self._save()
+                entry = None
+            if entry and not Path(entry['file']).exists():
+                self._drop(key)
+                self._save()
+                entry = None
+            if not entry:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry['accessed'] = time.time()
+            if time.time() - self._last_save > INDEX_SAVE_INTERVAL:
+                self._save()
+            return Path(entry['file'])
+
+    def put(self, keys, path, url=None, fmt=None):
+        """
+        Move a finished file into the cache under keys[0] (the rest become aliases)
+
+        Returns the file's new path
+        """
+        path = Path(path)
+        key = keys[0]
+        target = self.root / f'{key}{path.suffix}'
+        with self._lock:
+            self._load()
+            shutil.move(str(path), str(target))
+            now = time.time()
+            self._entries[key] = {
+                'file': str(target),
+                'size': target.stat().st_size,
+                'created': now,
+                'accessed': now,
+                'url': url,
+                'format': fmt,
+            }
+            for alias in keys[1:]:
+                if alias != key:
+                    self._aliases[alias] = key
+            self._evict(keep=key)
+            self._save()
+        return target
+
+    def _expired(self, entry, now):
+        return now - entry.get('accessed', entry['created']) > self.ttl
+
+    def touch(self, path):
+        """Note that the file at path was just used (e.g. fetched), for the TTL and LRU order"""
+        with self._lock:
+            self._load()
+            for entry in self._entries.values():
+                if entry['file'] == str(path):
+                    entry['accessed'] = time.time()
+                    if time.time() - self._last_save > INDEX_SAVE_INTERVAL:
+                        self._save()
+                    return
+
+    def _evict(self, keep=None, free_bytes=0):
+        """
+        Drop expired entries, then least recently used ones until under
+        max_bytes and at least free_bytes have been released
+        """
+        now = time.time()
+        freed = 0
+        for key in [k for k, e in self._entries.items() if self._expired(e, now) and k != keep]:
+            freed += self._entries[key]['size']
+            self._drop(key)
+        total = sum(e['size'] for e in self._entries.values())
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]['accessed']):
+            if total <= self.max_bytes and freed >= free_bytes:
+                break
+            if key != keep:
+                total -= entry['size']
+                freed += entry['size']
+                self._drop(key)
+        return freed
+
+    def evict(self, free_bytes=0):
+        """Apply the TTL and size limit now (and free extra space); returns bytes freed"""
+        with self._lock:
+            self._load()
+            freed = self._evict(free_bytes=free_bytes)
+            if freed:
+                self._save()
+            return freed
+
+    def discard(self, path):
+        """Remove the entry stored at path (and its aliases)"""
+        with self._lock:
+            self._load()
+            for key, entry in list(self._entries.items()):
+                if entry['file'] == str(path):
+                    self._drop(key)
+                    self._save()
+
+    def remove_orphans(self, min_age):
+        """Delete files in the cache directory the index doesn't know (left by a crash mid-put)"""
+        with self._lock:
+            self._load()
+            known = {entry['file'] for entry in self._entries.values()}
+            now = time.time()
+            for path in self.root.iterdir():
+                if path == self.index_path or str(path) in known or not path.is_file():
+                    continue
+                try:
+                    if now - path.stat().st_mtime > min_age:
+                        path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def claim(self, key, download_id):
+        """
+        Register download_id as producing key
+
+        Returns the id of a job already producing it (to join), or None
+        """
+        with self._lock:
+            owner = self._inflight.get(key)
+            if owner is not None:
+                return owner
+            self._inflight[key] = download_id
+            return None
+
+    def release(self, key, download_id):
+        with self._lock:
+            if self._inflight.get(key) == download_id:
+                del self._inflight[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(e['size'] for e in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'inflight': len(self._inflight),
+            }
@@ -4,20 +4,24 @@ Interactive M3U8 Video Downloader
 Prompts user for URL and downloads the video
 """
 
-import subprocess
 import sys
 from pathlib import Path
 
+from engine import DownloadError, download_file
+from progress import format_progress
+
+def show_progress(fields):
+    print(f"\r{format_progress(fields)}", end='', flush=True)
+
 def download_m3u8(url, output_filename):
     """
-    Download video from m3u8 URL using yt-dlp
+    Download video from m3u8 URL (in-process, falling back to yt-dlp)
     
     Args:
         url: The m3u8 stream URL
         output_filename: Name for the output file
     """
     output_path = Path(output_filename)
-    output_template = str(output_path.with_suffix(''))  # Remove extension, yt-dlp will add it
     
     print(f"\n{'='*60}")
     print(f"Downloading video from: {url}")
@@ -25,30 +29,14 @@ def download_m3u8(url, output_filename):
     print(f"{'='*60}\n")
     
     try:
-        # Use yt-dlp to download the m3u8 stream (run as Python module)
-        command = [
-            'python3', '-m', 'yt_dlp',
-            '--no-check-certificate',
-            '--allow-unplayable-formats',
-            '--fixup', 'never',
-            '-o', output_template,
-            '--merge-output-format', 'mp4',
-            url
-        ]
-        
-        # Run yt-dlp
-        result = subprocess.run(
-            command,
-            check=True,
-            capture_output=False
-        )
+        saved = download_file(url, output_path, progress=show_progress)
         
-        print(f"\n{'='*60}")
+        print(f"\n\n{'='*60}")
         print(f"✓ Download completed successfully!")
-        print(f"Video saved to: {output_path.absolute()}")
+        print(f"Video saved to: {saved.absolute()}")
         print(f"{'='*60}\n")
         
-    except subprocess.CalledProcessError as e:
+    except DownloadError as e:
         print(f"\n✗ Error during download: {e}")
         print("\nThe stream may be protected, expired, or invalid.")
         return False
@@ -64,6 +52,7 @@ def main():
     """Main interactive loop"""
     print("\n" + "="*60)
     print("M3U8 Video Downloader")
+    print("(for many URLs at once: python3 download.py --jobs 4 url ...)")
     print("="*60)
     
     while True:
@@ -1,83 +1,96 @@
 #!/usr/bin/env python3
 """
 M3U8 Video Downloader
-Downloads video from m3u8 streaming links using ffmpeg
+Downloads video from m3u8 streaming links, converting to .mp4 with ffmpeg
 """
 
+import shutil
 import subprocess
 import sys
+import time
 from pathlib import Path
 
-def download_m3u8(url, output_filename="downloaded_video.mp4"):
+from engine import DownloadError, download_file
+from progress import format_progress
+from ts_repair import DEFAULT_PRESET, DEFAULT_THREADS, RepairError, repair_ts
+
+def print_timings(timings):
+    print("\nTime per stage:")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<12} {seconds:8.1f} s")
+
+def download_m3u8(url, output_filename="downloaded_video.mp4", preset=DEFAULT_PRESET, threads=DEFAULT_THREADS):
     """
-    Download video from m3u8 URL using ffmpeg
+    Download video from m3u8 URL and convert it to .mp4
     
     Args:
         url: The m3u8 stream URL
         output_filename: Name for the output file (default: downloaded_video.mp4)
+        preset: x264 preset for any part that has to be re-encoded
+        threads: ffmpeg threads per re-encoded part (several parts run at once)
     """
     output_path = Path(output_filename)
+    timings = {}
     
     print(f"Downloading video from: {url}")
     print(f"Output file: {output_path.absolute()}")
     print("\nStarting download...\n")
     
+    # Same engine as the web app; ffmpeg reading the playlist itself is the fallback
+    started = time.perf_counter()
     try:
-        # Use ffmpeg to download and convert the m3u8 stream
-        # Added options to handle problematic streams
-        command = [
-            'ffmpeg',
-            '-allowed_extensions', 'ALL',  # Allow all segment extensions
-            '-protocol_whitelist', 'file,http,https,tcp,tls,crypto',  # Allow necessary protocols
-            '-i', url,
-            '-c', 'copy',  # Copy streams without re-encoding (faster)
-            '-bsf:a', 'aac_adtstoasc',  # Fix audio stream if needed
-            '-y',  # Overwrite output file if exists
-            str(output_path)
-        ]
-        
-        print("Running ffmpeg with enhanced compatibility options...\n")
-        
-        # Run ffmpeg
-        result = subprocess.run(
-            command,
-            check=True,
-            capture_output=False
-        )
-        
-        print(f"\n✓ Download completed successfully!")
-        print(f"Video saved to: {output_path.absolute()}")
-        
-    except subprocess.CalledProcessError as e:
-        print(f"\n✗ Error during download: {e}")
-        print("\nTrying alternative method with re-encoding...")
-        
-        # Fallback: try with re-encoding instead of copy
+        saved = download_file(url, output_path,
+                              progress=lambda fields: print(f"\r{format_progress(fields)}", end='', flush=True))
+    except DownloadError as e:
+        print(f"\n✗ Download engine failed: {e}")
+        print("Trying ffmpeg...\n")
+        saved = output_path.with_suffix('.ts')
         try:
-            command_fallback = [
+            # Copy into MPEG-TS, which takes the stream as it is; the .mp4
+            # conversion below then works from this file, never the network
+            command = [
                 'ffmpeg',
-                '-allowed_extensions', 'ALL',
-                '-protocol_whitelist', 'file,http,https,tcp,tls,crypto',
+                '-allowed_extensions', 'ALL',  # Allow all segment extensions
+                '-protocol_whitelist', 'file,http,https,tcp,tls,crypto',  # Allow necessary protocols
                 '-i', url,
-                '-c:v', 'libx264',  # Re-encode video
-                '-c:a', 'aac',  # Re-encode audio
-                '-y',
-                str(output_path)
+                '-map', '0',
+                '-c', 'copy',  # Copy streams without re-encoding (faster)
+                '-f', 'mpegts',
+                '-y',  # Overwrite output file if exists
+                str(saved)
             ]
-            
-            subprocess.run(command_fallback, check=True, capture_output=False)
-            print(f"\n✓ Download completed with re-encoding!")
-            print(f"Video saved to: {output_path.absolute()}")
+            subprocess.run(command, check=True, capture_output=False)
         except subprocess.CalledProcessError as e2:
-            print(f"\n✗ Fallback method also failed: {e2}")
+            print(f"\n✗ ffmpeg download also failed: {e2}")
+            sys.exit(1)
+        except FileNotFoundError:
+            print("\n✗ Error: ffmpeg not found!")
+            print("Please install ffmpeg:")
+            print("  macOS: brew install ffmpeg")
+            print("  Linux: sudo apt-get install ffmpeg")
+            print("  Windows: Download from https://ffmpeg.org/download.html")
+            sys.exit(1)
+    timings['download'] = time.perf_counter() - started
+    
+    # A .ts means the plain copy remux to .mp4 failed (or ffmpeg is missing):
+    # repair it from the downloaded data, re-encoding as little as possible
+    if saved.suffix == '.ts':
+        if not shutil.which('ffmpeg'):
+            print(f"\n✓ Download completed (install ffmpeg to convert it to .mp4)")
+            print(f"Video saved to: {saved.absolute()}")
+            return
+        print("\n\nConverting to .mp4...")
+        try:
+            saved = repair_ts(saved, output_path, preset=preset, threads=threads, timings=timings)
+        except RepairError as e:
+            print(f"\n✗ Could not convert the video: {e}")
+            print(f"The downloaded stream is kept at: {saved.absolute()}")
+            print_timings(timings)
             sys.exit(1)
-    except FileNotFoundError:
-        print("\n✗ Error: ffmpeg not found!")
-        print("Please install ffmpeg:")
-        print("  macOS: brew install ffmpeg")
-        print("  Linux: sudo apt-get install ffmpeg")
-        print("  Windows: Download from https://ffmpeg.org/download.html")
-        sys.exit(1)
+    
+    print(f"\n✓ Download completed successfully!")
+    print(f"Video saved to: {saved.absolute()}")
+    print_timings(timings)
 
 if __name__ == "__main__":
     # The m3u8 URL to download
@@ -86,4 +99,9 @@ if __name__ == "__main__":
     # You can change the output filename here
     output_file = "movie.mp4"
     
-    download_m3u8(video_url, output_file)
+    # Speed/quality of re-encoding damaged parts (ultrafast ... veryslow) and
+    # ffmpeg threads per part
+    preset = DEFAULT_PRESET
+    threads = DEFAULT_THREADS
+    
+    download_m3u8(video_url, output_file, preset, threads)
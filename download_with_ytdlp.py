@@ -2,50 +2,40 @@
 """
 M3U8 Video Downloader using yt-dlp
 More robust alternative to ffmpeg for downloading m3u8 streams
+For many URLs at once, use download.py
 """
 
-import subprocess
 import sys
 from pathlib import Path
 
+from engine import DownloadError, download_file
+from progress import format_progress
+
+def show_progress(fields):
+    print(f"\r{format_progress(fields)}", end='', flush=True)
+
 def download_m3u8(url, output_filename="movie.mp4"):
     """
-    Download video from m3u8 URL using yt-dlp
+    Download video from m3u8 URL (in-process, falling back to yt-dlp)
     
     Args:
         url: The m3u8 stream URL
         output_filename: Name for the output file (default: movie.mp4)
     """
     output_path = Path(output_filename)
-    output_template = str(output_path.with_suffix(''))  # Remove extension, yt-dlp will add it
     
     print(f"Downloading video from: {url}")
     print(f"Output file: {output_path.absolute()}")
-    print("\nStarting download with yt-dlp...\n")
+    print("\nStarting download...\n")
     
     try:
-        # Use yt-dlp to download the m3u8 stream (run as Python module)
-        command = [
-            'python3', '-m', 'yt_dlp',
-            '--no-check-certificate',  # Skip SSL certificate verification if needed
-            '--allow-unplayable-formats',  # Allow downloading unplayable formats
-            '--fixup', 'never',  # Don't try to fix file formats
-            '-o', output_template,  # Output template
-            '--merge-output-format', 'mp4',  # Merge to mp4
-            url
-        ]
-        
-        # Run yt-dlp
-        result = subprocess.run(
-            command,
-            check=True,
-            capture_output=False
-        )
+        # Same engine as the web app; rerunning after an interruption resumes
+        saved = download_file(url, output_path, progress=show_progress)
         
         print(f"\n✓ Download completed successfully!")
-        print(f"Video saved to: {output_path.absolute()}")
+        print(f"Video saved to: {saved.absolute()}")
         
-    except subprocess.CalledProcessError as e:
+    except DownloadError as e:
         print(f"\n✗ Error during download: {e}")
         print("\nThe stream may be protected, expired, or invalid.")
         sys.exit(1)
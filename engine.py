@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Download Engine
+One download of a URL to a file, by the fastest path that handles it:
+m3u8 playlists in-process (hls_engine), direct .mp4 files over parallel
+range requests (range_fetcher), and everything else - or whatever those
+can't handle - through yt-dlp with one tuned set of flags.
+Shared by the web app and the command-line tools.
+"""
+
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import checkpoint
+from download_cache import cache_key
+from hls_engine import HLSCancelled, HLSDownload, HLSError, is_hls_url
+from progress import PROGRESS_TEMPLATE, parse_progress
+from quality import format_id, max_height, pick_variant, ytdlp_format
+from range_fetcher import RangeCancelled, RangeDownload, RangeError
+
+YTDLP = ['python3', '-m', 'yt_dlp']
+
+# yt-dlp prints the final output path and height after these markers (see --print below)
+FILEPATH_MARKER = '__FILEPATH__ '
+HEIGHT_MARKER = '__HEIGHT__ '
+
+DEFAULT_CONNECTIONS = 16
+
+
+class DownloadError(Exception):
+    """Every path that could handle the URL failed"""
+
+
+class DownloadCancelled(Exception):
+    """The download was cancelled"""
+
+
+def is_direct_mp4(url):
+    return urlparse(url).path.lower().endswith('.mp4')
+
+
+def ytdlp_profile(connections=DEFAULT_CONNECTIONS):
+    """The tuned yt-dlp transfer flags every download and stream uses"""
+    return [
+        '--no-check-certificate',
+        '--concurrent-fragments', str(connections),  # Parallel fragments
+        '--buffer-size', '16K',  # Larger buffer for faster download
+        '--http-chunk-size', '10M',  # Download in 10MB chunks
+        '--retries', '10',  # Retry failed chunks
+        '--fragment-retries', '10',  # Retry failed fragments
+    ]
+
+
+def ytdlp_download_command(url, output_template, format_string='best', connections=DEFAULT_CONNECTIONS,
+                           rate_limit=None):
+    """yt-dlp command line for a download to disk, with machine-readable progress"""
+    limit = ['--limit-rate', str(int(rate_limit))] if rate_limit else []  # Bytes/s
+    return YTDLP + ytdlp_profile(connections) + limit + [
+        '--newline',  # Print progress on new lines
+        '--progress-template', PROGRESS_TEMPLATE,  # ...as JSON (see progress.py)
+        '-f', format_string,
+        '-o', output_template,
+        '--merge-output-format', 'mp4',
+        '--continue',  # Resume .part files left by a run that stopped mid-download
+        '--no-mtime',  # Don't set file modification time (faster)
+        '--print', f'after_move:{FILEPATH_MARKER}%(filepath)s',  # Report the final filename
+        '--print', f'after_move:{HEIGHT_MARKER}%(height)s',  # ...and the height picked
+        '--progress',  # --print implies --quiet; keep the progress lines
+        url
+    ]
+
+
+def ytdlp_stream_command(url, format_string='best', connections=DEFAULT_CONNECTIONS):
+    """yt-dlp command line that writes the video to stdout"""
+    return YTDLP + ytdlp_profile(connections) + [
+        '-f', format_string,
+        '--merge-output-format', 'mp4',
+        '--fixup', 'detect_or_warn',  # Fix issues automatically
+        '-o', '-',  # Output to stdout!
+        url
+    ]
+
+
+def ytdlp_info_command(url):
+    """yt-dlp command line that prints a URL's metadata (or a playlist's entries) as JSON"""
+    return YTDLP + ['--no-check-certificate', '-J', '--flat-playlist', '--no-warnings', url]
+
+
+class Download:
+    """
+    One download of url to output_path; run() returns the finished file
+
+    The output directory must belong to this download alone: yt-dlp's
+    output is found there, and resume data lives there. The extension may
+    differ from output_path's (e.g. .ts when ffmpeg isn't installed).
+
+    Exposes the Popen-like poll/wait/terminate/kill/send_signal surface of
+    whichever path is running, so callers pause, resume and cancel it the
+    same way. Optional hooks:
+      progress(fields)          fields as progress.parse_progress returns them
+      output(line)              other yt-dlp output (e.g. 'ERROR: ...' lines)
+      fallback(error)           an in-process path failed; yt-dlp runs next
+      select_variant(variants)  HLS master playlist choice (default: tallest within quality)
+      format_string()           yt-dlp -f value, asked for when yt-dlp starts (default: from quality)
+      throttle(nbytes)          blocks until that many more bytes may be taken in (see bandwidth.py)
+      rate_limit()              bytes/s cap for yt-dlp, which can't be throttled in-process (0 = none)
+    After run(): method ('hls', 'range' or 'yt-dlp'), height (when known)
+    and timings ({stage: seconds}).
+    """
+
+    def __init__(self, url, output_path, quality='best', connections=DEFAULT_CONNECTIONS,
+                 hls_concurrency=8, range_connections=8, progress=None, output=None, fallback=None,
+                 select_variant=None, format_string=None, throttle=None, rate_limit=None, pass_fds=()):
+        self.url = url
+        self.output_path = Path(output_path)
+        self.quality = quality
+        self.connections = connections
+        self.hls_concurrency = hls_concurrency
+        self.range_connections = range_connections
+        self.progress = progress
+        self.output = output
+        self.fallback = fallback
+        self.select_variant = select_variant or (lambda variants: pick_variant(variants, max_height(quality)))
+        self.format_string = format_string or (lambda: ytdlp_format(quality))
+        self.throttle = throttle
+        self.rate_limit = rate_limit or (lambda: 0)
+        self.pass_fds = pass_fds
+        self.method = None
+        self.height = None
+        self.timings = {}
+        self.returncode = None
+        self._process = None
+        self._paused = False
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+
+    # --- Popen-compatible control surface ---
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.returncode
+
+    def terminate(self):
+        self._cancelled.set()
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+
+    def kill(self):
+        self._cancelled.set()
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+
+    def send_signal(self, sig):
+        if sig in (signal.SIGSTOP, signal.SIGCONT):
+            self._paused = sig == signal.SIGSTOP  # Also applies to a path started later
+            if self._process is not None:
+                self._process.send_signal(sig)
+        else:
+            self.terminate()
+
+    def _start(self, process):
+        self._process = process
+        if self._paused:
+            process.send_signal(signal.SIGSTOP)
+        if self._cancelled.is_set():
+            process.terminate()
+
+    # --- Download ---
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            path = self._run()
+            self.returncode = 0
+            return path
+        except DownloadCancelled:
+            self.returncode = -signal.SIGTERM
+            raise
+        except Exception:
+            self.returncode = 1
+            raise
+        finally:
+            self.timings['total'] = time.perf_counter() - started
+            self._done.set()
+
+    def _run(self):
+        # m3u8 streams and direct .mp4 files are fetched in-process; yt-dlp
+        # is the fallback (and handles explicit format_ids, which only its
+        # extractors know)
+        if not format_id(self.quality):
+            if is_hls_url(self.url):
+                path = self._timed('hls', self._run_hls)
+                if path:
+                    return path
+            elif is_direct_mp4(self.url):
+                path = self._timed('range', self._run_range)
+                if path:
+                    return path
+        if self._cancelled.is_set():
+            raise DownloadCancelled()
+        return self._timed('yt-dlp', self._run_ytdlp)
+
+    def _timed(self, method, func):
+        self.method = method
+        started = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self.timings[method] = time.perf_counter() - started
+
+    def _native_failed(self, error):
+        print(f"{self.method} download failed, falling back to yt-dlp: {error}")
+        if self.fallback:
+            self.fallback(error)
+
+    def _run_hls(self):
+        def report(done, total, bytes_done, speed):
+            # Segments are similar in size, so extrapolate the total from those done
+            total_bytes = bytes_done * total // done
+            self._report({
+                'percent': done * 100.0 / total,
+                'downloaded_bytes': bytes_done,
+                'total_bytes': total_bytes,
+                'speed': speed,
+                'eta': (total_bytes - bytes_done) / speed if speed else None,
+                'fragment_index': done,
+                'fragment_count': total,
+            })
+
+        segment_checkpoint = checkpoint.SegmentCheckpoint(self.output_path.parent)
+        job = HLSDownload(self.url, self.output_path.with_suffix(''),
+                          concurrency=min(self.hls_concurrency, self.connections), progress=report,
+                          checkpoint=segment_checkpoint, select_variant=self.select_variant,
+                          throttle=self.throttle)
+        self._start(job)
+        try:
+            path = job.run()
+        except HLSCancelled:
+            raise DownloadCancelled()
+        except HLSError as e:
+            segment_checkpoint.clear()
+            # Or yt-dlp's output lookup could take the partial file for its own
+            for suffix in ('.ts', '.mp4'):
+                job.output_stem.with_suffix(suffix).unlink(missing_ok=True)
+            self._native_failed(e)
+            return None
+        if job.variant:
+            self.height = job.variant['height']
+        return path
+
+    def _run_range(self):
+        def report(bytes_done, total_bytes, speed):
+            self._report({
+                'percent': bytes_done * 100.0 / total_bytes,
+                'downloaded_bytes': bytes_done,
+                'total_bytes': total_bytes,
+                'speed': speed,
+                'eta': (total_bytes - bytes_done) / speed if speed else None,
+            })
+
+        path = self.output_path.with_suffix('.mp4')
+        range_checkpoint = checkpoint.RangeCheckpoint(self.output_path.parent)
+        job = RangeDownload(self.url, path, connections=min(self.range_connections, self.connections),
+                            progress=report, throttle=self.throttle, checkpoint=range_checkpoint)
+        self._start(job)
+        try:
+            return job.run()
+        except RangeCancelled:
+            raise DownloadCancelled()  # The pieces so far stay, for a resume
+        except RangeError as e:
+            range_checkpoint.clear()
+            path.unlink(missing_ok=True)
+            self._native_failed(e)
+            return None
+
+    def _report(self, fields):
+        if self.progress:
+            self.progress(fields)
+
+    def _run_ytdlp(self):
+        command = ytdlp_download_command(self.url, str(self.output_path.with_suffix('')),
+                                         self.format_string(), self.connections, self.rate_limit())
+        spawned = time.perf_counter()
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            pass_fds=self.pass_fds
+        )
+        self._start(process)
+
+        errors = []
+        reported_file = None
+        try:
+            for line in process.stdout:
+                if spawned:
+                    self.timings['yt-dlp first output'] = time.perf_counter() - spawned
+                    spawned = None
+                fields = parse_progress(line)
+                if fields:
+                    self._report(fields)
+                    continue
+                line = line.strip()
+                if line.startswith(FILEPATH_MARKER):
+                    reported_file = Path(line[len(FILEPATH_MARKER):])
+                elif line.startswith(HEIGHT_MARKER):
+                    height = line[len(HEIGHT_MARKER):]
+                    self.height = int(height) if height.isdigit() else None
+                elif line:
+                    if line.startswith('ERROR:'):
+                        errors.append(line)
+                    if self.output:
+                        self.output(line)
+            process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+        if self._cancelled.is_set():
+            raise DownloadCancelled()
+        if process.returncode != 0:
+            raise DownloadError(errors[-1] if errors else 'Download failed')
+
+        # Use the path yt-dlp reported; otherwise the output directory holds
+        # only this download, so its largest file is the result
+        if reported_file and reported_file.is_file():
+            return reported_file
+        files = [f for f in self.output_path.parent.iterdir() if f.is_file() and not f.name.startswith('.')]
+        if not files:
+            raise DownloadError(f'File not found. Expected: {self.output_path.stem}. Found files: none')
+        return max(files, key=lambda f: f.stat().st_size)
+
+
+def _place(cached, target):
+    """Put a cached file at target: a hard link when possible, else a copy"""
+    target.unlink(missing_ok=True)
+    try:
+        os.link(cached, target)
+    except OSError:
+        shutil.copyfile(cached, target)
+
+
+def download_file(url, output_path, quality='best', connections=DEFAULT_CONNECTIONS, progress=None,
+                  output=None, cache=None, started=None):
+    """
+    Download url to output_path for a command-line tool; returns the final path
+
+    Partial data goes to a work directory beside the output
+    (.<name>.download), so a run that was interrupted resumes where it
+    stopped. With a DownloadCache, repeat downloads come from the cache.
+    started(job) gets the Download before it runs (e.g. to cancel it).
+    The extension may differ from output_path's (.ts without ffmpeg).
+    """
+    output_path = Path(output_path)
+    key = cache_key(url, quality)
+    cached = cache.get(key) if cache else None
+    if cached:
+        target = output_path.with_suffix(cached.suffix)
+        _place(cached, target)
+        return target
+
+    work_dir = output_path.parent / f'.{output_path.name}.download'
+    work_dir.mkdir(parents=True, exist_ok=True)
+    job = Download(url, work_dir / output_path.name, quality, connections, progress=progress, output=output)
+    if started:
+        started(job)
+    path = job.run()
+    target = output_path.with_suffix(path.suffix)
+    if cache:
+        _place(cache.put([key], path, url=url, fmt=quality), target)
+    else:
+        os.replace(path, target)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return target
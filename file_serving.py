@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Media File Serving
+Sends finished downloads with Range / If-Range / ETag support, zero-copy
+sendfile() for byte ranges, and optional hand-off to a front proxy
+"""
+
+import os
+from pathlib import Path
+
+from flask import request, send_file, current_app
+
+# How long browsers/proxies may reuse a finished file without revalidating
+MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', '3600'))
+
+# '' (serve from Flask), 'x-accel' (nginx X-Accel-Redirect) or 'x-sendfile' (Apache/lighttpd)
+SENDFILE_MODE = os.environ.get('SENDFILE_MODE', '').lower()
+
+# nginx 'internal' location that maps onto the media root, for X-Accel-Redirect
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected-downloads').rstrip('/')
+
+MEDIA_TYPES = {
+    '.mp4': 'video/mp4',
+    '.m4v': 'video/mp4',
+    '.ts': 'video/mp2t',  # Would otherwise be guessed as a Qt translation file
+    '.mkv': 'video/x-matroska',
+    '.webm': 'video/webm',
+    '.m4a': 'audio/mp4',
+    '.zip': 'application/zip',
+}
+
+
+def container_suffix(path, default='.mp4'):
+    """File extension for the container a media file actually is, from its first bytes"""
+    with open(path, 'rb') as f:
+        head = f.read(4096)
+    if head[4:8] in (b'ftyp', b'styp', b'moov', b'moof'):
+        return '.mp4'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return '.webm' if b'webm' in head[:64] else '.mkv'
+    if len(head) > 188 and head[0] == 0x47 and head[188] == 0x47:
+        return '.ts'
+    return default
+
+
+class _FileRange:
+    """
+    A file limited to one byte range
+
+    Keeps the real fileno() (positioned at the range start), so a server
+    whose wsgi.file_wrapper uses sendfile() - like gunicorn - sends the
+    range straight from the page cache; read() stops at the range end for
+    servers that iterate instead.
+    """
+
+    def __init__(self, path, start, length):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = length
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def _accel_redirect(path, media_root, download_name):
+    """Let nginx serve the bytes (it handles Range itself)"""
+    relative = Path(path).resolve().relative_to(Path(media_root).resolve())
+    response = current_app.response_class()
+    response.headers['X-Accel-Redirect'] = f'{X_ACCEL_PREFIX}/{relative.as_posix()}'
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.headers['Cache-Control'] = f'private, max-age={MEDIA_MAX_AGE}'
+    response.mimetype = MEDIA_TYPES.get(Path(path).suffix.lower(), 'application/octet-stream')
+    return response
+
+
+def send_media(path, download_name, media_root):
+    """Response for a finished media file under media_root"""
+    if SENDFILE_MODE == 'x-accel':
+        return _accel_redirect(path, media_root, download_name)
+
+    # send_file answers Range, If-Range, If-None-Match and If-Modified-Since
+    # itself (206 / 304 / 416) using an ETag built from mtime + size + path
+    response = send_file(
+        path,
+        as_attachment=True,
+        download_name=download_name,
+        mimetype=MEDIA_TYPES.get(Path(path).suffix.lower()),
+        conditional=True,
+        etag=True,
+        max_age=MEDIA_MAX_AGE,
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.cache_control.public = False
+    response.cache_control.private = True
+
+    # Werkzeug serves ranges through a Python read loop; swap in a
+    # range-limited real file so the server can sendfile() it instead.
+    # With X-Sendfile the front server sends the bytes, so there's no body to swap.
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if (response.status_code == 206 and response.content_range and file_wrapper
+            and not current_app.config['USE_X_SENDFILE']):
+        start, stop = response.content_range.start, response.content_range.stop
+        response.response.close()
+        response.response = file_wrapper(_FileRange(path, start, stop - start), 1024 * 1024)
+        response.direct_passthrough = True
+    return response
@@ -0,0 +1,43 @@
+"""
+Gunicorn settings (read automatically from the working directory)
+
+/stream, /events and ZIP bundles stay open for as long as the client
+reads, and /check-formats waits on yt-dlp, so workers must not be
+single-request sync workers. The default is threaded workers (gthread):
+each long response holds one thread, not the whole process.
+GUNICORN_WORKER_CLASS=gevent (pip install gevent) runs them as greenlets
+instead, for thousands of mostly idle streams per worker.
+"""
+
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+# One process by default: job state lives in memory unless JOB_STORE=sqlite
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+# Threads per gthread worker (gunicorn silently turns sync workers with threads > 1 into gthread)
+threads = int(os.environ.get('GUNICORN_THREADS', '64')) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', '1000'))  # gevent
+
+# Keep a few threads (connections) free for page loads and status polls: past
+# this many open streams, new ones get 503 (see MAX_STREAMS in app.py)
+if worker_class == 'gthread':
+    os.environ.setdefault('MAX_STREAMS', str(max(threads - 8, 1)))
+elif worker_class == 'gevent':
+    os.environ.setdefault('MAX_STREAMS', str(max(worker_connections - 50, 1)))
+
+# Threaded and gevent workers heartbeat from their main loop, so this only
+# catches a wedged worker, not a long stream
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+
+# app.py starts scheduler, janitor and watcher threads on import; they must
+# start in each worker, after the fork (and after gevent's monkey-patching)
+preload_app = False
+
+
+def on_starting(server):
+    if workers > 1 and not (os.environ.get('JOB_STORE') or '').startswith('sqlite'):
+        server.log.warning('WEB_CONCURRENCY > 1 without JOB_STORE=sqlite: '
+                           'each worker only sees its own jobs')
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Native HLS Downloader
+Parses m3u8 playlists and fetches their segments in-process over a shared
+connection pool, writing them to disk in playlist order.
+Used by app.py instead of spawning a yt-dlp interpreter per job.
+"""
+
+import re
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+DEFAULT_CONCURRENCY = 8
+THROTTLE_SLICE = 256 * 1024  # Bytes per throttle call, so a capped job still pauses/cancels promptly
+POOL_SIZE = 64  # Connections kept alive per host across ALL jobs
+
+_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class HLSError(Exception):
+    """The native engine could not download this stream (caller falls back to yt-dlp)"""
+
+
+class HLSUnsupported(HLSError):
+    """The playlist uses a feature the native engine doesn't handle"""
+
+
+class HLSCancelled(Exception):
+    """The job was cancelled while downloading"""
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the process-wide requests session (keep-alive connection pool)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=POOL_SIZE, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = USER_AGENT
+            _session = session
+        return _session
+
+
+def is_hls_url(url):
+    """Check whether a URL points at an m3u8 playlist"""
+    return urlparse(url).path.lower().endswith('.m3u8')
+
+
+def _parse_attributes(text):
+    """Parse an m3u8 attribute list (KEY=VALUE,KEY="VALUE") into a dict"""
+    attributes = {}
+    for key, value in _ATTRIBUTE_RE.findall(text):
+        attributes[key] = value[1:-1] if value.startswith('"') else value
+    return attributes
+
+
+def _parse_byterange(value, previous_end):
+    """Parse '<length>[@<offset>]' into (offset, length)"""
+    length, _, offset = value.partition('@')
+    start = int(offset) if offset else previous_end
+    return start, int(length)
+
+
+def parse_playlist(text, base_url):
+    """
+    Parse an m3u8 playlist
+
+    Returns a dict with 'type' set to 'master' (with 'variants' and 'media')
+    or 'media' (with 'segments', 'init' and 'endlist')
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or not lines[0].startswith('#EXTM3U'):
+        raise HLSError('Not an m3u8 playlist')
+
+    if any(line.startswith('#EXT-X-STREAM-INF') for line in lines):
+        variants = []
+        media = []
+        pending = None
+        for line in lines:
+            if line.startswith('#EXT-X-STREAM-INF:'):
+                pending = _parse_attributes(line.split(':', 1)[1])
+            elif line.startswith('#EXT-X-MEDIA:'):
+                attributes = _parse_attributes(line.split(':', 1)[1])
+                if 'URI' in attributes:
+                    attributes['URI'] = urljoin(base_url, attributes['URI'])
+                media.append(attributes)
+            elif pending is not None and not line.startswith('#'):
+                resolution = pending.get('RESOLUTION', '')
+                width, _, height = resolution.partition('x')
+                variants.append({
+                    'url': urljoin(base_url, line),
+                    'bandwidth': int(pending.get('BANDWIDTH') or 0),
+                    'width': int(width) if width.isdigit() else None,
+                    'height': int(height) if height.isdigit() else None,
+                    'codecs': pending.get('CODECS', ''),
+                    'audio': pending.get('AUDIO'),
+                })
+                pending = None
+        return {'type': 'master', 'variants': variants, 'media': media}
+
+    segments = []
+    init = None
+    key = None
+    duration = 0.0
+    byterange = None
+    ends = {}  # Last byte offset per URI, for BYTERANGE without an offset
+    sequence = 0
+    endlist = False
+    for line in lines:
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',')[0] or 0)
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            byterange = line.split(':', 1)[1]
+        elif line.startswith('#EXT-X-KEY:'):
+            attributes = _parse_attributes(line.split(':', 1)[1])
+            key = None if attributes.get('METHOD', 'NONE') == 'NONE' else attributes
+        elif line.startswith('#EXT-X-MAP:'):
+            attributes = _parse_attributes(line.split(':', 1)[1])
+            init = {'url': urljoin(base_url, attributes['URI']), 'range': None}
+            if attributes.get('BYTERANGE'):
+                init['range'] = _parse_byterange(attributes['BYTERANGE'], 0)
+        elif line.startswith('#EXT-X-ENDLIST'):
+            endlist = True
+        elif not line.startswith('#'):
+            url = urljoin(base_url, line)
+            segment_range = None
+            if byterange:
+                segment_range = _parse_byterange(byterange, ends.get(url, 0))
+                ends[url] = segment_range[0] + segment_range[1]
+            segments.append({
+                'url': url,
+                'duration': duration,
+                'range': segment_range,
+                'key': key,
+                'sequence': sequence,
+            })
+            sequence += 1
+            duration = 0.0
+            byterange = None
+    return {'type': 'media', 'segments': segments, 'init': init, 'endlist': endlist}
+
+
+def fetch_playlist(url, session=None, timeout=15):
+    """Download and parse a playlist, returning (playlist, final_url)"""
+    session = session or get_session()
+    try:
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise HLSError(f'Could not fetch playlist: {e}')
+    return parse_playlist(response.text, response.url), response.url
+
+
+def best_variant(variants):
+    """Pick the highest-bandwidth variant of a master playlist"""
+    return max(variants, key=lambda v: (v['bandwidth'], v['height'] or 0))
+
+
+class HLSDownload:
+    """
+    One in-process HLS download
+
+    Exposes the same poll/wait/terminate/kill/send_signal surface as
+    subprocess.Popen so app.py can keep it in download_processes and
+    pause/resume/cancel it exactly like a yt-dlp process.
+
+    With a checkpoint (see checkpoint.SegmentCheckpoint) the resolved
+    segment manifest and resume point are persisted, and a later run
+    continues from the last segment written instead of from zero.
+    """
+
+    def __init__(self, url, output_stem, concurrency=DEFAULT_CONCURRENCY,
+                 retries=10, progress=None, session=None, checkpoint=None, select_variant=None, throttle=None):
+        # progress(segments_done, segments_total, bytes_written, bytes_per_second)
+        # select_variant(variants) picks from a master playlist (default: best_variant)
+        # throttle(nbytes) blocks until that many more bytes may be taken in (see bandwidth.py)
+        self.url = url
+        self.output_stem = Path(output_stem) if output_stem else None  # None when only streaming
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.progress = progress
+        self.session = session or get_session()
+        self.checkpoint = checkpoint
+        self.select_variant = select_variant or best_variant
+        self.throttle = throttle
+        self.variant = None  # The master playlist variant downloaded, if any
+        self.returncode = None
+        self.output_path = None
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        self._done = threading.Event()
+
+    # --- Popen-compatible control surface ---
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.returncode
+
+    def terminate(self):
+        self._cancelled.set()
+        self._running.set()  # Wake paused workers so they can exit
+
+    kill = terminate
+
+    def send_signal(self, sig):
+        if sig == signal.SIGSTOP:
+            self._running.clear()
+        elif sig == signal.SIGCONT:
+            self._running.set()
+        else:
+            self.terminate()
+
+    # --- Download ---
+
+    def _check_state(self):
+        """Block while paused; raise if cancelled"""
+        self._running.wait()
+        if self._cancelled.is_set():
+            raise HLSCancelled()
+
+    def _fetch(self, url, byte_range=None):
+        """Fetch one segment with retries"""
+        headers = {}
+        if byte_range:
+            start, length = byte_range
+            headers['Range'] = f'bytes={start}-{start + length - 1}'
+        for attempt in range(self.retries + 1):
+            self._check_state()
+            try:
+                response = self.session.get(url, headers=headers, timeout=(10, 30))
+                response.raise_for_status()
+                return response.content
+            except requests.RequestException as e:
+                if attempt == self.retries:
+                    raise HLSError(f'Segment failed after {self.retries} retries: {e}')
+                time.sleep(min(0.5 * 2 ** attempt, 5))
+
+    def resolve(self):
+        """Fetch the playlist (following a master playlist) and return the media playlist"""
+        playlist, playlist_url = fetch_playlist(self.url, self.session)
+        if playlist['type'] == 'master':
+            if not playlist['variants']:
+                raise HLSUnsupported('Master playlist has no variants')
+            variant = self.variant = self.select_variant(playlist['variants'])
+            if variant['audio'] and any(m.get('GROUP-ID') == variant['audio'] and 'URI' in m
+                                        for m in playlist['media']):
+                raise HLSUnsupported('Separate audio renditions need merging')
+            playlist, playlist_url = fetch_playlist(variant['url'], self.session)
+            if playlist['type'] != 'media':
+                raise HLSError('Variant playlist is not a media playlist')
+        if not playlist['endlist']:
+            raise HLSUnsupported('Live playlists are not supported')
+        if not playlist['segments']:
+            raise HLSError('Playlist has no segments')
+        if any(segment['key'] for segment in playlist['segments']):
+            raise HLSUnsupported('Encrypted segments are not supported')
+        return playlist
+
+    def run(self):
+        """Download the stream; returns the path of the finished file"""
+        try:
+            resume = self.checkpoint.load() if self.checkpoint else None
+            if resume:
+                playlist, start_index, offset = resume
+                # The variant picked before the restart; the hook sees it again
+                # (e.g. to reserve its bandwidth), as the only choice
+                self.variant = playlist.get('variant')
+                if self.variant:
+                    self.select_variant([self.variant])
+            else:
+                playlist = self.resolve()
+                start_index = offset = 0
+                if self.checkpoint:
+                    self.checkpoint.start(dict(playlist, variant=self.variant))
+            path = self._download(playlist, start_index, offset)
+            self.returncode = 0
+            return path
+        except HLSCancelled:
+            self.returncode = -signal.SIGTERM
+            raise
+        except Exception:
+            self.returncode = 1
+            raise
+        finally:
+            self._done.set()
+
+    def _save_checkpoint(self, output, next_index):
+        if self.checkpoint.due():
+            output.flush()  # The checkpoint must never point past what's on disk
+            self.checkpoint.update(next_index, output.tell())
+
+    def _open_output(self, raw_path, start_index, offset):
+        """Open the output file, cut back to the checkpointed offset when resuming"""
+        if start_index and raw_path.exists():
+            output = open(raw_path, 'r+b')
+            output.truncate(offset)
+            output.seek(offset)
+            return output, start_index
+        return open(raw_path, 'wb'), 0
+
+    def fetch_init(self, playlist):
+        """The fMP4 init section of a playlist, or None for TS playlists"""
+        init = playlist['init']
+        return self._fetch(init['url'], init['range']) if init else None
+
+    def iter_segments(self, segments, start_index=0):
+        """
+        Yield (index, data) for each segment in playlist order
+
+        Keeps a bounded window of in-flight segments, so memory stays at ~2x
+        concurrency segments regardless of stream length, and fetching only
+        runs ahead of the consumer by that window.
+        """
+        total = len(segments)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            window = deque()
+            next_index = start_index
+            try:
+                for index in range(start_index, total):
+                    while next_index < total and len(window) < self.concurrency * 2:
+                        segment = segments[next_index]
+                        window.append(pool.submit(self._fetch, segment['url'], segment['range']))
+                        next_index += 1
+                    yield index, window.popleft().result()
+            except BaseException:
+                # Also reached when the consumer abandons the generator
+                self._cancelled.set()
+                self._running.set()
+                for future in window:
+                    future.cancel()
+                raise
+
+    def _download(self, playlist, start_index=0, offset=0):
+        segments = playlist['segments']
+        fragmented = playlist['init'] is not None
+        raw_path = self.output_stem.with_suffix('.mp4' if fragmented else '.ts')
+        total = len(segments)
+        started = time.time()
+
+        output, start_index = self._open_output(raw_path, start_index, offset)
+        bytes_done = resumed_bytes = output.tell()
+        # closing() stops the fetches straight away if writing fails
+        with output, closing(self.iter_segments(segments, start_index)) as fetched:
+            if fragmented and start_index == 0:
+                output.write(self.fetch_init(playlist))
+
+            for index, data in fetched:
+                if self.throttle:
+                    for start in range(0, len(data), THROTTLE_SLICE):
+                        self._check_state()
+                        self.throttle(min(THROTTLE_SLICE, len(data) - start))
+                output.write(data)
+                bytes_done += len(data)
+                if self.checkpoint:
+                    self._save_checkpoint(output, index + 1)
+                if self.progress:
+                    elapsed = time.time() - started
+                    speed = (bytes_done - resumed_bytes) / elapsed if elapsed > 0 else 0.0
+                    self.progress(index + 1, total, bytes_done, speed)
+
+        if fragmented:
+            self.output_path = raw_path
+        else:
+            self.output_path = remux_to_mp4(raw_path)
+        return self.output_path
+
+
+def remux_to_mp4(ts_path):
+    """Copy-remux a .ts file to .mp4 with ffmpeg when it's installed (no re-encode)"""
+    ts_path = Path(ts_path)
+    if not shutil.which('ffmpeg'):
+        return ts_path
+    mp4_path = ts_path.with_suffix('.mp4')
+    result = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-i', str(ts_path),
+         '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-movflags', '+faststart', str(mp4_path)],
+        capture_output=True
+    )
+    if result.returncode != 0:
+        mp4_path.unlink(missing_ok=True)
+        return ts_path
+    ts_path.unlink(missing_ok=True)
+    return mp4_path
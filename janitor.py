@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Disk Janitor
+Background sweeper that keeps DOWNLOAD_DIR and the job store bounded:
+expires cached files and finished job records, enforces per-user quotas,
+removes leftovers of crashed jobs, and checks for free space before a
+job is admitted
+"""
+
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import checkpoint
+
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+STALE_AFTER = 3600  # Leftover temp files older than this belong to no live request
+
+
+def record_last_used(record):
+    """When a job record was last of use to anyone: fetched, finished or created"""
+    return max(record.get('fetched') or 0, record.get('finished') or 0, record.get('created') or 0)
+
+
+class Janitor:
+    """
+    Periodic cleanup of finished downloads
+
+    Cached files are bounded by the cache's own TTL and max_bytes; job
+    records are dropped once finished and unused for job_retention seconds
+    (or as soon as their file is gone); user_quota caps the bytes of
+    completed files one user (job 'owner') keeps on the server, oldest-used
+    first. Finished batch records (if a batch store is given) expire
+    like job records. Every worker process may run one; sweeps are idempotent.
+
+    Bytes still to come from admitted jobs are a running total, kept up to
+    date through track() as jobs report progress (per worker process).
+    Dropped records are also forgotten by events (a JobEvents), if given.
+    """
+
+    def __init__(self, download_dir, downloads, cache, interval=300, job_retention=24 * 3600,
+                 user_quota=0, min_free=256 * 1024 * 1024, batches=None, events=None):
+        self.download_dir = Path(download_dir)
+        self.downloads = downloads
+        self.batches = batches
+        self.events = events
+        self.cache = cache
+        self.interval = interval
+        self.job_retention = job_retention
+        self.user_quota = user_quota
+        self.min_free = min_free
+        self._thread = None
+        self._lock = threading.Lock()
+        self._reservations = {}  # job_id -> (expected_bytes, downloaded_bytes)
+        self._reserved = 0
+        self._reserve_lock = threading.Lock()
+        self.sweeps = 0
+        self.records_evicted = 0
+        self.files_evicted = 0
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Janitor sweep failed: {e}")
+
+    def sweep(self):
+        with self._lock:
+            self.cache.evict()
+            self.cache.remove_orphans(STALE_AFTER)
+            records = self._finished_records()
+            self._expire_records(records)
+            if self.user_quota:
+                self._enforce_user_quota(records)
+            self._remove_leftovers()
+            if self.batches is not None:
+                self._expire_batches()
+            self.sweeps += 1
+
+    def _finished_records(self):
+        records = {}
+        for job_id in self.downloads.ids():
+            record = self.downloads.get(job_id)
+            if record and record['status'] in FINISHED_STATUSES:
+                records[job_id] = record
+        return records
+
+    def _drop_record(self, records, job_id):
+        try:
+            del self.downloads[job_id]
+        except KeyError:
+            pass
+        records.pop(job_id, None)
+        if self.events is not None:
+            self.events.forget(job_id)
+        self.records_evicted += 1
+
+    def _expire_records(self, records):
+        now = time.time()
+        for job_id, record in list(records.items()):
+            file_gone = record['status'] == 'completed' and not Path(record.get('file') or '').is_file()
+            if file_gone or now - record_last_used(record) > self.job_retention:
+                self._drop_record(records, job_id)
+
+    def _expire_batches(self):
+        now = time.time()
+        for batch_id in self.batches.ids():
+            batch = self.batches.get(batch_id)
+            if batch and batch['status'] not in ('expanding', 'running') and \
+                    now - (batch.get('finished') or batch['created']) > self.job_retention:
+                try:
+                    del self.batches[batch_id]
+                except KeyError:
+                    pass
+
+    def enforce_user_quota(self, owner, keep=None):
+        """Trim one owner's files back under the quota (called as their downloads finish)"""
+        with self._lock:
+            self._enforce_user_quota(self._finished_records(), owner, keep)
+
+    def _enforce_user_quota(self, records, only_owner=None, keep=None):
+        by_owner = {}
+        for job_id, record in records.items():
+            if record['status'] != 'completed' or not record.get('owner'):
+                continue
+            if only_owner is None or record['owner'] == only_owner:
+                by_owner.setdefault(record['owner'], []).append((job_id, record))
+        for jobs in by_owner.values():
+            used = sum(record.get('file_bytes') or 0 for _, record in jobs)
+            for job_id, record in sorted(jobs, key=lambda item: record_last_used(item[1])):
+                if used <= self.user_quota:
+                    break
+                if job_id == keep:
+                    continue
+                used -= record.get('file_bytes') or 0
+                self._drop_record(records, job_id)
+                # The file is shared by every job for the same media; keep it while any uses it
+                if not any(other.get('file') == record['file'] for other in records.values()):
+                    self.cache.discard(record['file'])
+                    self.files_evicted += 1
+
+    def _remove_leftovers(self):
+        """Job directories and stream temp files that no running job owns"""
+        now = time.time()
+        for path in self.download_dir.iterdir():
+            try:
+                age = now - path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if age < STALE_AFTER:
+                continue
+            if path.is_file() and path.name.startswith('stream-'):
+                path.unlink(missing_ok=True)
+            elif path.is_dir() and path != self.cache.root and not (path / checkpoint.JOB_FILE).exists():
+                # Directories with a job file are resumed at startup; the rest are debris
+                lock = checkpoint.claim(path)
+                if lock:
+                    shutil.rmtree(path, ignore_errors=True)
+                    checkpoint.release(lock)
+
+    def track(self, job_id, fields):
+        """Update the reserved total from a job's changed fields (expected_bytes, downloaded_bytes, status)"""
+        with self._reserve_lock:
+            expected, downloaded = self._reservations.pop(job_id, (0, 0))
+            self._reserved -= max(expected - downloaded, 0)
+            expected = fields.get('expected_bytes', expected) or 0
+            downloaded = fields.get('downloaded_bytes', downloaded) or 0
+            if expected and fields.get('status') not in FINISHED_STATUSES:
+                self._reservations[job_id] = (expected, downloaded)
+                self._reserved += max(expected - downloaded, 0)
+
+    def untrack(self, job_id):
+        """Stop counting a job (e.g. one dropped before it started)"""
+        self.track(job_id, {'status': 'cancelled'})
+
+    def reserved_bytes(self):
+        """Bytes still to be written by jobs that were admitted with a known size"""
+        return self._reserved
+
+    def ensure_space(self, expected_bytes):
+        """
+        Whether a job of expected_bytes (0 if unknown) fits on disk
+
+        Running jobs' remaining bytes and min_free are kept clear; if they
+        don't fit, cached files are evicted (least recently used first) to
+        make room, unless even an empty cache would be too small.
+        """
+        def shortfall():
+            free = shutil.disk_usage(self.download_dir).free - self.reserved_bytes()
+            return expected_bytes + self.min_free - free
+
+        missing = shortfall()
+        if missing <= 0:
+            return True
+        if missing > self.cache.stats()['bytes']:
+            return False  # Emptying the cache wouldn't be enough; keep it
+        with self._lock:
+            self.cache.evict(free_bytes=missing)
+        return shortfall() <= 0
+
+    def stats(self):
+        usage = shutil.disk_usage(self.download_dir)
+        return {
+            'sweeps': self.sweeps,
+            'records_evicted': self.records_evicted,
+            'files_evicted': self.files_evicted,
+            'disk_free': usage.free,
+            'disk_total': usage.total,
+            'reserved_bytes': self.reserved_bytes(),
+        }
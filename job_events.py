@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Job Change Notifications
+Lets progress streams sleep until a job they watch actually changes
+instead of re-reading job state on a timer
+"""
+
+import threading
+
+
+class JobEvents:
+    """Per-job change counters behind one condition variable"""
+
+    def __init__(self):
+        self._versions = {}
+        self._cond = threading.Condition()
+
+    def notify(self, job_id):
+        with self._cond:
+            self._versions[job_id] = self._versions.get(job_id, 0) + 1
+            self._cond.notify_all()
+
+    def forget(self, job_id):
+        """Drop the counter of a job that no longer exists"""
+        with self._cond:
+            self._versions.pop(job_id, None)
+
+    def snapshot(self, job_ids):
+        with self._cond:
+            return tuple(self._versions.get(job_id, 0) for job_id in job_ids)
+
+    def wait(self, job_ids, seen, timeout):
+        """
+        Block until any of job_ids changes past the `seen` snapshot, or timeout
+
+        Returns the new snapshot (equal to `seen` on timeout)
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: tuple(self._versions.get(job_id, 0) for job_id in job_ids) != seen,
+                timeout
+            )
+            return tuple(self._versions.get(job_id, 0) for job_id in job_ids)
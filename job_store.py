@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Job State Store
+Pluggable backends for the download records app.py keeps, so /status,
+/cancel and /download-file work no matter which gunicorn worker (or
+node) receives the request
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class JobStore:
+    """
+    Mapping-style interface over job records (plain JSON-able dicts)
+
+    Reads return copies: change a record with update(), never by mutating
+    what store[job_id] returned. A backend only has to implement _load,
+    _save, _delete and ids; a Redis version would map them onto
+    GET/SET/DEL of a JSON value (or HGETALL/HSET) and SCAN.
+    """
+
+    shared = False  # True if other processes see the same records
+
+    def _load(self, job_id):
+        raise NotImplementedError
+
+    def _save(self, job_id, record):
+        raise NotImplementedError
+
+    def _delete(self, job_id):
+        raise NotImplementedError
+
+    def ids(self):
+        raise NotImplementedError
+
+    def get(self, job_id, default=None):
+        record = self._load(job_id)
+        return default if record is None else record
+
+    def update(self, job_id, fields):
+        record = self._load(job_id)
+        if record is not None:
+            record.update(fields)
+            self._save(job_id, record)
+
+    def flush(self):
+        pass
+
+    def __getitem__(self, job_id):
+        record = self.get(job_id)
+        if record is None:
+            raise KeyError(job_id)
+        return record
+
+    def __setitem__(self, job_id, record):
+        self._save(job_id, dict(record))
+
+    def __delitem__(self, job_id):
+        self._delete(job_id)
+
+    def __contains__(self, job_id):
+        return self._load(job_id) is not None
+
+    def __len__(self):
+        return len(self.ids())
+
+
+class MemoryJobStore(JobStore):
+    """Records in a dict; only the current process sees them (the default)"""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def _load(self, job_id):
+        with self._lock:
+            record = self._records.get(job_id)
+            return dict(record) if record is not None else None
+
+    def _save(self, job_id, record):
+        with self._lock:
+            self._records[job_id] = record
+
+    def _delete(self, job_id):
+        with self._lock:
+            self._records.pop(job_id, None)
+
+    def update(self, job_id, fields):
+        with self._lock:
+            if job_id in self._records:
+                self._records[job_id].update(fields)
+
+    def ids(self):
+        with self._lock:
+            return list(self._records)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Records in a SQLite file shared by every worker process on the host
+
+    Updates are buffered per job and written at most every flush_interval
+    seconds, so yt-dlp progress lines don't each become a write. Changes to
+    'status' (or any field listed in immediate_fields) are written at once.
+    Buffered changes are merged into reads made by the same process.
+    """
+
+    shared = True
+
+    def __init__(self, path, flush_interval=1.0, immediate_fields=('status', 'control', 'file'), table='jobs'):
+        self.path = str(path)
+        self.table = table  # Several stores can share one file
+        self.flush_interval = flush_interval
+        self.immediate_fields = set(immediate_fields)
+        self._local = threading.local()
+        self._pending = {}  # job_id -> fields not yet written
+        self._lock = threading.Lock()
+        self._connect().execute(
+            f'CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)'
+        )
+        flusher = threading.Thread(target=self._flush_loop, daemon=True, name='job-store-flush')
+        flusher.start()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _read(self, job_id):
+        row = self._connect().execute(f'SELECT data FROM {self.table} WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, job_id, record):
+        self._connect().execute(
+            f'INSERT OR REPLACE INTO {self.table} (id, data, updated) VALUES (?, ?, ?)',
+            (job_id, json.dumps(record), time.time())
+        )
+
+    def _load(self, job_id):
+        record = self._read(job_id)
+        with self._lock:
+            pending = self._pending.get(job_id)
+        if record is not None and pending:
+            record.update(pending)
+        return record
+
+    def _save(self, job_id, record):
+        with self._lock:
+            pending = self._pending.pop(job_id, None)
+        # Buffered changes are newer than the record they'd otherwise be lost with
+        self._write(job_id, dict(record, **pending) if pending else record)
+
+    def _delete(self, job_id):
+        with self._lock:
+            self._pending.pop(job_id, None)
+        self._connect().execute(f'DELETE FROM {self.table} WHERE id = ?', (job_id,))
+
+    def ids(self):
+        return [row[0] for row in self._connect().execute(f'SELECT id FROM {self.table}')]
+
+    def update(self, job_id, fields):
+        with self._lock:
+            self._pending.setdefault(job_id, {}).update(fields)
+            if not self.immediate_fields.intersection(fields):
+                return
+            fields = self._pending.pop(job_id)
+        self._apply(job_id, fields)
+
+    def _apply(self, job_id, fields):
+        """Read-modify-write one record inside a write transaction"""
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            record = self._read(job_id)
+            if record is not None:
+                record.update(fields)
+                self._write(job_id, record)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for job_id, fields in pending.items():
+            self._apply(job_id, fields)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Job store flush failed: {e}")
+
+
+def open_job_store(spec, default_dir=None, table='jobs'):
+    """
+    Build a store from a JOB_STORE setting
+
+    'memory' (default) or 'sqlite' (file in default_dir) or 'sqlite:///abs/path.db';
+    table names the kind of record kept (SQLite table), e.g. 'jobs' or 'batches'
+    """
+    spec = (spec or 'memory').strip()
+    if spec == 'memory':
+        return MemoryJobStore()
+    if spec == 'sqlite':
+        return SQLiteJobStore(f'{default_dir}/jobs.sqlite3', table=table)
+    if spec.startswith('sqlite://'):
+        return SQLiteJobStore(urlparse(spec).path, table=table)
+    raise ValueError(f"Unknown JOB_STORE: {spec}")
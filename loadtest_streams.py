@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Stream Load Test
+Opens more and more concurrent /stream responses against a running
+instance, each read at playback speed, while timing a cheap request on
+the side - shows how many streams one instance holds before it stops
+answering quickly
+
+Usage: loadtest_streams.py <server url> [levels, e.g. 10,50,100] [seconds per level] [KB/s per stream]
+
+The streamed media comes from a local fMP4 HLS stand-in server, so the
+instance under test must run on this machine (or reach 127.0.0.1 here).
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote
+
+import requests
+
+SEGMENTS = 200
+SEGMENT_SIZE = 256 * 1024
+HEALTH_INTERVAL = 0.25
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_stream(directory):
+    """A VOD fMP4 playlist (init section + segments), which /stream passes through without ffmpeg"""
+    (directory / 'init.mp4').write_bytes(os.urandom(1024))
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-TARGETDURATION:4', '#EXT-X-MAP:URI="init.mp4"']
+    for i in range(SEGMENTS):
+        (directory / f'seg{i:05d}.m4s').write_bytes(os.urandom(SEGMENT_SIZE))
+        lines += ['#EXTINF:4.0,', f'seg{i:05d}.m4s']
+    lines.append('#EXT-X-ENDLIST')
+    (directory / 'index.m3u8').write_text('\n'.join(lines) + '\n')
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def client(url, rate, until, results):
+    """Read one stream at `rate` bytes/s until `until`; record status, time to first byte and bytes"""
+    started = time.perf_counter()
+    record = {'status': None, 'ttfb': None, 'bytes': 0}
+    try:
+        with requests.get(url, stream=True, timeout=(10, 60)) as response:
+            record['status'] = response.status_code
+            if response.status_code == 200:
+                for chunk in response.iter_content(64 * 1024):
+                    if record['ttfb'] is None:
+                        record['ttfb'] = time.perf_counter() - started
+                    record['bytes'] += len(chunk)
+                    ahead = record['bytes'] / rate - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(min(ahead, max(until - time.time(), 0)))
+                    if time.time() >= until:
+                        break
+    except requests.RequestException as e:
+        record['status'] = type(e).__name__
+    results.append(record)
+
+
+def health(server, until, latencies, active):
+    """Time a cheap request every HEALTH_INTERVAL seconds"""
+    while time.time() < until:
+        started = time.perf_counter()
+        try:
+            stats = requests.get(f'{server}/stream/stats', timeout=30).json()
+            latencies.append(time.perf_counter() - started)
+            active.append(stats['active'])
+        except requests.RequestException:
+            latencies.append(float('inf'))
+        time.sleep(HEALTH_INTERVAL)
+
+
+def run_level(server, stream_url, streams, seconds, rate):
+    until = time.time() + seconds
+    results, latencies, active = [], [], []
+    threads = [threading.Thread(target=client, args=(stream_url, rate, until, results), daemon=True)
+               for _ in range(streams)]
+    threads.append(threading.Thread(target=health, args=(server, until, latencies, active), daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(seconds + 90)
+
+    ttfb = [r['ttfb'] for r in results if r['ttfb'] is not None]
+    return {
+        'ok': sum(r['status'] == 200 for r in results),
+        'refused': sum(r['status'] == 503 for r in results),
+        'failed': sum(r['status'] not in (200, 503) for r in results),
+        'ttfb_p50': percentile(ttfb, 0.5),
+        'ttfb_p95': percentile(ttfb, 0.95),
+        'health_p50': percentile(latencies, 0.5),
+        'health_p95': percentile(latencies, 0.95),
+        'mbps': sum(r['bytes'] for r in results) / seconds / (1024 * 1024),
+        'active': max(active, default=0),
+    }
+
+
+def wait_until_idle(server, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f'{server}/stream/stats', timeout=10).json()['active'] == 0:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    server = sys.argv[1].rstrip('/')
+    levels = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [10, 25, 50, 100]
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 15
+    rate = int(sys.argv[4]) * 1024 if len(sys.argv) > 4 else 256 * 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_stream(Path(tmp))
+        media = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=tmp))
+        threading.Thread(target=media.serve_forever, daemon=True).start()
+        playlist = f'http://127.0.0.1:{media.server_address[1]}/index.m3u8'
+
+        print(f"\n{server}: {seconds:.0f} s per level, each stream read at {rate // 1024} KB/s\n")
+        print(f"{'streams':>8}{'ok':>6}{'503':>6}{'failed':>8}{'ttfb p50/p95 (s)':>20}"
+              f"{'health p50/p95 (ms)':>22}{'MB/s':>8}{'active':>8}")
+        print("-" * 86)
+        for index, streams in enumerate(levels):
+            # A distinct URL per level, so no stream is served from the cache of an earlier one
+            stream_url = f'{server}/stream?url={quote(f"{playlist}?level={index}", safe="")}&filename=load.mp4'
+            r = run_level(server, stream_url, streams, seconds, rate)
+            print(f"{streams:>8}{r['ok']:>6}{r['refused']:>6}{r['failed']:>8}"
+                  f"{r['ttfb_p50']:>10.2f}/{r['ttfb_p95']:<9.2f}"
+                  f"{r['health_p50'] * 1000:>11.0f}/{r['health_p95'] * 1000:<10.0f}{r['mbps']:>8.1f}{r['active']:>8}")
+            wait_until_idle(server)
+        media.shutdown()
+
+    print("\nhealth = latency of GET /stream/stats while the streams are open")
+    print("503    = refused by MAX_STREAMS, keeping headroom for other requests")
+
+
+if __name__ == '__main__':
+    main()
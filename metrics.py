@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Metrics
+A minimal Prometheus-style registry (counters, gauges, histograms with
+labels) rendered in the text exposition format for /metrics.
+Values are per worker process.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket sets shared by several histograms
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+THROUGHPUT_BUCKETS = tuple(2 ** n * 1024 for n in range(6, 19, 2))  # 64 KiB/s ... 256 MiB/s
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.label_names, key, (), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """For collectors mirroring a count kept elsewhere (e.g. cache hits)"""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f'{self.name}_bucket', self.label_names, key,
+                                    (('le', _format_value(bound)),), count))
+                samples.append((f'{self.name}_sum', self.label_names, key, (), total))
+                samples.append((f'{self.name}_count', self.label_names, key, (), counts[-1]))
+        return samples
+
+
+class Registry:
+    """
+    Holds metrics plus collectors: callables run at scrape time that refresh
+    gauges from state kept elsewhere (job store, caches, disk)
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector {collect.__name__} failed: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, label_names, key, extra, value in metric.samples():
+                lines.append(f'{name}{_format_labels(label_names, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Format Probe Cache
+Memoizes /check-formats extractor results with a TTL, LRU eviction, an
+optional disk tier, and coalescing of simultaneous probes of the same URL
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from download_cache import normalize_url
+
+
+class _Flight:
+    """A probe in progress that other requests for the same URL wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ProbeCache:
+    """
+    get_or_probe(url, probe) returns probe(url), calling it at most once per
+    URL per TTL, and only once for any number of concurrent callers.
+    Exceptions raised by probe are passed to every waiter and never cached.
+    """
+
+    def __init__(self, ttl=600, max_entries=512, disk_dir=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(exist_ok=True, parents=True)
+        self._entries = OrderedDict()  # key -> (created, result), oldest first
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.probe_seconds = 0.0  # Total time spent in the extractor
+        self.probes = 0
+
+    def _key(self, url):
+        return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return self.disk_dir / f'{key}.json'
+
+    def _read_disk(self, key):
+        try:
+            entry = json.loads(self._disk_path(key).read_text())
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['created'] > self.ttl:
+            self._disk_path(key).unlink(missing_ok=True)
+            return None
+        return entry['created'], entry['result']
+
+    def _write_disk(self, key, created, result):
+        path = self._disk_path(key)
+        tmp_path = path.with_name(f'.{key}.{os.getpid()}.tmp')
+        try:
+            tmp_path.write_text(json.dumps({'created': created, 'result': result}))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Probe cache disk write failed: {e}")
+
+    def _store(self, key, created, result):
+        """Insert into the memory tier (lock held)"""
+        self._entries[key] = (created, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, key):
+        """Memory, then disk; returns the cached result or None (lock held)"""
+        entry = self._entries.get(key)
+        if entry and time.time() - entry[0] <= self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry:
+            del self._entries[key]
+        if self.disk_dir:
+            entry = self._read_disk(key)
+            if entry:
+                self._store(key, *entry)
+                self.disk_hits += 1
+                return entry[1]
+        return None
+
+    def peek(self, url):
+        """Cached result for url, or None; never probes and isn't counted as a hit"""
+        key = self._key(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[0] <= self.ttl:
+                return entry[1]
+        if self.disk_dir:
+            entry = self._read_disk(key)
+            if entry:
+                return entry[1]
+        return None
+
+    def get_or_probe(self, url, probe):
+        key = self._key(url)
+        with self._lock:
+            result = self._lookup(key)
+            if result is not None:
+                return result
+            flight = self._inflight.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.result
+
+        started = time.time()
+        try:
+            flight.result = probe(url)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            elapsed = time.time() - started
+            with self._lock:
+                self.probes += 1
+                self.probe_seconds += elapsed
+                if flight.error is None:
+                    self._store(key, started, flight.result)
+                del self._inflight[key]
+            flight.done.set()
+        if self.disk_dir:
+            self._write_disk(key, started, flight.result)
+        return flight.result
+
+    def stats(self):
+        with self._lock:
+            avg = self.probe_seconds / self.probes if self.probes else 0.0
+            served = self.hits + self.disk_hits + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'probe_seconds': round(self.probe_seconds, 3),
+                'avg_probe_seconds': round(avg, 3),
+                'saved_seconds': round(served * avg, 3),  # Estimated extractor time avoided
+            }
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Request Profiler
+Opt-in sampling profiler for Flask request handlers: a fraction of
+requests runs under cProfile, and the results are summed per endpoint
+"""
+
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+
+from flask import g, request
+
+
+class RequestProfiler:
+    """
+    Profiles about sample_rate of requests (0 disables it)
+
+    cProfile can only run one profile per process at a time, so a sampled
+    request that arrives while another is being profiled is skipped. Only
+    the handler is profiled; a streamed body runs after it returns.
+    """
+
+    def __init__(self, sample_rate=0.0):
+        self.sample_rate = sample_rate
+        self._stats = {}  # endpoint -> pstats.Stats
+        self._counts = {}
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def init_app(self, app):
+        if self.enabled:
+            app.before_request(self._start)
+            app.teardown_request(self._stop)
+
+    def _start(self):
+        if random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            return
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+    def _stop(self, exc=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        self._busy.release()
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            if endpoint in self._stats:
+                self._stats[endpoint].add(profile)
+            else:
+                self._stats[endpoint] = pstats.Stats(profile)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def report(self, limit=25, sort='cumulative'):
+        """Top functions per endpoint, as pstats text"""
+        out = io.StringIO()
+        out.write(f'# Sampled request profiles (rate {self.sample_rate}) at {time.ctime()}\n')
+        with self._lock:
+            for endpoint, stats in sorted(self._stats.items()):
+                out.write(f'\n## {endpoint}: {self._counts[endpoint]} requests\n')
+                stats.stream = out
+                stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Download Progress
+Parses yt-dlp's machine-readable progress lines into typed fields and
+rate-limits how often they're written to the job record
+"""
+
+import json
+import time
+
+# Lines yt-dlp prints through --progress-template start with this marker
+PROGRESS_MARKER = '__PROGRESS__ '
+
+_FIELDS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate',
+           'speed', 'eta', 'fragment_index', 'fragment_count')
+
+# One JSON object per progress update (%(...)j renders missing values as null)
+PROGRESS_TEMPLATE = 'download:' + PROGRESS_MARKER + '{' + ','.join(
+    f'"{field}":%(progress.{field})j' for field in _FIELDS
+) + '}'
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def parse_progress(line):
+    """
+    Typed progress fields from a --progress-template line, or None
+
+    Returns downloaded_bytes, total_bytes (exact or estimated), speed
+    (bytes/s), eta (s), fragment_index, fragment_count and percent
+    """
+    if not line.startswith(PROGRESS_MARKER):
+        return None
+    try:
+        raw = json.loads(line[len(PROGRESS_MARKER):])
+    except ValueError:
+        return None
+    done = _number(raw.get('downloaded_bytes'))
+    total = _number(raw.get('total_bytes')) or _number(raw.get('total_bytes_estimate'))
+    fields = {
+        'downloaded_bytes': done,
+        'total_bytes': total,
+        'speed': _number(raw.get('speed')),
+        'eta': _number(raw.get('eta')),
+        'fragment_index': _number(raw.get('fragment_index')),
+        'fragment_count': _number(raw.get('fragment_count')),
+    }
+    if done is not None and total:
+        fields['percent'] = min(done * 100.0 / total, 100.0)
+    elif fields['fragment_index'] and fields['fragment_count']:
+        fields['percent'] = fields['fragment_index'] * 100.0 / fields['fragment_count']
+    return fields
+
+
+def _mib(value):
+    return f'{value / (1024 * 1024):.2f}MiB'
+
+
+def format_progress(fields):
+    """Human-readable progress line for the 'progress' field"""
+    parts = [f"[download] {fields.get('percent') or 0:5.1f}%"]
+    if fields.get('total_bytes'):
+        parts.append(f"of {_mib(fields['total_bytes'])}")
+    if fields.get('speed'):
+        parts.append(f"at {_mib(fields['speed'])}/s")
+    if fields.get('eta') is not None:
+        minutes, seconds = divmod(int(fields['eta']), 60)
+        parts.append(f'ETA {minutes:02d}:{seconds:02d}')
+    if fields.get('fragment_count'):
+        parts.append(f"(frag {fields.get('fragment_index') or 0}/{fields['fragment_count']})")
+    return ' '.join(parts)
+
+
+class ProgressThrottle:
+    """Lets at most one update through per interval"""
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self._last = 0.0
+
+    def ready(self):
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return False
+        self._last = now
+        return True
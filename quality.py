@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Quality Selection
+Turns the quality a user asked for into a yt-dlp format selector or an HLS
+variant choice, and keeps a server-wide bitrate budget that steps new jobs
+down to lower variants while the server is busy
+"""
+
+import threading
+
+# Normalized qualities (what job records and cache keys hold):
+#   'best'       - highest quality available
+#   '<N>p'       - highest quality at most N pixels tall
+#   'id:<fmt>'   - a yt-dlp format_id from /check-formats
+BEST = 'best'
+
+
+def normalize_quality(quality=None, format_id=None, known_formats=()):
+    """
+    Canonical form of a requested quality, so '720', '720p' and 'same' share cache keys
+
+    format_id is taken as given. A quality that is neither 'best' nor a
+    height must be one of known_formats (the format_ids /check-formats
+    listed for the URL); anything else raises ValueError.
+    """
+    if format_id:
+        return f'id:{str(format_id).strip()}'
+    quality = str(quality or '').strip()
+    if quality.lower() in ('', 'best', 'same'):
+        return BEST
+    height = quality.lower()[:-1] if quality.lower().endswith('p') else quality
+    if height.isdigit() and int(height) > 0:
+        return f'{int(height)}p'
+    fmt = quality[3:] if quality.startswith('id:') else quality
+    if fmt in known_formats:
+        return f'id:{fmt}'
+    raise ValueError(f"Unknown quality '{quality}': use 'best', a height like 720p, or a format_id")
+
+
+def max_height(quality):
+    """Height cap of a normalized quality, or None"""
+    if quality.endswith('p') and quality[:-1].isdigit():
+        return int(quality[:-1])
+    return None
+
+
+def format_id(quality):
+    """yt-dlp format_id of a normalized quality, or None"""
+    return quality[3:] if quality.startswith('id:') else None
+
+
+def ytdlp_format(quality, max_bitrate=None):
+    """
+    yt-dlp -f selector for a normalized quality
+
+    max_bitrate (bits/s) prefers formats within the budget but still falls
+    back to the unrestricted choice rather than failing.
+    """
+    fmt = format_id(quality)
+    if fmt:
+        # /check-formats lists video formats, which may have no audio track
+        return f'{fmt}[acodec!=none]/{fmt}+bestaudio/{fmt}/best'
+    height = max_height(quality)
+    limit = f'[height<=?{height}]' if height else ''
+    choices = []
+    if max_bitrate:
+        tbr = f'[tbr<=?{max_bitrate // 1000}]'
+        choices += [f'best{limit}{tbr}', f'bestvideo{limit}{tbr}+bestaudio']
+    choices += [f'best{limit}', f'bestvideo{limit}+bestaudio'] if limit else []
+    choices.append('best')
+    return '/'.join(choices)
+
+
+def expected_size(probe, quality):
+    """
+    Bytes the requested quality should take, from a /check-formats result
+
+    Returns None when the probe has no size for it.
+    """
+    formats = (probe or {}).get('formats') or []
+    fmt = format_id(quality)
+    if fmt:
+        matches = [f for f in formats if f.get('format_id') == fmt]
+    else:
+        height = max_height(quality)
+        matches = [f for f in formats if not height or (f.get('height') or 0) <= height]
+        # Formats come tallest first; the selector takes the tallest that fits
+        matches = matches[:1]
+    return (matches[0].get('filesize') or None) if matches else None
+
+
+def pick_variant(variants, height=None, bandwidth=None):
+    """
+    Best HLS variant within a height and bandwidth (bits/s) cap
+
+    Variants over the caps are only used when nothing fits, in which case
+    the smallest one is returned.
+    """
+    def fits(variant):
+        if height and variant['height'] and variant['height'] > height:
+            return False
+        if bandwidth and variant['bandwidth'] > bandwidth:
+            return False
+        return True
+
+    def rank(variant):
+        return variant['bandwidth'], variant['height'] or 0
+
+    candidates = [v for v in variants if fits(v)]
+    if candidates:
+        return max(candidates, key=rank)
+    return min(variants, key=rank)
+
+
+class BitrateBudget:
+    """
+    Server-wide cap on the summed bitrate of running downloads
+
+    Each job reserves the bitrate of the variant it picked. A new job may use
+    what's left of the budget, but never less than an equal share of it, so
+    jobs step down to lower variants under load instead of queueing. A budget
+    of 0 turns the mode off. Reservations are per worker process.
+    """
+
+    def __init__(self, total=0):
+        self.total = total
+        self._reserved = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.total > 0
+
+    def allowance(self, job_id):
+        """Bits/s a job may pick a variant within, or None when unlimited"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            others = {k: v for k, v in self._reserved.items() if k != job_id}
+            left = self.total - sum(others.values())
+            return max(left, self.total // (len(others) + 1))
+
+    def reserve(self, job_id, bitrate):
+        if self.enabled:
+            with self._lock:
+                self._reserved[job_id] = bitrate
+
+    def release(self, job_id):
+        with self._lock:
+            self._reserved.pop(job_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'total': self.total, 'reserved': sum(self._reserved.values()),
+                    'jobs': len(self._reserved)}
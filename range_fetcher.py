@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Parallel Range Downloader
+Fetches a direct media file (e.g. a plain .mp4 URL) over several HTTP
+connections at once with Range requests, writing each piece straight to
+its offset in a preallocated file - no part files and no merge pass.
+With a checkpoint, an interrupted download resumes each piece where it
+stopped.
+"""
+
+import os
+import re
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from hls_engine import get_session
+
+DEFAULT_CONNECTIONS = 8
+MIN_PIECE_SIZE = 1024 * 1024  # Smaller files aren't worth splitting
+MAX_PIECE_SIZE = 64 * 1024 * 1024
+READ_SIZE = 256 * 1024
+
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+
+
+class RangeError(Exception):
+    """The file could not be downloaded with range requests (caller falls back to yt-dlp)"""
+
+
+class RangeUnsupported(RangeError):
+    """The server doesn't serve byte ranges of this URL, or doesn't say how big it is"""
+
+
+class RangeCancelled(Exception):
+    """The job was cancelled while downloading"""
+
+
+def split_ranges(size, connections, min_piece=MIN_PIECE_SIZE, max_piece=MAX_PIECE_SIZE):
+    """
+    Split [0, size) into (start, end) pieces, end exclusive
+
+    About four pieces per connection, so a connection that finishes early
+    picks up more work instead of idling behind a slow one.
+    """
+    piece = min(max(size // (connections * 4), min_piece), max_piece)
+    return [(start, min(start + piece, size)) for start in range(0, size, piece)]
+
+
+class RangeDownload:
+    """
+    One multi-connection download of a direct file
+
+    Exposes the same poll/wait/terminate/kill/send_signal surface as
+    subprocess.Popen (like hls_engine.HLSDownload), so app.py can pause,
+    resume and cancel it like any other job.
+
+    With a checkpoint (see checkpoint.RangeCheckpoint) the pieces and how
+    far each got are persisted; a later run against the same file version
+    keeps those bytes and fetches only the rest.
+    """
+
+    def __init__(self, url, output_path, connections=DEFAULT_CONNECTIONS, retries=5,
+                 progress=None, session=None, throttle=None, checkpoint=None):
+        # progress(bytes_done, total_bytes, bytes_per_second)
+        # throttle(nbytes) blocks until that many more bytes may be taken in (see bandwidth.py)
+        self.url = url
+        self.output_path = output_path
+        self.connections = max(1, connections)
+        self.retries = retries
+        self.progress = progress
+        self.session = session or get_session()
+        self.throttle = throttle
+        self.checkpoint = checkpoint
+        self.size = None
+        self.returncode = None
+        self._validator = None  # ETag or Last-Modified: pieces must all come from one version
+        self._done_bytes = 0
+        self._pieces = []  # [start, end, offset reached] per piece, for the checkpoint
+        self._resumed_bytes = 0  # Already on disk from an earlier run
+        self._lock = threading.Lock()
+        self._started = None
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        self._done = threading.Event()
+
+    # --- Popen-compatible control surface ---
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.returncode
+
+    def terminate(self):
+        self._cancelled.set()
+        self._running.set()  # Wake paused workers so they can exit
+
+    kill = terminate
+
+    def send_signal(self, sig):
+        if sig == signal.SIGSTOP:
+            self._running.clear()
+        elif sig == signal.SIGCONT:
+            self._running.set()
+        else:
+            self.terminate()
+
+    # --- Download ---
+
+    def _check_state(self):
+        """Block while paused; raise if cancelled"""
+        self._running.wait()
+        if self._cancelled.is_set():
+            raise RangeCancelled()
+
+    def probe(self):
+        """
+        Ask for the first byte: a 206 with a Content-Range total proves the
+        server serves ranges (many don't send Accept-Ranges on HEAD)
+        """
+        try:
+            response = self.session.get(self.url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=(10, 30))
+        except requests.RequestException as e:
+            raise RangeError(f'Probe failed: {e}')
+        with response:
+            match = _CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+            if response.status_code != 206 or not match:
+                raise RangeUnsupported(f'No byte ranges (HTTP {response.status_code})')
+            self.url = response.url  # Skip the redirects for every piece
+            self.size = int(match.group(3))
+            etag = response.headers.get('ETag')
+            self._validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+        return self.size
+
+    def _fetch_piece(self, fd, piece):
+        """Fetch piece [start, end) into fd from the offset it reached, resuming within it on retries"""
+        start, end, offset = piece
+        if offset >= end:
+            return
+        for attempt in range(self.retries + 1):
+            self._check_state()
+            headers = {'Range': f'bytes={offset}-{end - 1}'}
+            if self._validator:
+                headers['If-Range'] = self._validator
+            try:
+                with self.session.get(self.url, headers=headers, stream=True, timeout=(10, 30)) as response:
+                    if response.status_code == 429 or response.status_code >= 500:
+                        # Overloaded or rate limited: worth another try from the same offset
+                        raise requests.HTTPError(f'HTTP {response.status_code}', response=response)
+                    if response.status_code == 200 and self._validator:
+                        raise RangeError(f'File changed on the server (HTTP 200 for bytes {offset}-{end - 1})')
+                    if response.status_code != 206:
+                        raise RangeError(f'Expected 206 for bytes {offset}-{end - 1}, got HTTP {response.status_code}')
+                    match = _CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+                    if not match or int(match.group(1)) != offset:
+                        raise RangeError(f'Asked for bytes {offset}-{end - 1}, got '
+                                         f"{response.headers.get('Content-Range') or 'no Content-Range'}")
+                    for chunk in response.iter_content(READ_SIZE):
+                        self._check_state()
+                        if self.throttle:
+                            self.throttle(len(chunk))
+                        chunk = chunk[:end - offset]
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        piece[2] = offset
+                        self._advance(len(chunk))
+                        if offset >= end:
+                            return
+                raise requests.ConnectionError(f'Connection closed at byte {offset} of piece {start}-{end - 1}')
+            except requests.RequestException as e:
+                if attempt == self.retries:
+                    raise RangeError(f'Piece {start}-{end - 1} failed after {self.retries} retries: {e}')
+                time.sleep(min(0.5 * 2 ** attempt, 5))
+
+    def _advance(self, count):
+        with self._lock:
+            self._done_bytes += count
+            done = self._done_bytes
+        if self.checkpoint and self.checkpoint.due():
+            with self._lock:
+                # Offsets only move past bytes already written
+                self.checkpoint.update(self.size, self._validator, [list(piece) for piece in self._pieces])
+        if self.progress:
+            elapsed = time.time() - self._started
+            self.progress(done, self.size, (done - self._resumed_bytes) / elapsed if elapsed > 0 else 0.0)
+
+    def _resume_pieces(self):
+        """Pieces saved by an earlier run of this same file version, or None to start over"""
+        saved = self.checkpoint.load() if self.checkpoint else None
+        if not saved or saved['size'] != self.size or saved['validator'] != self._validator:
+            return None
+        try:
+            if os.path.getsize(self.output_path) != self.size:
+                return None
+        except OSError:
+            return None
+        self._resumed_bytes = sum(offset - start for start, _, offset in saved['pieces'])
+        return saved['pieces']
+
+    def run(self):
+        """Download the file to output_path; returns output_path"""
+        try:
+            if self.size is None:
+                self.probe()
+            self._started = time.time()
+            self._resumed_bytes = 0
+            pieces = self._resume_pieces()
+            if pieces:
+                # Keep what an earlier run wrote; the file already has its full size
+                fd = os.open(self.output_path, os.O_RDWR)
+            else:
+                pieces = [[start, end, start] for start, end in split_ranges(self.size, self.connections)]
+                fd = os.open(self.output_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if self.size and not self._resumed_bytes:
+                    # Reserve the whole file up front: no fragmentation, and a full disk fails now
+                    if hasattr(os, 'posix_fallocate'):
+                        os.posix_fallocate(fd, 0, self.size)
+                    else:
+                        os.ftruncate(fd, self.size)
+                self._pieces = pieces
+                self._done_bytes = self._resumed_bytes
+                if self.checkpoint:
+                    self.checkpoint.update(self.size, self._validator, pieces)
+                with ThreadPoolExecutor(max_workers=max(1, min(self.connections, len(pieces)))) as pool:
+                    futures = [pool.submit(self._fetch_piece, fd, piece) for piece in pieces]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except BaseException:
+                        self.terminate()  # Stop the other pieces promptly
+                        raise
+            finally:
+                os.close(fd)
+            self.returncode = 0
+            return self.output_path
+        except RangeCancelled:
+            self.returncode = -signal.SIGTERM
+            raise
+        except Exception:
+            self.returncode = 1
+            raise
+        finally:
+            self._done.set()
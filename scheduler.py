@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Download Scheduler
+Bounded worker pool for server-side downloads with per-host connection
+caps and FIFO or priority ordering
+"""
+
+import bisect
+import itertools
+import threading
+from urllib.parse import urlparse
+
+
+def origin_host(url):
+    """Host a job's connections count against"""
+    return (urlparse(url).hostname or '').lower()
+
+
+class _Job:
+    def __init__(self, job_id, url, func, args, priority, connections, sort_key, resolve=None):
+        self.job_id = job_id
+        self.host = origin_host(url)
+        self.resolve = resolve
+        self.cancelled = False
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.connections = connections
+        self.sort_key = sort_key
+
+
+class DownloadScheduler:
+    """
+    Runs submitted jobs on a fixed pool of worker threads
+
+    Every job asks for a number of connections (its fragment/segment
+    concurrency). A job only starts when its origin host has at least one
+    free connection, and is granted at most what's left of that host's
+    cap, so the total number of sockets open to one CDN stays bounded no
+    matter how many users hit it. Jobs for a saturated host are skipped
+    over, not blocking jobs for other hosts behind them.
+
+    A job submitted with resolve (e.g. a page whose video is on a CDN)
+    first has resolve() run on a worker without taking connections; the
+    URL it returns re-keys the job to that host, and the job goes back to
+    its place in the queue.
+    """
+
+    def __init__(self, workers=4, connections_per_host=16, connections_per_job=16, order='fifo'):
+        if order not in ('fifo', 'priority'):
+            raise ValueError(f"Unknown queue order: {order}")
+        self.workers = max(1, workers)
+        self.connections_per_host = max(1, connections_per_host)
+        self.connections_per_job = max(1, connections_per_job)
+        self.order = order
+        self._queue = []  # Sorted list of (sort_key, _Job)
+        self._queued = {}  # job_id -> _Job
+        self._running = {}  # job_id -> _Job
+        self._resolving = {}  # job_id -> _Job having its URL resolved
+        self._host_connections = {}  # host -> connections granted to running jobs
+        self._counter = itertools.count()
+        self._lock = threading.Condition()
+        self._threads = []
+
+    def _start_workers(self):
+        # Workers start lazily so importing app.py doesn't spawn threads
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, daemon=True,
+                                      name=f'download-worker-{len(self._threads)}')
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job_id, url, func, args=(), priority=0, connections=None, resolve=None):
+        """
+        Queue func(*args, connections=N) to run on the pool
+
+        Higher priority runs first when the scheduler is in 'priority' order.
+        resolve() returns the URL the job will really fetch from (or None
+        to keep url's host).
+        """
+        connections = min(connections or self.connections_per_job, self.connections_per_host)
+        sequence = next(self._counter)
+        sort_key = (-priority, sequence) if self.order == 'priority' else (sequence,)
+        job = _Job(job_id, url, func, args, priority, connections, sort_key, resolve)
+        with self._lock:
+            self._start_workers()
+            bisect.insort(self._queue, (sort_key, job), key=lambda item: item[0])
+            self._queued[job_id] = job
+            self._lock.notify()
+
+    def cancel(self, job_id):
+        """Drop a job that hasn't started yet; returns True if it was queued"""
+        with self._lock:
+            if job_id in self._resolving:
+                self._resolving[job_id].cancelled = True  # Not re-queued once resolved
+                return True
+            job = self._queued.pop(job_id, None)
+            if job is None:
+                return False
+            self._queue.remove((job.sort_key, job))
+            return True
+
+    def position(self, job_id):
+        """1-based position of a queued job, or None if it isn't queued"""
+        with self._lock:
+            job = self._queued.get(job_id)
+            if job is None:
+                return None
+            return bisect.bisect_left(self._queue, job.sort_key, key=lambda item: item[0]) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': len(self._queue) + len(self._resolving),
+                'running': len(self._running),
+                'workers': self.workers,
+                'host_connections': dict(self._host_connections),
+            }
+
+    def _next_job(self):
+        """Pop the first queued job whose host has a free connection, or that needs resolving (lock held)"""
+        for index, (_, job) in enumerate(self._queue):
+            if job.resolve:
+                del self._queue[index]
+                del self._queued[job.job_id]
+                return job, 0
+            free = self.connections_per_host - self._host_connections.get(job.host, 0)
+            if free > 0:
+                del self._queue[index]
+                del self._queued[job.job_id]
+                return job, min(job.connections, free)
+        return None, 0
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                job, granted = self._next_job()
+                while job is None:
+                    self._lock.wait()
+                    job, granted = self._next_job()
+                if job.resolve:
+                    self._resolving[job.job_id] = job
+                else:
+                    self._running[job.job_id] = job
+                    self._host_connections[job.host] = self._host_connections.get(job.host, 0) + granted
+            if job.resolve:
+                self._resolve(job)
+                continue
+            try:
+                job.func(*job.args, connections=granted)
+            except Exception as e:
+                print(f"Scheduled job {job.job_id} crashed: {e}")
+            finally:
+                with self._lock:
+                    del self._running[job.job_id]
+                    remaining = self._host_connections[job.host] - granted
+                    if remaining:
+                        self._host_connections[job.host] = remaining
+                    else:
+                        del self._host_connections[job.host]
+                    self._lock.notify_all()
+
+    def _resolve(self, job):
+        """Run job.resolve() (no connections held), re-key the job and put it back in its place"""
+        resolve, job.resolve = job.resolve, None
+        try:
+            url = resolve()
+            if url:
+                job.host = origin_host(url)
+        except Exception as e:
+            print(f"Resolving job {job.job_id} failed: {e}")
+        with self._lock:
+            del self._resolving[job.job_id]
+            if not job.cancelled:
+                bisect.insort(self._queue, (job.sort_key, job), key=lambda item: item[0])
+                self._queued[job.job_id] = job
+            self._lock.notify_all()
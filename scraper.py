@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Page Scraper
+Finds m3u8/mp4 URLs in a web page by scanning the response as it streams
+in, stopping as soon as a playlist turns up
+"""
+
+import re
+import threading
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+CHUNK_SIZE = 16 * 1024
+MAX_PAGE_BYTES = 2 * 1024 * 1024  # Stop reading a page after this much HTML
+MAX_REDIRECTS = 5
+MAX_IFRAMES = 2  # Embedded players to follow when the page itself has nothing
+OVERLAP = 2048  # Bytes re-scanned across chunk boundaries (longest URL we expect)
+
+# One pass over each chunk finds the cheap anchors - a media extension or
+# an <iframe src> - and only the bytes around an extension are looked at
+# closely. Case-sensitive alternatives keep the regex engine on its fast
+# literal search.
+_ANCHOR_RE = re.compile(
+    rb'\.(?P<ext>m3u8|mp4|M3U8|MP4)(?![a-zA-Z0-9])'
+    rb'|<(?:iframe|IFRAME)\s[^>]*?src=["\'](?P<iframe>[^"\'<>]+)["\']'
+)
+_URL_TAIL_RE = re.compile(rb'[^\s<>"\']*')
+_ABSOLUTE_RE = re.compile(rb'https?:(?:\\?/){2}')
+# Relative URLs only count inside player configs ("file": "/v/a.m3u8") and <source src>
+_RELATIVE_CONTEXT_RE = re.compile(
+    rb'(?:"(?:file|src|hls|hlsUrl|url|source|videoUrl|video_url|contentUrl)"\s*:\s*'
+    rb'|<(?:source|SOURCE)\s[^>]*?src=)["\']\Z'
+)
+_DELIMITERS = tuple(bytes([c]) for c in b' \t\r\n<>"\'')
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared keep-alive session for page fetches"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = USER_AGENT
+            session.max_redirects = MAX_REDIRECTS
+            _session = session
+        return _session
+
+
+def is_direct_media_url(url):
+    """Whether a URL already points at a playlist or video file (query strings allowed)"""
+    path = urlparse(url).path.lower()
+    return path.endswith('.m3u8') or path.endswith('.mp4')
+
+
+def _clean(raw):
+    """Undo JSON/HTML escaping in a matched URL"""
+    url = raw.decode('utf-8', errors='ignore')
+    url = url.replace('\\/', '/').replace('\\u0026', '&').replace('&amp;', '&')
+    return url.rstrip('\\')
+
+
+def _media_url(buffer, match):
+    """
+    The URL around an extension anchor, or None if it isn't one
+
+    Returns False if the URL may continue past the end of the buffer.
+    """
+    lowest = max(match.start() - OVERLAP, 0)
+    start = max(buffer.rfind(d, lowest, match.start()) for d in _DELIMITERS) + 1
+    if start == 0 and lowest > 0:
+        return None  # Longer than any URL we care about
+    end = _URL_TAIL_RE.match(buffer, match.end()).end()
+    if end == len(buffer):
+        return False
+    absolute = _ABSOLUTE_RE.search(buffer, start, end)
+    if absolute:
+        return buffer[absolute.start():end]
+    if _RELATIVE_CONTEXT_RE.search(buffer, max(start - 256, 0), start):
+        return buffer[start:end]
+    return None
+
+
+def scan_chunks(chunks, base_url, stop_early=True):
+    """
+    Scan an iterable of HTML byte chunks for media URLs
+
+    Returns (candidates, iframes): candidates are (url, kind) tuples with
+    kind 'm3u8' or 'mp4', in page order. With stop_early, scanning ends
+    at the first m3u8 (the preferred kind), so the rest of the page is
+    never read.
+    """
+    candidates = []
+    iframes = []
+    seen = set()
+    tail = b''
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        following = next(chunks, None)
+        buffer = tail + chunk
+        for match in _ANCHOR_RE.finditer(buffer):
+            if match.group('iframe'):
+                src = urljoin(base_url, _clean(match.group('iframe')))
+                if src not in seen:
+                    seen.add(src)
+                    iframes.append(src)
+                continue
+            raw = _media_url(buffer, match)
+            if raw is False and following is not None:
+                continue  # Found again, whole, once the next chunk arrives
+            if not raw:
+                continue
+            url = urljoin(base_url, _clean(raw))
+            if url in seen:
+                continue
+            seen.add(url)
+            kind = match.group('ext').decode().lower()
+            candidates.append((url, kind))
+            if stop_early and kind == 'm3u8':
+                return candidates, iframes
+        tail = buffer[-OVERLAP:]
+        chunk = following
+    return candidates, iframes
+
+
+def _limited(response, max_bytes):
+    """Yield at most max_bytes of a streamed response body"""
+    read = 0
+    for chunk in response.iter_content(CHUNK_SIZE):
+        yield chunk
+        read += len(chunk)
+        if read >= max_bytes:
+            return
+
+
+def scan_page(page_url, stop_early=True, depth=1, session=None):
+    """Fetch a page (streamed) and return its media candidates, following iframes if needed"""
+    session = session or get_session()
+    with session.get(page_url, timeout=(5, 10), stream=True) as response:
+        response.raise_for_status()
+        candidates, iframes = scan_chunks(_limited(response, MAX_PAGE_BYTES), response.url, stop_early)
+
+    if not candidates and depth > 0:
+        for iframe_url in iframes[:MAX_IFRAMES]:
+            try:
+                candidates = scan_page(iframe_url, stop_early, depth - 1, session)
+            except requests.RequestException:
+                continue
+            if candidates:
+                break
+    return candidates
+
+
+def pick_candidate(candidates):
+    """Prefer the first m3u8, then the first mp4"""
+    for kind in ('m3u8', 'mp4'):
+        for url, candidate_kind in candidates:
+            if candidate_kind == kind:
+                return url
+    return None
+
+
+def extract_video_url(page_url, picker=None, height=None):
+    """
+    Extract m3u8 or mp4 URL from webpage
+
+    With a source_picker.SourcePicker, the whole page is scanned and the
+    candidate that probes best (within height) wins; otherwise the first
+    m3u8, then the first mp4.
+    """
+    try:
+        if picker:
+            return picker.pick(page_url, scan_page(page_url, stop_early=False), height)
+        return pick_candidate(scan_page(page_url))
+    except requests.RequestException as e:
+        print(f"URL extraction error: {e}")
+        return None
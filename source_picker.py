@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Source Picker
+Chooses among the m3u8/mp4 URLs a page links to by probing them all at
+once - a playlist fetch or a small ranged GET each - and scoring them on
+liveness, latency, a throughput sample and resolution. The winning
+mirror is remembered per site, so later pages from it skip the probing.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import requests
+
+from hls_engine import HLSError, get_session, parse_playlist
+from quality import pick_variant
+
+MAX_PROBES = 8  # Candidates probed per page, in page order
+PROBE_DEADLINE = 5.0  # Seconds before unfinished probes count as dead
+PROBE_TIMEOUT = (3, 5)
+SAMPLE_BYTES = 256 * 1024  # Read from each source to measure throughput...
+SAMPLE_SECONDS = 1.5  # ...or for this long, whichever comes first
+GOOD_THROUGHPUT = 4 * 1024 * 1024  # Bytes/s at which a source counts as fast enough
+DEFAULT_HEIGHT = 480  # Assumed for sources that don't say
+
+_HEIGHT_HINT_RE = re.compile(r'(?<![0-9])(\d{3,4})[pP](?![a-zA-Z0-9])')
+
+
+def _height_hint(url):
+    """Height a URL names, like .../video_720p.mp4, or None"""
+    match = _HEIGHT_HINT_RE.search(urlparse(url).path)
+    return int(match.group(1)) if match else None
+
+
+def _sample(session, url, byte_range=None):
+    """GET the start of url; returns (seconds to headers, bytes read, seconds reading)"""
+    start, length = byte_range or (0, SAMPLE_BYTES)
+    headers = {'Range': f'bytes={start}-{start + min(length, SAMPLE_BYTES) - 1}'}
+    requested = time.perf_counter()
+    with session.get(url, headers=headers, stream=True, timeout=PROBE_TIMEOUT) as response:
+        response.raise_for_status()
+        if response.headers.get('Content-Type', '').startswith('text/html'):
+            raise requests.RequestException('Got an HTML page, not media')
+        latency = time.perf_counter() - requested
+        read = 0
+        for chunk in response.iter_content(64 * 1024):
+            read += len(chunk)
+            if read >= SAMPLE_BYTES or time.perf_counter() - requested - latency >= SAMPLE_SECONDS:
+                break
+        return latency, read, time.perf_counter() - requested - latency
+
+
+def probe_source(url, kind, height=None, session=None):
+    """
+    Probe one candidate; returns a dict with alive, latency (s), throughput
+    (bytes/s), height and error
+
+    A playlist is fetched (and for a master playlist, the variant that
+    would be downloaded at this height cap), then the first segment is
+    sampled. A direct file has its first bytes sampled.
+    """
+    session = session or get_session()
+    result = {'url': url, 'kind': kind, 'alive': False, 'latency': None, 'throughput': 0.0,
+              'height': _height_hint(url), 'error': None}
+    try:
+        if kind == 'm3u8':
+            requested = time.perf_counter()
+            response = session.get(url, timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            result['latency'] = time.perf_counter() - requested
+            playlist = parse_playlist(response.text, response.url)
+            if playlist['type'] == 'master':
+                if not playlist['variants']:
+                    raise HLSError('Master playlist has no variants')
+                variant = pick_variant(playlist['variants'], height)
+                result['height'] = variant['height'] or result['height']
+                response = session.get(variant['url'], timeout=PROBE_TIMEOUT)
+                response.raise_for_status()
+                playlist = parse_playlist(response.text, response.url)
+            if not playlist.get('segments'):
+                raise HLSError('Playlist has no segments')
+            segment = playlist['segments'][0]
+            _, read, seconds = _sample(session, segment['url'], segment['range'])
+        else:
+            result['latency'], read, seconds = _sample(session, url)
+    except (requests.RequestException, HLSError, ValueError) as e:
+        result['error'] = str(e)
+        return result
+    result['alive'] = read > 0
+    result['throughput'] = read / seconds if seconds > 0 else float(GOOD_THROUGHPUT)
+    return result
+
+
+def score(result, height=None):
+    """
+    How good a probed source is; None for a dead one
+
+    Resolution times speed. Resolution counts up to the requested cap; a
+    file known to be taller than the cap counts less, as all of it would
+    be downloaded. Throughput counts in full from GOOD_THROUGHPUT up and
+    proportionally below it, and every second of latency halves the
+    score. So a mirror that can't keep up loses to a lower resolution
+    that can, and among equals the fastest wins.
+    """
+    if not result['alive']:
+        return None
+    cap = height or 2160
+    source_height = result['height'] or DEFAULT_HEIGHT
+    resolution = source_height / cap if source_height <= cap else cap / source_height
+    speed = min(result['throughput'] / GOOD_THROUGHPUT, 1.0)
+    return resolution * speed / (1 + result['latency'])
+
+
+class SourcePicker:
+    """
+    pick(page_url, candidates, height) returns the best candidate URL
+
+    candidates are (url, kind) tuples as scraper.scan_page returns them.
+    The winner's host and kind are cached per page host for ttl seconds;
+    while a later page from that site offers a candidate on the same
+    host, it is taken without probing. forget(page_url) drops the entry
+    (e.g. when a download from the remembered host fails).
+    """
+
+    def __init__(self, ttl=3600, max_hosts=512, session=None):
+        self.ttl = ttl
+        self.max_hosts = max_hosts
+        self.session = session
+        self._winners = OrderedDict()  # page host -> (created, media host, kind), oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.probes = 0
+        self.probe_seconds = 0.0
+
+    def _cached(self, page_host, candidates):
+        with self._lock:
+            entry = self._winners.get(page_host)
+            if entry and time.time() - entry[0] > self.ttl:
+                del self._winners[page_host]
+                entry = None
+            if not entry:
+                return None
+            for url, kind in candidates:
+                if (urlparse(url).netloc, kind) == entry[1:]:
+                    self._winners.move_to_end(page_host)
+                    self.hits += 1
+                    return url
+        return None
+
+    def _remember(self, page_host, url, kind):
+        with self._lock:
+            self._winners[page_host] = (time.time(), urlparse(url).netloc, kind)
+            self._winners.move_to_end(page_host)
+            while len(self._winners) > self.max_hosts:
+                self._winners.popitem(last=False)
+
+    def forget(self, page_url):
+        with self._lock:
+            self._winners.pop(urlparse(page_url).netloc, None)
+
+    def probe_all(self, candidates, height=None):
+        """Probe candidates concurrently; returns results (dead ones too) best first"""
+        candidates = candidates[:MAX_PROBES]
+        started = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=len(candidates))
+        futures = [pool.submit(probe_source, url, kind, height, self.session) for url, kind in candidates]
+        wait(futures, timeout=PROBE_DEADLINE)
+        pool.shutdown(wait=False, cancel_futures=True)  # Stragglers finish in the background
+        results = []
+        for future, (url, kind) in zip(futures, candidates):
+            if future.done():
+                results.append(future.result())
+            else:
+                results.append({'url': url, 'kind': kind, 'alive': False, 'latency': None,
+                                'throughput': 0.0, 'height': None, 'error': 'Probe timed out'})
+        with self._lock:
+            self.probes += 1
+            self.probe_seconds += time.perf_counter() - started
+        return sorted(results, key=lambda r: -1 if score(r, height) is None else score(r, height), reverse=True)
+
+    def pick(self, page_url, candidates, height=None):
+        if len(candidates) <= 1:
+            return candidates[0][0] if candidates else None
+        page_host = urlparse(page_url).netloc
+        cached = self._cached(page_host, candidates)
+        if cached:
+            return cached
+        with self._lock:
+            self.misses += 1
+
+        # Playlists first, as scanning found them preferred
+        ordered = sorted(candidates, key=lambda c: c[1] != 'm3u8')
+        results = self.probe_all(ordered, height)
+        best = results[0]
+        for r in results:
+            state = f"{r['throughput'] / 1024:.0f} KB/s, {r['latency']:.2f} s, {r['height'] or '?'}p" \
+                if r['alive'] else r['error']
+            print(f"Source {'*' if r is best else ' '} {r['url'][:100]}: {state}")
+        if not best['alive']:
+            return ordered[0][0]  # Nothing answered; let the download report the error
+        self._remember(page_host, best['url'], best['kind'])
+        return best['url']
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hosts': len(self._winners),
+                'hits': self.hits,
+                'misses': self.misses,
+                'probes': self.probes,
+                'avg_probe_seconds': round(self.probe_seconds / self.probes, 3) if self.probes else 0.0,
+            }
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Streaming Remux
+Turns an HLS VOD playlist into a fragmented MP4 while it downloads: TS
+segments are piped through ffmpeg with a copy remux (no re-encode), and
+fMP4 segments are passed through as they are.
+
+The whole pipeline is pull-driven: the client socket drains ffmpeg's
+stdout, ffmpeg drains the segment feeder, and the feeder only fetches a
+bounded window ahead, so memory stays flat however slow the client is.
+"""
+
+import os
+import shutil
+import signal
+import subprocess
+import threading
+from collections import deque
+from contextlib import closing
+
+from hls_engine import HLSDownload, HLSCancelled, HLSError, HLSUnsupported
+
+# Pipe reads start small (fast first bytes) and grow while the producer keeps up
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+# Write a moov up front and a moof per keyframe, so players can start on
+# the first fragment and the output never needs seeking back into
+FRAGMENT_FLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+
+
+def drain(pipe, lines):
+    """Read a pipe to EOF in the background, keeping its last lines (avoids pipe-full stalls)"""
+    def run():
+        for line in iter(pipe.readline, b''):
+            lines.append(line.decode('utf-8', errors='ignore').rstrip())
+        pipe.close()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+class ChunkSizer:
+    """
+    Read size for a pipe that follows its throughput
+
+    A read that fills the whole chunk means more was already waiting, so
+    the next read asks for twice as much; a read that comes back mostly
+    empty halves it. Fast producers get fewer, larger writes to the socket;
+    slow ones don't sit on buffered bytes.
+    """
+
+    def __init__(self, minimum=MIN_CHUNK_SIZE, maximum=MAX_CHUNK_SIZE):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = minimum
+
+    def update(self, got):
+        if got >= self.size:
+            self.size = min(self.size * 2, self.maximum)
+        elif got < self.size // 4:
+            self.size = max(self.size // 2, self.minimum)
+
+
+def stop_process(process, timeout=5, group=False):
+    """
+    Terminate a child, killing it if it doesn't exit in time
+
+    With group, the signal goes to the child's whole process group (start it
+    with start_new_session=True), so helpers it spawned stop too.
+    """
+    def send(sig):
+        try:
+            if group:
+                os.killpg(process.pid, sig)
+            else:
+                process.send_signal(sig)
+        except ProcessLookupError:
+            pass
+
+    if process.poll() is None:
+        send(signal.SIGTERM)
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            send(signal.SIGKILL)
+            process.wait()
+
+
+class HLSStream:
+    """
+    One HLS playlist streamed out as fragmented MP4
+
+    open() resolves the playlist before any response is started, so the
+    caller can still fall back to another method; iterating then yields
+    the MP4 bytes. complete is True once everything was delivered.
+    """
+
+    def __init__(self, url, concurrency=8, select_variant=None, session=None):
+        self.job = HLSDownload(url, None, concurrency=concurrency, session=session,
+                               select_variant=select_variant)
+        self.playlist = None
+        self.complete = False
+        self.error = None
+        self.stderr = deque(maxlen=20)
+        self._process = None
+        self._feeder = None
+
+    def open(self):
+        """Resolve the playlist; raises HLSError if it can't be streamed this way"""
+        self.playlist = self.job.resolve()
+        if self.playlist['init'] is None and not shutil.which('ffmpeg'):
+            raise HLSUnsupported('ffmpeg is needed to remux TS segments')
+        return self
+
+    def __iter__(self):
+        if self.playlist['init'] is not None:
+            return self._passthrough()
+        return self._remux()
+
+    def _passthrough(self):
+        """Segments are fMP4 already: the init section, then the segments as fetched"""
+        try:
+            yield self.job.fetch_init(self.playlist)
+            with closing(self.job.iter_segments(self.playlist['segments'])) as fetched:
+                for _, data in fetched:
+                    yield data
+            self.complete = True
+        except (HLSError, HLSCancelled) as e:
+            self.error = e
+        finally:
+            self.close()
+
+    def _feed(self, stdin):
+        """Write segments into ffmpeg; blocks whenever ffmpeg (and so the client) falls behind"""
+        try:
+            with closing(self.job.iter_segments(self.playlist['segments'])) as fetched:
+                for _, data in fetched:
+                    stdin.write(data)
+        except (HLSError, HLSCancelled) as e:
+            self.error = e
+        except OSError:
+            pass  # ffmpeg went away (client disconnected)
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def _remux(self):
+        self._process = subprocess.Popen(
+            ['ffmpeg', '-v', 'error', '-nostdin',
+             # Keep probing to well under one segment, so output starts right away
+             '-probesize', '1M', '-analyzeduration', '2M',
+             '-f', 'mpegts', '-i', 'pipe:0',
+             '-map', '0:v?', '-map', '0:a?', '-c', 'copy',
+             '-f', 'mp4', '-movflags', FRAGMENT_FLAGS, 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        drain(self._process.stderr, self.stderr)
+        self._feeder = threading.Thread(target=self._feed, args=(self._process.stdin,), daemon=True)
+        self._feeder.start()
+        sizer = ChunkSizer()
+        try:
+            while True:
+                # read1 returns whatever ffmpeg has produced, without waiting for a full chunk
+                chunk = self._process.stdout.read1(sizer.size)
+                if not chunk:
+                    break
+                sizer.update(len(chunk))
+                yield chunk
+            self._process.wait()
+            self._feeder.join()
+            self.complete = self._process.returncode == 0 and self.error is None
+            if self._process.returncode != 0:
+                print(f"ffmpeg remux failed: {' / '.join(self.stderr)}")
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop fetching and remuxing (safe to call more than once)"""
+        self.job.terminate()
+        if self._process:
+            stop_process(self._process)
+            self._process.stdout.close()
+        if self._feeder:
+            self._feeder.join(timeout=5)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Stream Statistics
+Counts the long-lived responses in flight (/stream, /events, ZIP bundles)
+and the bytes they send, for the stats endpoint
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class StreamStats:
+    """Active streams and their throughput over a sliding window"""
+
+    def __init__(self, window=10):
+        self.window = window
+        self._streams = {}  # stream id -> {'kind', 'started', 'bytes'}
+        self._recent = deque()  # [second, bytes] buckets within the window
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.started = 0
+        self.completed = 0
+        self.aborted = 0
+        self.total_bytes = 0
+
+    def start(self, kind):
+        with self._lock:
+            stream_id = next(self._ids)
+            self._streams[stream_id] = {'kind': kind, 'started': time.time(), 'bytes': 0}
+            self.started += 1
+            return stream_id
+
+    def add(self, stream_id, size):
+        second = int(time.time())
+        with self._lock:
+            self._streams[stream_id]['bytes'] += size
+            self.total_bytes += size
+            if self._recent and self._recent[-1][0] == second:
+                self._recent[-1][1] += size
+            else:
+                self._recent.append([second, size])
+                self._prune(second)
+
+    def finish(self, stream_id, complete):
+        with self._lock:
+            self._streams.pop(stream_id, None)
+            if complete:
+                self.completed += 1
+            else:
+                self.aborted += 1
+
+    def _prune(self, now):
+        while self._recent and self._recent[0][0] <= now - self.window:
+            self._recent.popleft()
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            self._prune(int(now))
+            by_kind = {}
+            for stream in self._streams.values():
+                by_kind[stream['kind']] = by_kind.get(stream['kind'], 0) + 1
+            return {
+                'active': len(self._streams),
+                'active_by_kind': by_kind,
+                'bytes_per_second': sum(size for _, size in self._recent) / self.window,
+                'started': self.started,
+                'completed': self.completed,
+                'aborted': self.aborted,
+                'total_bytes': self.total_bytes,
+            }
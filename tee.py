@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Stream Tee
+Fetches a video from the origin once while any number of clients watch:
+the fetch writes to a file on disk, and every client - the one that
+started it and any that ask for the same video meanwhile - reads that
+file, waiting behind the writer when it catches up. A complete file is
+handed over (e.g. to the download cache) for later requests.
+"""
+
+import threading
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
+
+READ_SIZE = 256 * 1024
+
+
+class Tee:
+    """
+    One origin fetch being written to path
+
+    read() yields the file from the start, following the writer until it
+    finishes. The fetch stops early once every reader that attached has
+    gone; if none ever attaches, it runs to the end.
+    """
+
+    def __init__(self, key, path):
+        self.key = key
+        self.path = Path(path)
+        self.final_path = None  # Where the file went once complete
+        self.size = 0
+        self.readers = 0
+        self.attached = 0
+        self.started = time.time()
+        self.done = False
+        self.complete = False
+        self._cond = threading.Condition()
+
+    def _produce(self, f, chunks, is_complete, on_complete, on_done):
+        complete = False
+        try:
+            with f, closing(iter(chunks)) as body:
+                for chunk in body:
+                    f.write(chunk)
+                    with self._cond:
+                        self.size += len(chunk)
+                        self._cond.notify_all()
+                        if self.attached and not self.readers:
+                            break  # Everyone left: stop fetching
+                else:
+                    complete = is_complete()
+        except Exception as e:
+            print(f"Stream tee failed: {e}")
+        finally:
+            with self._cond:
+                # Under the lock, so a reader opens either the file here or where it went
+                if complete:
+                    try:
+                        self.final_path = Path(on_complete(self.path))
+                    except Exception as e:
+                        print(f"Could not keep streamed file: {e}")
+                        complete = False
+                if not complete:
+                    self.path.unlink(missing_ok=True)
+                self.complete = complete
+                self.done = True
+                self._cond.notify_all()
+            # Only now, so a request in between finds this tee or the cached file, never neither
+            on_done(self)
+
+    def read(self):
+        with self._cond:
+            try:
+                f = open(self.final_path or self.path, 'rb')
+            except FileNotFoundError:
+                return  # The fetch failed (and its file was removed) before this reader started
+            self.readers += 1
+            self.attached += 1
+        try:
+            offset = 0
+            while True:
+                with self._cond:
+                    while offset >= self.size and not self.done:
+                        self._cond.wait()
+                    size = self.size
+                if offset >= size:
+                    return
+                data = f.read(min(size - offset, READ_SIZE))
+                if not data:
+                    return
+                offset += len(data)
+                yield data
+        finally:
+            f.close()
+            with self._cond:
+                self.readers -= 1
+
+
+class TeeRegistry:
+    """Tees in progress, by cache key; files are written into directory"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._tees = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._tees.get(key)
+
+    def start(self, key, chunks, is_complete, on_complete):
+        """
+        Start writing chunks to disk under key, unless that's already
+        under way; returns (tee, created). When it wasn't created, chunks
+        is not used.
+
+        is_complete() says whether chunks ended because the video did;
+        on_complete(path) takes the finished file and returns its new path.
+        """
+        with self._lock:
+            tee = self._tees.get(key)
+            if tee:
+                return tee, False
+            tee = Tee(key, self.directory / f'stream-{uuid.uuid4()}.mp4')
+            # Created before anyone can read it, so readers never find it missing mid-fetch
+            f = open(tee.path, 'wb', buffering=0)
+            self._tees[key] = tee
+        threading.Thread(target=tee._produce, args=(f, chunks, is_complete, on_complete, self._done),
+                         daemon=True).start()
+        return tee, True
+
+    def _done(self, tee):
+        with self._lock:
+            if self._tees.get(tee.key) is tee:
+                del self._tees[tee.key]
+
+    def stats(self):
+        with self._lock:
+            tees = list(self._tees.values())
+        return {
+            'active': len(tees),
+            'readers': sum(tee.readers for tee in tees),
+            'bytes': sum(tee.size for tee in tees),
+        }
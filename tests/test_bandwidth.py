@@ -0,0 +1,76 @@
+"""Shaper global cap shares and per-flow caps (timing based, with generous margins)"""
+
+import threading
+import time
+
+from bandwidth import DOWNLOAD, STREAM, Shaper, shaped
+
+CHUNK = 16 * 1024
+DURATION = 1.0
+
+
+def run_flows(shaper, kinds, duration=DURATION):
+    """Push chunks through one flow per kind at once; returns bytes moved per flow"""
+    flows = [shaper.flow(kind, label=f'{kind}-{index}') for index, kind in enumerate(kinds)]
+    start = threading.Barrier(len(flows))
+    deadline = time.monotonic() + duration
+
+    def pump(flow):
+        start.wait()
+        while time.monotonic() < deadline:
+            flow.consume(CHUNK)
+
+    threads = [threading.Thread(target=pump, args=(flow,)) for flow in flows]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for flow in flows:
+        flow.close()
+    return [flow.bytes for flow in flows]
+
+
+def test_equal_weights_share_equally():
+    rate = 2 * 1024 * 1024
+    first, second = run_flows(Shaper(rate=rate), [DOWNLOAD, DOWNLOAD])
+    assert 0.7 < first / second < 1.4
+    assert first + second < rate * DURATION * 1.3
+
+
+def test_streams_get_their_weight():
+    rate = 2 * 1024 * 1024
+    download, stream = run_flows(Shaper(rate=rate), [DOWNLOAD, STREAM])
+    # Default weights 1:4, so the stream should get about four fifths
+    assert 2.5 < stream / download < 6
+    assert download + stream < rate * DURATION * 1.3
+
+
+def test_idle_share_goes_to_the_others():
+    rate = 1024 * 1024
+    shaper = Shaper(rate=rate)
+    idle = shaper.flow(STREAM)  # Registered but never sends
+    download, = run_flows(shaper, [DOWNLOAD])
+    idle.close()
+    assert download > rate * DURATION * 0.7
+
+
+def test_per_flow_cap():
+    cap = 256 * 1024
+    shaper = Shaper(caps={DOWNLOAD: cap})
+    capped, uncapped = run_flows(shaper, [DOWNLOAD, STREAM], duration=0.5)
+    assert capped < cap * 0.5 * 1.5
+    assert uncapped > capped * 4
+
+
+def test_configure_applies_to_running_flows():
+    shaper = Shaper(rate=64 * 1024)
+    shaper.configure(rate=0, caps={STREAM: 128 * 1024})
+    assert shaper.rate == 0
+    assert shaper.flow(STREAM).limit() == 128 * 1024
+    assert shaper.flow(STREAM, cap=0).limit() == 0
+
+
+def test_shaped_closes_its_flow():
+    shaper = Shaper()
+    assert b''.join(shaped((chunk for chunk in [b'ab', b'cd']), shaper, STREAM)) == b'abcd'
+    assert shaper.stats()['flows'] == []
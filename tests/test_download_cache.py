@@ -0,0 +1,105 @@
+"""DownloadCache keys, TTL from last use and LRU eviction"""
+
+import pytest
+
+import download_cache
+from download_cache import DownloadCache, cache_key, normalize_url
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(download_cache.time, 'time', clock)
+    return clock
+
+
+def add(cache, tmp_path, key, size, aliases=()):
+    path = tmp_path / f'incoming-{key}.mp4'
+    path.write_bytes(b'x' * size)
+    return cache.put([key, *aliases], path)
+
+
+def test_normalized_urls_share_a_key():
+    assert normalize_url('HTTPS://Example.com:443/v?b=2&a=1&utm_source=x#t=3') == 'https://example.com/v?a=1&b=2'
+    assert cache_key('https://example.com/v?a=1&b=2') == cache_key('https://EXAMPLE.com/v?b=2&a=1')
+    assert cache_key('https://example.com/v', 'best') != cache_key('https://example.com/v', '720p')
+
+
+def test_put_moves_the_file_and_aliases_resolve(tmp_path, clock):
+    cache = DownloadCache(tmp_path / 'cache')
+    path = add(cache, tmp_path, 'media', 10, aliases=['page'])
+    assert path == tmp_path / 'cache' / 'media.mp4'
+    assert not (tmp_path / 'incoming-media.mp4').exists()
+    assert cache.get('page') == path
+    assert cache.get('other') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl_counts_from_last_use(tmp_path, clock):
+    cache = DownloadCache(tmp_path / 'cache', ttl=100)
+    add(cache, tmp_path, 'used', 10)
+    path = add(cache, tmp_path, 'idle', 10)
+    clock.now += 80
+    assert cache.get('used')
+    clock.now += 80
+    # 160s after both were added: the one fetched 80s ago is still fresh
+    assert cache.get('used')
+    assert cache.get('idle') is None
+    assert not path.exists()
+
+
+def test_touch_keeps_a_file_alive(tmp_path, clock):
+    cache = DownloadCache(tmp_path / 'cache', ttl=100)
+    path = add(cache, tmp_path, 'served', 10)
+    clock.now += 80
+    cache.touch(path)
+    clock.now += 80
+    assert cache.get('served') == path
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path, clock):
+    cache = DownloadCache(tmp_path / 'cache', max_bytes=250)
+    add(cache, tmp_path, 'a', 100)
+    clock.now += 1
+    add(cache, tmp_path, 'b', 100)
+    clock.now += 1
+    assert cache.get('a')  # Now b is the least recently used
+    clock.now += 1
+    add(cache, tmp_path, 'c', 100)
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+    assert cache.stats()['bytes'] == 200
+
+
+def test_evict_frees_extra_space(tmp_path, clock):
+    cache = DownloadCache(tmp_path / 'cache')
+    for key in 'abc':
+        add(cache, tmp_path, key, 100)
+        clock.now += 1
+    assert cache.evict(free_bytes=150) == 200
+    assert [key for key in 'abc' if cache.get(key)] == ['c']
+
+
+def test_index_is_shared_between_instances(tmp_path, clock):
+    first = DownloadCache(tmp_path / 'cache')
+    second = DownloadCache(tmp_path / 'cache')
+    path = add(first, tmp_path, 'a', 10)
+    assert second.get('a') == path
+
+
+def test_claim_and_release(tmp_path):
+    cache = DownloadCache(tmp_path / 'cache')
+    assert cache.claim('k', 'job1') is None
+    assert cache.claim('k', 'job2') == 'job1'
+    cache.release('k', 'job2')  # Not the owner: no effect
+    assert cache.claim('k', 'job3') == 'job1'
+    cache.release('k', 'job1')
+    assert cache.claim('k', 'job3') is None
@@ -0,0 +1,135 @@
+"""parse_playlist and the checks HLSDownload.resolve makes before downloading"""
+
+import pytest
+
+from hls_engine import HLSDownload, HLSError, HLSUnsupported, parse_playlist
+
+MASTER = """#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="English",DEFAULT=YES
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2",AUDIO="aud"
+360/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2800000,RESOLUTION=1280x720
+https://cdn.example.com/720/index.m3u8
+"""
+
+MEDIA = """#EXTM3U
+#EXT-X-VERSION:4
+#EXT-X-TARGETDURATION:6
+#EXT-X-MEDIA-SEQUENCE:7
+#EXTINF:6.0,
+seg7.ts
+#EXTINF:5.5,
+seg8.ts
+#EXT-X-ENDLIST
+"""
+
+
+class FakeResponse:
+    def __init__(self, url, text):
+        self.url = url
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """Serves playlists from a dict of url -> text"""
+
+    def __init__(self, playlists):
+        self.playlists = playlists
+
+    def get(self, url, **kwargs):
+        return FakeResponse(url, self.playlists[url])
+
+
+def test_master_playlist_variants_and_media():
+    playlist = parse_playlist(MASTER, 'https://example.com/video/master.m3u8')
+    assert playlist['type'] == 'master'
+    low, high = playlist['variants']
+    assert low == {
+        'url': 'https://example.com/video/360/index.m3u8',
+        'bandwidth': 800000,
+        'width': 640,
+        'height': 360,
+        'codecs': 'avc1.4d401e,mp4a.40.2',
+        'audio': 'aud',
+    }
+    assert high['url'] == 'https://cdn.example.com/720/index.m3u8'
+    assert (high['height'], high['codecs'], high['audio']) == (720, '', None)
+    assert playlist['media'] == [{'TYPE': 'AUDIO', 'GROUP-ID': 'aud', 'NAME': 'English', 'DEFAULT': 'YES'}]
+
+
+def test_media_playlist_segments():
+    playlist = parse_playlist(MEDIA, 'https://example.com/video/720/index.m3u8')
+    assert playlist['type'] == 'media'
+    assert playlist['endlist'] is True
+    assert playlist['init'] is None
+    assert [(s['url'], s['duration'], s['sequence']) for s in playlist['segments']] == [
+        ('https://example.com/video/720/seg7.ts', 6.0, 7),
+        ('https://example.com/video/720/seg8.ts', 5.5, 8),
+    ]
+    assert all(s['key'] is None and s['range'] is None for s in playlist['segments'])
+
+
+def test_byte_ranges_and_init_section():
+    text = """#EXTM3U
+#EXT-X-MAP:URI="init.mp4",BYTERANGE="700@0"
+#EXTINF:4,
+#EXT-X-BYTERANGE:1000@700
+media.mp4
+#EXTINF:4,
+#EXT-X-BYTERANGE:1200
+media.mp4
+#EXT-X-ENDLIST
+"""
+    playlist = parse_playlist(text, 'https://example.com/a/index.m3u8')
+    assert playlist['init'] == {'url': 'https://example.com/a/init.mp4', 'range': (0, 700)}
+    # A range without an offset continues where the previous one of that URI ended
+    assert [s['range'] for s in playlist['segments']] == [(700, 1000), (1700, 1200)]
+
+
+def test_encryption_applies_until_method_none():
+    text = """#EXTM3U
+#EXT-X-KEY:METHOD=AES-128,URI="https://keys.example.com/k1",IV=0x1234
+#EXTINF:6,
+a.ts
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:6,
+b.ts
+#EXT-X-ENDLIST
+"""
+    first, second = parse_playlist(text, 'https://example.com/index.m3u8')['segments']
+    assert first['key'] == {'METHOD': 'AES-128', 'URI': 'https://keys.example.com/k1', 'IV': '0x1234'}
+    assert second['key'] is None
+
+
+def test_live_playlist_has_no_endlist():
+    playlist = parse_playlist(MEDIA.replace('#EXT-X-ENDLIST\n', ''), 'https://example.com/live.m3u8')
+    assert playlist['endlist'] is False
+
+
+def test_not_a_playlist():
+    with pytest.raises(HLSError):
+        parse_playlist('<html></html>', 'https://example.com/index.m3u8')
+
+
+def test_resolve_follows_the_best_variant():
+    session = FakeSession({
+        'https://example.com/video/master.m3u8': MASTER,
+        'https://cdn.example.com/720/index.m3u8': MEDIA,
+    })
+    download = HLSDownload('https://example.com/video/master.m3u8', None, session=session)
+    playlist = download.resolve()
+    assert download.variant['height'] == 720
+    assert playlist['segments'][0]['url'] == 'https://cdn.example.com/720/seg7.ts'
+
+
+@pytest.mark.parametrize('text', [
+    MEDIA.replace('#EXT-X-ENDLIST\n', ''),
+    MEDIA.replace('#EXTINF:6.0,', '#EXT-X-KEY:METHOD=SAMPLE-AES,URI="skd://key"\n#EXTINF:6.0,'),
+], ids=['live', 'encrypted'])
+def test_resolve_rejects_what_it_cannot_download(text):
+    session = FakeSession({'https://example.com/index.m3u8': text})
+    with pytest.raises(HLSUnsupported):
+        HLSDownload('https://example.com/index.m3u8', None, session=session).resolve()
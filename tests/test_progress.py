@@ -0,0 +1,65 @@
+"""parse_progress on yt-dlp --progress-template lines"""
+
+import json
+
+from progress import PROGRESS_MARKER, PROGRESS_TEMPLATE, format_progress, parse_progress
+
+
+def line(**fields):
+    return PROGRESS_MARKER + json.dumps(fields)
+
+
+def test_template_prints_the_marker():
+    assert PROGRESS_TEMPLATE.startswith('download:' + PROGRESS_MARKER)
+
+
+def test_exact_total():
+    fields = parse_progress(line(status='downloading', downloaded_bytes=512, total_bytes=2048,
+                                 total_bytes_estimate=None, speed=1024.5, eta=2,
+                                 fragment_index=None, fragment_count=None))
+    assert fields == {
+        'downloaded_bytes': 512,
+        'total_bytes': 2048,
+        'speed': 1024.5,
+        'eta': 2,
+        'fragment_index': None,
+        'fragment_count': None,
+        'percent': 25.0,
+    }
+
+
+def test_estimated_total_and_cap_at_100():
+    fields = parse_progress(line(downloaded_bytes=3000, total_bytes=None, total_bytes_estimate=2000))
+    assert fields['total_bytes'] == 2000
+    assert fields['percent'] == 100.0
+
+
+def test_fragments_when_size_unknown():
+    fields = parse_progress(line(downloaded_bytes=100, total_bytes=None, fragment_index=3, fragment_count=12))
+    assert fields['percent'] == 25.0
+
+
+def test_no_percent_without_a_total():
+    fields = parse_progress(line(downloaded_bytes=100, speed=None, eta=None))
+    assert 'percent' not in fields
+    assert fields['speed'] is None
+
+
+def test_non_numbers_are_dropped():
+    fields = parse_progress(line(downloaded_bytes='100', total_bytes=True, speed='NA', eta=[1]))
+    assert fields['downloaded_bytes'] is None
+    assert fields['total_bytes'] is None
+    assert fields['speed'] is None
+    assert fields['eta'] is None
+
+
+def test_other_lines_are_ignored():
+    assert parse_progress('[download] Destination: video.mp4') is None
+    assert parse_progress(PROGRESS_MARKER + '{not json') is None
+    assert parse_progress('') is None
+
+
+def test_format_progress():
+    text = format_progress({'percent': 50.0, 'total_bytes': 2 * 1024 ** 2, 'speed': 1024 ** 2, 'eta': 61,
+                            'fragment_index': 2, 'fragment_count': 4})
+    assert text == '[download]  50.0% of 2.00MiB at 1.00MiB/s ETA 01:01 (frag 2/4)'
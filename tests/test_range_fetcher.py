@@ -0,0 +1,130 @@
+"""split_ranges and RangeDownload against an in-memory range server"""
+
+import os
+import re
+
+import pytest
+
+from checkpoint import RangeCheckpoint
+from range_fetcher import MIN_PIECE_SIZE, RangeDownload, RangeError, split_ranges
+
+URL = 'https://cdn.example.com/video.mp4'
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.url = URL
+
+    def iter_content(self, size):
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class RangeServer:
+    """Serves data with Range support; records the ranges asked for"""
+
+    def __init__(self, data, etag='"v1"', failures=0):
+        self.data = data
+        self.etag = etag
+        self.failures = failures  # Pieces answered with a 503 before serving normally
+        self.requested = []
+
+    def get(self, url, headers=None, **kwargs):
+        start, end = map(int, re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups())
+        if headers.get('If-Range') not in (None, self.etag):
+            return FakeResponse(200, self.data, {'ETag': self.etag})
+        if self.failures and start:
+            self.failures -= 1
+            return FakeResponse(503)
+        self.requested.append((start, end))
+        end = min(end, len(self.data) - 1)
+        return FakeResponse(206, self.data[start:end + 1], {
+            'Content-Range': f'bytes {start}-{end}/{len(self.data)}',
+            'ETag': self.etag,
+        })
+
+
+def test_split_ranges_covers_the_file_without_overlap():
+    size = 37 * MIN_PIECE_SIZE + 123
+    pieces = split_ranges(size, 4)
+    assert pieces[0][0] == 0 and pieces[-1][1] == size
+    assert all(end == next_start for (_, end), (next_start, _) in zip(pieces, pieces[1:]))
+    # About four pieces per connection
+    assert 14 <= len(pieces) <= 18
+
+
+def test_split_ranges_piece_bounds():
+    assert split_ranges(1000, 8) == [(0, 1000)]
+    assert split_ranges(3 * MIN_PIECE_SIZE, 8) == [(i * MIN_PIECE_SIZE, (i + 1) * MIN_PIECE_SIZE) for i in range(3)]
+    assert len(split_ranges(10 * 1024 ** 3, 1, max_piece=64 * 1024 ** 2)) == 160
+    assert split_ranges(0, 4) == []
+
+
+def test_download_writes_every_piece(tmp_path):
+    data = os.urandom(3 * MIN_PIECE_SIZE + 5)
+    output = tmp_path / 'video.mp4'
+    RangeDownload(URL, output, connections=3, session=RangeServer(data)).run()
+    assert output.read_bytes() == data
+
+
+def test_server_errors_are_retried(tmp_path):
+    data = os.urandom(2 * MIN_PIECE_SIZE)
+    output = tmp_path / 'video.mp4'
+    RangeDownload(URL, output, connections=2, retries=2, session=RangeServer(data, failures=1)).run()
+    assert output.read_bytes() == data
+
+
+def test_resume_from_checkpoint_fetches_only_the_rest(tmp_path):
+    data = os.urandom(4 * MIN_PIECE_SIZE)
+    output = tmp_path / 'video.mp4'
+    half = MIN_PIECE_SIZE // 2
+    # An earlier run finished the first piece and half of the third
+    partial = bytearray(len(data))
+    partial[:MIN_PIECE_SIZE] = data[:MIN_PIECE_SIZE]
+    partial[2 * MIN_PIECE_SIZE:2 * MIN_PIECE_SIZE + half] = data[2 * MIN_PIECE_SIZE:2 * MIN_PIECE_SIZE + half]
+    output.write_bytes(bytes(partial))
+    pieces = [[i * MIN_PIECE_SIZE, (i + 1) * MIN_PIECE_SIZE, i * MIN_PIECE_SIZE] for i in range(4)]
+    pieces[0][2] = MIN_PIECE_SIZE
+    pieces[2][2] += half
+    checkpoint = RangeCheckpoint(tmp_path)
+    checkpoint.update(len(data), '"v1"', pieces)
+
+    server = RangeServer(data)
+    RangeDownload(URL, output, connections=4, session=server, checkpoint=checkpoint).run()
+    assert output.read_bytes() == data
+    assert sorted(start for start, _ in server.requested[1:]) == [
+        MIN_PIECE_SIZE, 2 * MIN_PIECE_SIZE + half, 3 * MIN_PIECE_SIZE]
+
+
+def test_resume_starts_over_when_the_file_changed(tmp_path):
+    data = os.urandom(2 * MIN_PIECE_SIZE)
+    output = tmp_path / 'video.mp4'
+    output.write_bytes(bytes(len(data)))
+    checkpoint = RangeCheckpoint(tmp_path)
+    checkpoint.update(len(data), '"v0"', [[0, MIN_PIECE_SIZE, MIN_PIECE_SIZE],
+                                          [MIN_PIECE_SIZE, 2 * MIN_PIECE_SIZE, MIN_PIECE_SIZE]])
+
+    server = RangeServer(data)
+    RangeDownload(URL, output, connections=2, session=server, checkpoint=checkpoint).run()
+    assert output.read_bytes() == data
+    assert 0 in [start for start, _ in server.requested[1:]]
+
+
+def test_file_changing_mid_download_fails(tmp_path):
+    data = os.urandom(2 * MIN_PIECE_SIZE)
+    server = RangeServer(data)
+    download = RangeDownload(URL, tmp_path / 'video.mp4', connections=2, retries=0, session=server)
+    download.probe()
+    server.etag = '"v2"'
+    with pytest.raises(RangeError):
+        download.run()
+    assert download.poll() == 1
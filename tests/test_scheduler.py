@@ -0,0 +1,127 @@
+"""DownloadScheduler per-host connection caps, queue order and resolving"""
+
+import threading
+
+import pytest
+
+from scheduler import DownloadScheduler
+
+TIMEOUT = 5
+
+
+class Recorder:
+    """Job function that records its start and blocks until released"""
+
+    def __init__(self):
+        self.started = []
+        self.granted = {}
+        self.release = {}
+        self.cond = threading.Condition()
+
+    def __call__(self, job_id, connections):
+        with self.cond:
+            self.started.append(job_id)
+            self.granted[job_id] = connections
+            self.cond.notify_all()
+        self.release[job_id].wait(TIMEOUT)
+
+    def submit(self, scheduler, job_id, url, **kwargs):
+        self.release[job_id] = threading.Event()
+        scheduler.submit(job_id, url, self, args=(job_id,), **kwargs)
+
+    def wait_started(self, count):
+        with self.cond:
+            assert self.cond.wait_for(lambda: len(self.started) >= count, TIMEOUT)
+
+    def finish(self, job_id):
+        self.release[job_id].set()
+
+
+def settle(scheduler):
+    """Wait until no idle worker could start another job"""
+    for _ in range(100):
+        with scheduler._lock:
+            if not scheduler._resolving:
+                return
+        threading.Event().wait(0.01)
+
+
+def test_per_host_cap():
+    scheduler = DownloadScheduler(workers=4, connections_per_host=4, connections_per_job=3)
+    jobs = Recorder()
+    jobs.submit(scheduler, 'a1', 'https://a.example/1')
+    jobs.submit(scheduler, 'a2', 'https://A.example/2')
+    jobs.submit(scheduler, 'a3', 'https://a.example/3')
+    jobs.submit(scheduler, 'b1', 'https://b.example/1')
+    jobs.wait_started(3)
+    settle(scheduler)
+    # a1 takes 3 of a.example's 4 connections, a2 gets the one left, a3 waits; b1 isn't held up
+    assert sorted(jobs.started) == ['a1', 'a2', 'b1']
+    assert jobs.granted == {'a1': 3, 'a2': 1, 'b1': 3}
+    assert scheduler.stats()['host_connections'] == {'a.example': 4, 'b.example': 3}
+    assert scheduler.position('a3') == 1
+
+    jobs.finish('a1')
+    jobs.wait_started(4)
+    assert jobs.started[-1] == 'a3'
+    assert jobs.granted['a3'] == 3
+    for job_id in jobs.release:
+        jobs.finish(job_id)
+
+
+@pytest.mark.parametrize('order, expected', [
+    ('fifo', ['low', 'high', 'mid']),
+    ('priority', ['high', 'mid', 'low']),
+])
+def test_queue_order(order, expected):
+    scheduler = DownloadScheduler(workers=1, order=order)
+    jobs = Recorder()
+    jobs.submit(scheduler, 'blocker', 'https://a.example/0')
+    jobs.wait_started(1)
+    jobs.submit(scheduler, 'low', 'https://a.example/1', priority=0)
+    jobs.submit(scheduler, 'high', 'https://a.example/2', priority=5)
+    jobs.submit(scheduler, 'mid', 'https://a.example/3', priority=1)
+    assert [scheduler.position(job_id) for job_id in expected] == [1, 2, 3]
+    for job_id in ['blocker'] + expected:
+        jobs.finish(job_id)
+    jobs.wait_started(4)
+    assert jobs.started[1:] == expected
+
+
+def test_cancel_queued_job():
+    scheduler = DownloadScheduler(workers=1)
+    jobs = Recorder()
+    jobs.submit(scheduler, 'blocker', 'https://a.example/0')
+    jobs.wait_started(1)
+    jobs.submit(scheduler, 'gone', 'https://a.example/1')
+    jobs.submit(scheduler, 'kept', 'https://a.example/2')
+    assert scheduler.cancel('gone') is True
+    assert scheduler.cancel('gone') is False
+    assert scheduler.position('kept') == 1
+    jobs.finish('blocker')
+    jobs.finish('kept')
+    jobs.wait_started(2)
+    assert jobs.started == ['blocker', 'kept']
+
+
+def test_resolve_rekeys_the_job_to_the_media_host():
+    scheduler = DownloadScheduler(workers=2, connections_per_host=2, connections_per_job=2)
+    jobs = Recorder()
+    jobs.submit(scheduler, 'cdn', 'https://cdn.example/video.mp4')
+    jobs.wait_started(1)
+    # The page is on another host, but its video is on the saturated CDN
+    resolved = threading.Event()
+
+    def resolve():
+        resolved.set()
+        return 'https://cdn.example/other.mp4'
+
+    jobs.submit(scheduler, 'page', 'https://site.example/watch', resolve=resolve)
+    assert resolved.wait(TIMEOUT)
+    settle(scheduler)
+    assert jobs.started == ['cdn']
+    assert scheduler.position('page') == 1
+    jobs.finish('cdn')
+    jobs.wait_started(2)
+    assert scheduler.stats()['host_connections'] == {'cdn.example': 2}
+    jobs.finish('page')
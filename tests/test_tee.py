@@ -0,0 +1,93 @@
+"""TeeRegistry: one origin fetch shared by readers, then handed to the download cache"""
+
+import threading
+
+from download_cache import DownloadCache
+from tee import TeeRegistry
+
+TIMEOUT = 5
+
+
+def gated(chunks, gate):
+    """Yield chunks, waiting for gate before the last one"""
+    for chunk in chunks[:-1]:
+        yield chunk
+    assert gate.wait(TIMEOUT)
+    yield chunks[-1]
+
+
+def test_readers_share_one_fetch_and_the_file_goes_to_the_cache(tmp_path):
+    registry = TeeRegistry(tmp_path)
+    cache = DownloadCache(tmp_path / 'cache')
+    chunks = [bytes([n]) * 1000 for n in range(5)]
+    gate = threading.Event()
+    seen_during_handoff = []
+
+    def keep(path):
+        # Still registered while the file moves, so a request now finds the tee
+        seen_during_handoff.append(registry.get('key'))
+        return cache.put(['key'], path)
+
+    tee, created = registry.start('key', gated(chunks, gate), lambda: True, keep)
+    assert created
+    joined, created = registry.start('key', iter(()), lambda: True, keep)
+    assert joined is tee and not created
+
+    bodies = []
+    readers = [threading.Thread(target=lambda: bodies.append(b''.join(tee.read()))) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    gate.set()
+    for reader in readers:
+        reader.join(TIMEOUT)
+
+    assert bodies == [b''.join(chunks)] * 3
+    assert seen_during_handoff == [tee]
+    assert tee.complete and tee.final_path == cache.get('key')
+    assert cache.get('key').read_bytes() == b''.join(chunks)
+    assert registry.get('key') is None
+    assert not tee.path.exists()
+    # A late reader of the finished tee reads the cached file
+    assert b''.join(tee.read()) == b''.join(chunks)
+
+
+def test_incomplete_fetch_is_not_cached(tmp_path):
+    registry = TeeRegistry(tmp_path)
+    handed_over = []
+    tee, _ = registry.start('key', iter([b'partial']), lambda: False, handed_over.append)
+    assert b''.join(tee.read()) in (b'', b'partial')
+    for _ in range(100):
+        if registry.get('key') is None:
+            break
+        threading.Event().wait(0.01)
+    assert registry.get('key') is None
+    assert tee.done and not tee.complete
+    assert handed_over == []
+    assert not tee.path.exists()
+
+
+def test_fetch_stops_when_every_reader_leaves(tmp_path):
+    registry = TeeRegistry(tmp_path)
+    gate = threading.Event()
+    produced = []
+
+    def endless():
+        n = 0
+        while True:
+            produced.append(n)
+            yield b'x' * 1000
+            n += 1
+            if n == 2:
+                assert gate.wait(TIMEOUT)
+
+    tee, _ = registry.start('key', endless(), lambda: True, lambda path: path)
+    body = tee.read()
+    next(body)
+    body.close()  # The only reader hangs up
+    gate.set()
+    for _ in range(100):
+        if tee.done:
+            break
+        threading.Event().wait(0.01)
+    assert tee.done and not tee.complete
+    assert len(produced) < 10
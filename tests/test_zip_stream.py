@@ -0,0 +1,124 @@
+"""ZipArchive output checked with zipfile, including ZIP64 layouts and Range slices"""
+
+import io
+import os
+import zipfile
+import zlib
+
+import pytest
+
+from zip_stream import ZIP64_LIMIT, ZipArchive, unique_names
+
+
+class ArchiveReader(io.RawIOBase):
+    """Seekable file over ZipArchive.iter_range, so zipfile can read huge archives without building them"""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.archive.size}[whence]
+        self.position = base + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        data = b''.join(self.archive.iter_range(self.position, self.position + len(buffer)))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def write_files(tmp_path, contents):
+    paths = []
+    for name, data in contents.items():
+        path = tmp_path / name
+        path.write_bytes(data)
+        paths.append(path)
+    return paths
+
+
+def sparse_file(path, size):
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    return path
+
+
+@pytest.fixture
+def small_archive(tmp_path):
+    contents = {'a.mp4': os.urandom(300_000), 'b.mp4': b'', 'c.mp4': os.urandom(1234)}
+    paths = write_files(tmp_path, contents)
+    names = ['a.mp4', 'b.mp4', 'vidéo.mp4']
+    return ZipArchive([(path, name, None) for path, name in zip(paths, names)]), contents, names
+
+
+def test_archive_opens_with_zipfile(small_archive):
+    archive, contents, names = small_archive
+    body = b''.join(archive.iter_range())
+    assert len(body) == archive.size
+    with zipfile.ZipFile(io.BytesIO(body)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == names
+        for name, data in zip(names, contents.values()):
+            assert zf.read(name) == data
+            assert zf.getinfo(name).compress_type == zipfile.ZIP_STORED
+    assert archive.crcs == [zlib.crc32(data) for data in contents.values()]
+
+
+@pytest.mark.parametrize('start, stop', [
+    (0, 1), (0, 30), (10, 300_100), (299_000, 310_000), (1, None), (-1, None),
+])
+def test_range_slice_equals_the_full_body(small_archive, start, stop):
+    archive, _, _ = small_archive
+    body = b''.join(archive.iter_range())
+    start = start % archive.size
+    stop = archive.size if stop is None else stop
+    assert b''.join(archive.iter_range(start, stop, chunk_size=4096)) == body[start:stop]
+
+
+def test_every_range_boundary(small_archive):
+    archive, _, _ = small_archive
+    body = b''.join(archive.iter_range())
+    # Slices starting and ending on each side of every part boundary
+    edges = sorted({offset + delta for offset, _, _ in archive._parts for delta in (-1, 0, 1)
+                    if 0 <= offset + delta <= archive.size})
+    for start, stop in zip(edges, edges[2:]):
+        assert b''.join(archive.iter_range(start, stop)) == body[start:stop]
+
+
+def test_etag_follows_the_contents(tmp_path):
+    path, = write_files(tmp_path, {'a.mp4': b'one'})
+    first = ZipArchive([(path, 'a.mp4', None)]).etag
+    assert ZipArchive([(path, 'a.mp4', None)]).etag == first
+    assert ZipArchive([(path, 'b.mp4', None)]).etag != first
+
+
+@pytest.mark.parametrize('size, zip64', [(ZIP64_LIMIT - 1, False), (ZIP64_LIMIT, True)])
+def test_zip64_boundary(tmp_path, size, zip64):
+    big = sparse_file(tmp_path / 'big.mp4', size)
+    small, = write_files(tmp_path, {'small.mp4': b'after the big one'})
+    # CRCs given, so the sparse file is never read in full
+    archive = ZipArchive([(big, 'big.mp4', 0), (small, 'small.mp4', None)])
+    header = b''.join(archive.iter_range(0, 30))
+    assert int.from_bytes(header[18:22], 'little') == (0xFFFFFFFF if zip64 else size)
+    with zipfile.ZipFile(ArchiveReader(archive)) as zf:
+        big_info, small_info = zf.infolist()
+        assert big_info.file_size == size
+        # The second entry starts past 4 GiB either way; its offset needs ZIP64 too
+        assert small_info.header_offset > ZIP64_LIMIT
+        assert zf.read('small.mp4') == b'after the big one'
+        with zf.open('big.mp4') as f:
+            assert f.read(16) == bytes(16)
+
+
+def test_unique_names():
+    assert unique_names(['a.mp4', 'a.mp4', 'b', 'b', 'a.mp4']) == ['a.mp4', 'a (2).mp4', 'b', 'b (2)', 'a (3).mp4']
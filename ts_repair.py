@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+MPEG-TS Repair
+Turns a downloaded .ts that won't copy-remux into an .mp4 without
+downloading it again, in tiers that each cost more than the last:
+
+  1. remux      copy-remux the whole file with timestamp/bitstream fixes
+  2. split      cut the file into keyframe-aligned pieces (no ffmpeg)
+  3. pieces     copy-remux each piece; re-encode only the pieces that fail,
+                several at a time (only for H.264/AAC sources, so re-encoded
+                pieces match the copied ones)
+  4. join       concatenate the pieces and copy-remux them to .mp4
+  5. transcode  last resort: re-encode the whole file
+
+Each stage's wall time goes into the `timings` dict passed in.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+TS_PACKET = 188
+PIECE_SIZE = 16 * 1024 * 1024  # Pieces end at the first keyframe past this size
+
+DEFAULT_PRESET = 'veryfast'
+DEFAULT_THREADS = 2  # ffmpeg threads per re-encoded piece
+
+# Regenerate missing timestamps, drop packets the demuxer flags as corrupt,
+# and move streams that start below zero back to zero
+REMUX_FIXES = ['-fflags', '+genpts+discardcorrupt', '-avoid_negative_ts', 'make_zero']
+
+# Errors after which ffmpeg may still exit 0 but the output is unusable;
+# anything else it logs (a damaged packet it skipped, say) isn't a failure
+FATAL_ERRORS = (
+    'Invalid data found when processing input',
+    'Conversion failed',
+    'Could not write header',
+    'Error muxing a packet',
+    'Error submitting a packet to the muxer',
+    'non monotonically increasing dts',
+)
+
+# Codecs the piece tier re-encodes to; other sources go straight to a full transcode
+PIECE_CODECS = {'video': 'h264', 'audio': 'aac'}
+
+
+class RepairError(Exception):
+    """Not even a full re-encode produced a playable file"""
+
+
+def _ffmpeg(args):
+    """Run ffmpeg quietly; returns (ok, error lines). Fails on a non-zero exit or a FATAL_ERRORS message."""
+    result = subprocess.run(['ffmpeg', '-v', 'error', '-nostdin', '-y'] + args,
+                            capture_output=True, text=True)
+    errors = [line for line in result.stderr.splitlines() if line.strip()]
+    fatal = any(marker in line for line in errors for marker in FATAL_ERRORS)
+    return result.returncode == 0 and not fatal, errors
+
+
+def stream_codecs(path):
+    """{codec_type: {codec_name, ...}} of a media file (from ffprobe), or None if it can't be read"""
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'stream=codec_type,codec_name',
+                                 '-of', 'json', str(path)], capture_output=True, text=True)
+        streams = json.loads(result.stdout or '{}').get('streams', [])
+    except (OSError, ValueError):
+        return None
+    if result.returncode != 0:
+        return None
+    codecs = {}
+    for stream in streams:
+        if stream.get('codec_name'):
+            codecs.setdefault(stream.get('codec_type'), set()).add(stream['codec_name'])
+    return codecs
+
+
+def pieces_repairable(path):
+    """Whether re-encoded pieces would match the copied ones (every audio/video stream is H.264/AAC)"""
+    codecs = stream_codecs(path)
+    return bool(codecs) and all(codecs.get(kind, set()) <= {codec} for kind, codec in PIECE_CODECS.items())
+
+
+def remux(source, target, fixes=True):
+    """Copy-remux source to .mp4 (no re-encode)"""
+    return _ffmpeg((REMUX_FIXES if fixes else []) + [
+        '-i', str(source), '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-movflags', '+faststart', str(target)])
+
+
+def remux_piece(source, target):
+    """Copy-remux one piece to .ts, keeping its original timestamps so pieces can be joined"""
+    # Same streams as transcode_piece keeps, so copied and re-encoded pieces join
+    return _ffmpeg(['-fflags', '+genpts', '-copyts', '-i', str(source),
+                    '-map', '0:v?', '-map', '0:a?', '-c', 'copy', '-mpegts_copyts', '1', '-f', 'mpegts', str(target)])
+
+
+def transcode_piece(source, target, preset=DEFAULT_PRESET, threads=DEFAULT_THREADS):
+    """Re-encode one piece to .ts (H.264/AAC), keeping its original timestamps"""
+    ok, errors = _ffmpeg(['-err_detect', 'ignore_err', '-copyts', '-i', str(source),
+                          '-map', '0:v?', '-map', '0:a?',
+                          '-c:v', 'libx264', '-preset', preset, '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+                          '-threads', str(threads), '-mpegts_copyts', '1', '-f', 'mpegts', str(target)])
+    # Decoding a damaged piece always logs errors; what matters is that a file came out
+    return target.exists() and target.stat().st_size > 0, errors
+
+
+def transcode(source, target, preset=DEFAULT_PRESET):
+    """Re-encode the whole file to .mp4 on all cores"""
+    ok, errors = _ffmpeg(['-err_detect', 'ignore_err', '-i', str(source),
+                          '-c:v', 'libx264', '-preset', preset, '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+                          '-movflags', '+faststart', str(target)])
+    return target.exists() and target.stat().st_size > 0, errors
+
+
+# --- Splitting ---
+
+def _sync(data, pos):
+    """First offset at or after pos where two TS packets in a row start"""
+    size = len(data)
+    while pos < size:
+        pos = data.find(b'\x47', pos, size)
+        if pos < 0:
+            return size
+        if pos + TS_PACKET >= size or data[pos + TS_PACKET] == 0x47:
+            return pos
+        pos += 1
+    return size
+
+
+def _pid(packet):
+    return ((packet[1] & 0x1f) << 8) | packet[2]
+
+
+def _payload(packet):
+    control = packet[3] & 0x30
+    if not control & 0x10:
+        return b''
+    return packet[5 + packet[4]:] if control & 0x20 else packet[4:]
+
+
+def _is_video_keyframe(packet):
+    """Start of a video PES that the muxer marked as a random access point"""
+    if not packet[1] & 0x40 or not packet[3] & 0x20 or packet[4] == 0 or not packet[5] & 0x40:
+        return False
+    payload = _payload(packet)
+    return len(payload) > 3 and payload[:3] == b'\x00\x00\x01' and 0xe0 <= payload[3] <= 0xef
+
+
+def _program_tables(data, limit=4096):
+    """The first PAT packet and the PMT packets it points to, from the start of the file"""
+    pat, pmts, pmt_pids = None, {}, set()
+    pos = _sync(data, 0)
+    for _ in range(limit):
+        if pos + TS_PACKET > len(data) or (pat and pmt_pids and pmt_pids <= set(pmts)):
+            break
+        packet = data[pos:pos + TS_PACKET]
+        pid = _pid(packet)
+        if pid == 0 and pat is None and packet[1] & 0x40:
+            pat = packet
+            section = _payload(packet)
+            section = section[1 + section[0]:]  # Skip the pointer field
+            length = ((section[1] & 0x0f) << 8) | section[2]
+            for i in range(8, min(3 + length - 4, len(section) - 3), 4):  # Program loop, minus the CRC
+                if (section[i] << 8) | section[i + 1]:  # Program 0 is the network PID
+                    pmt_pids.add(((section[i + 2] & 0x1f) << 8) | section[i + 3])
+        elif pid in pmt_pids and pid not in pmts and packet[1] & 0x40:
+            pmts[pid] = packet
+        pos = _sync(data, pos + TS_PACKET)
+    return (pat or b'') + b''.join(pmts.values())
+
+
+def split_ts(ts_path, out_dir, piece_size=PIECE_SIZE):
+    """
+    Cut a .ts into pieces that each start at a video keyframe; returns their paths
+
+    Every piece after the first gets the file's PAT/PMT in front, so
+    ffmpeg can read it on its own. A file without keyframe markers comes
+    back as one piece.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    pieces = []
+    if os.path.getsize(ts_path) == 0:
+        return pieces  # mmap can't map an empty file
+    with open(ts_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        tables = _program_tables(data)
+        size = len(data)
+        start = _sync(data, 0)
+        while start < size:
+            # Only the stretch past piece_size is scanned packet by packet
+            end = _sync(data, start + piece_size - (piece_size % TS_PACKET))
+            while end < size and not _is_video_keyframe(data[end:end + TS_PACKET]):
+                end = _sync(data, end + TS_PACKET)
+            path = out_dir / f'piece{len(pieces):05d}.ts'
+            with open(path, 'wb') as piece:
+                if pieces:
+                    piece.write(tables)
+                for offset in range(start, end, 1024 * 1024):
+                    piece.write(data[offset:min(offset + 1024 * 1024, end)])
+            pieces.append(path)
+            start = end
+    return pieces
+
+
+# --- Repair ---
+
+def _stage(timings, name, func, *args):
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        if timings is not None:
+            timings[name] = time.perf_counter() - started
+
+
+def _repair_pieces(pieces, preset, threads, jobs):
+    """Copy-remux each piece, re-encoding the ones that fail; returns (outputs, pieces re-encoded)"""
+    def fix(piece):
+        target = piece.with_suffix('.out.ts')
+        ok, errors = remux_piece(piece, target)
+        if ok:
+            return target, False
+        print(f"  {piece.name}: {errors[-1] if errors else 'remux failed'} - re-encoding")
+        target.unlink(missing_ok=True)
+        ok, errors = transcode_piece(piece, target, preset, threads)
+        if not ok:
+            raise RepairError(f"{piece.name}: {errors[-1] if errors else 're-encode failed'}")
+        return target, True
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(fix, pieces))
+    return [target for target, _ in results], sum(reencoded for _, reencoded in results)
+
+
+def _join(parts, target):
+    with open(target, 'wb') as joined:
+        for part in parts:
+            with open(part, 'rb') as f:
+                shutil.copyfileobj(f, joined, 1024 * 1024)
+
+
+def repair_ts(ts_path, output_path, preset=DEFAULT_PRESET, threads=DEFAULT_THREADS, jobs=None,
+              timings=None, piece_size=PIECE_SIZE):
+    """
+    Turn ts_path into the .mp4 output_path, re-encoding as little as possible
+
+    preset and threads apply to each re-encoded piece; jobs pieces are
+    re-encoded at once (default: enough to use every core). ts_path is
+    removed once the .mp4 exists.
+    """
+    ts_path, output_path = Path(ts_path), Path(output_path).with_suffix('.mp4')
+    jobs = jobs or max(1, (os.cpu_count() or 1) // max(threads, 1))
+    if ts_path.stat().st_size == 0:
+        raise RepairError('The downloaded file is empty')
+
+    ok, errors = _stage(timings, 'remux', remux, ts_path, output_path)
+    if ok:
+        ts_path.unlink()
+        return output_path
+    print(f"Remux with timestamp fixes failed ({errors[-1] if errors else 'unknown error'}), "
+          f"repairing piece by piece...")
+    output_path.unlink(missing_ok=True)
+
+    work_dir = output_path.parent / f'.{output_path.name}.repair'
+    try:
+        if pieces_repairable(ts_path):
+            pieces = _stage(timings, 'split', split_ts, ts_path, work_dir, piece_size)
+            try:
+                parts, reencoded = _stage(timings, 'pieces', _repair_pieces, pieces, preset, threads, jobs)
+                print(f"Re-encoded {reencoded} of {len(pieces)} pieces")
+                joined = work_dir / 'joined.ts'
+                _stage(timings, 'join', _join, parts, joined)
+                ok, errors = _stage(timings, 'join remux', remux, joined, output_path)
+            except RepairError as e:
+                ok, errors = False, [str(e)]
+            if not ok:
+                print(f"Piece repair failed ({errors[-1] if errors else 'unknown error'}), re-encoding everything...")
+        else:
+            # Re-encoded H.264/AAC pieces can't be joined with copied pieces in other codecs
+            ok = False
+            print("Not an H.264/AAC stream, re-encoding everything...")
+        if not ok:
+            output_path.unlink(missing_ok=True)
+            ok, errors = _stage(timings, 'transcode', transcode, ts_path, output_path, preset)
+            if not ok:
+                output_path.unlink(missing_ok=True)
+                raise RepairError(errors[-1] if errors else 'Re-encode failed')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    ts_path.unlink()
+    return output_path
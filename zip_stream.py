@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Streaming ZIP
+Stored (uncompressed) ZIP archives of files on disk, laid out in advance
+so any byte range of the archive can be produced with constant memory
+and no temporary archive
+"""
+
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+
+CHUNK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+CRC_CACHE_SIZE = 4096
+
+_crc_cache = {}  # (path, size, mtime_ns) -> CRC-32
+_crc_lock = threading.Lock()
+
+
+def file_crc32(path, chunk_size=CHUNK_SIZE):
+    """CRC-32 of a file, remembered while its size and mtime don't change"""
+    stat = os.stat(path)
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    with _crc_lock:
+        if key in _crc_cache:
+            return _crc_cache[key]
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    with _crc_lock:
+        if len(_crc_cache) >= CRC_CACHE_SIZE:
+            _crc_cache.pop(next(iter(_crc_cache)))
+        _crc_cache[key] = crc
+    return crc
+
+
+def _dos_time(timestamp):
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    if year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01, the earliest date ZIP can store
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+class ZipArchive:
+    """
+    A stored ZIP of entries (path, name in archive, crc32 or None)
+
+    Sizes and CRCs go in the local headers, so the whole layout - and the
+    archive's length - is known before the first byte is sent; that is
+    what makes Range requests possible. ZIP64 records are added only where
+    a size, offset or entry count needs them. Missing CRCs are computed
+    (one read of the file) and available afterwards in .crcs.
+    """
+
+    def __init__(self, entries):
+        self._parts = []  # (archive offset, length, bytes or (path, file offset))
+        self.size = 0
+        self.crcs = []
+        central = []
+        fingerprint = hashlib.sha1()
+        for path, name, crc in entries:
+            stat = os.stat(path)
+            if crc is None:
+                crc = file_crc32(path)
+            self.crcs.append(crc)
+            fingerprint.update(f'{name}\0{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0{crc}\n'.encode())
+            offset = self.size
+            local, record = self._headers(name, stat.st_size, stat.st_mtime, crc, offset)
+            self._add(local)
+            self._add((str(path), 0), stat.st_size)
+            central.append(record)
+        self._add_end(central)
+        self.etag = fingerprint.hexdigest()
+
+    def _add(self, data, length=None):
+        length = len(data) if length is None else length
+        if length:
+            self._parts.append((self.size, length, data))
+            self.size += length
+
+    def _headers(self, name, size, mtime, crc, offset):
+        """Local file header and central directory record for one entry"""
+        encoded = name.encode('utf-8')
+        flags = 0 if encoded.isascii() else 0x800  # Bit 11: name is UTF-8
+        dos_time, dos_date = _dos_time(mtime)
+        zip64 = size >= ZIP64_LIMIT
+        version = 45 if zip64 or offset >= ZIP64_LIMIT else 20
+
+        local_extra = struct.pack('<HHQQ', 1, 16, size, size) if zip64 else b''
+        stored_size = ZIP64_LIMIT if zip64 else size
+        local = struct.pack('<IHHHHHIIIHH', 0x04034b50, version, flags, 0, dos_time, dos_date,
+                            crc, stored_size, stored_size, len(encoded), len(local_extra))
+
+        # The central record's ZIP64 extra holds only the fields that overflow, in this order
+        fields = [size, size] if zip64 else []
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+        central_extra = struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b''
+        record = struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, flags, 0,
+                             dos_time, dos_date, crc, stored_size, stored_size, len(encoded),
+                             len(central_extra), 0, 0, 0, 0o100644 << 16, min(offset, ZIP64_LIMIT))
+        return local + encoded + local_extra, record + encoded + central_extra
+
+    def _add_end(self, central):
+        start = self.size
+        for record in central:
+            self._add(record)
+        length = self.size - start
+        count = len(central)
+        if count >= 0xFFFF or start >= ZIP64_LIMIT or length >= ZIP64_LIMIT:
+            end64 = self.size
+            self._add(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, length, start))
+            self._add(struct.pack('<IIQI', 0x07064b50, 0, end64, 1))
+        self._add(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                              min(length, ZIP64_LIMIT), min(start, ZIP64_LIMIT), 0))
+
+    def iter_range(self, start=0, stop=None, chunk_size=CHUNK_SIZE):
+        """Yield the archive's bytes [start, stop)"""
+        stop = self.size if stop is None else min(stop, self.size)
+        for offset, length, data in self._parts:
+            if offset + length <= start:
+                continue
+            if offset >= stop:
+                break
+            begin = max(start - offset, 0)
+            end = min(stop - offset, length)
+            if isinstance(data, bytes):
+                yield data[begin:end]
+                continue
+            path, file_offset = data
+            with open(path, 'rb') as f:
+                f.seek(file_offset + begin)
+                remaining = end - begin
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise IOError(f'{path} shrank while being sent')
+                    remaining -= len(chunk)
+                    yield chunk
+
+
+def unique_names(names):
+    """Make archive names unique by numbering repeats ('a.mp4', 'a (2).mp4')"""
+    seen = {}
+    result = []
+    for name in names:
+        count = seen.get(name, 0) + 1
+        seen[name] = count
+        if count > 1:
+            stem, dot, ext = name.rpartition('.')
+            name = f'{stem} ({count}).{ext}' if dot else f'{name} ({count})'
+        result.append(name)
+    return result